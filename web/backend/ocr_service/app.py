@@ -4,12 +4,47 @@ Usa PP-StructureV3 para entender la estructura de documentos.
 """
 import os
 import base64
+import contextvars
+import hashlib
 import io
-from flask import Flask, request, jsonify
+import json
+import mmap
+import logging
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+from html.parser import HTMLParser
+from flask import Flask, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from PIL import Image, ImageEnhance, ImageFilter
 import numpy as np
 import cv2
+from ocr_store import OcrStore
+from engine_pool import EnginePool, PoolTimeout
+from engine_registry import EngineRegistry
+from batcher import MicroBatcher
+from metrics import metrics, RequestStages
+from extraction import (extract_invoice_data_from_structure, normalize_structure_data, build_invoice_data,
+                        build_ocr_text, reextract_from_record, json_safe, OCR_ROW_RECONSTRUCTION)
+import segmentation
+from structure_profile import StructureProfile
+from idle_unloader import IdleUnloader
+from coalescer import InflightCoalescer, CoalesceTimeout
+import tiling
+from deadline import Deadline, DeadlineExceeded
+from scheduler import PriorityScheduler, PRIORITY_CLASSES, INTERACTIVE
+from jobs import JobStore, PENDING
+from quality import QualityGate, ImageQualityError
+import memstats
+import profiling
+from logs import setup_logging, request_id_var
+from profiling import Profiler, ProfilerBusy
+
+setup_logging()
+logger = logging.getLogger('ocr.app')
 
 try:
     from paddleocr import PaddleOCR
@@ -18,88 +53,287 @@ try:
     try:
         from paddleocr import PPStructureV3
         PPSTRUCTURE_AVAILABLE = True
-        print("✅ PaddleOCR y PPStructureV3 importados correctamente")
+        logger.info("✅ PaddleOCR y PPStructureV3 importados correctamente")
     except ImportError:
         # Intentar con el nombre antiguo
         try:
             from paddleocr import PPStructure
             PPSTRUCTURE_AVAILABLE = True
             PPStructureV3 = PPStructure  # Alias para compatibilidad
-            print("✅ PaddleOCR y PPStructure importados correctamente")
+            logger.info("✅ PaddleOCR y PPStructure importados correctamente")
         except ImportError:
             PPSTRUCTURE_AVAILABLE = False
-            print("✅ PaddleOCR importado correctamente (PPStructure no disponible)")
+            logger.info("✅ PaddleOCR importado correctamente (PPStructure no disponible)")
 except ImportError as e:
     PADDLEOCR_AVAILABLE = False
     PPSTRUCTURE_AVAILABLE = False
-    print(f"⚠️  PaddleOCR no está instalado. Error: {e}")
-    print("   Ejecuta: pip install -r requirements.txt")
+    logger.warning("⚠️ PaddleOCR no está instalado (%s). Ejecuta: pip install -r requirements.txt", e)
 except Exception as e:
     PADDLEOCR_AVAILABLE = False
     PPSTRUCTURE_AVAILABLE = False
-    print(f"⚠️  Error importando PaddleOCR: {e}")
-    print("   Ejecuta: pip install -r requirements.txt")
+    logger.warning("⚠️ Error importando PaddleOCR (%s). Ejecuta: pip install -r requirements.txt", e)
+
+# orjson (en requirements.txt) serializa respuestas grandes bastante más rápido que json;
+# json queda solo como respaldo si falta en la instalación
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.warning("⚠️ orjson no está instalado: las respuestas se serializan con json (más lento)")
 
 app = Flask(__name__)
 CORS(app)
 
-# Inicializar PaddleOCR (lazy loading)
-ocr_engine = None
-structure_engine = None
+# Directorio compartido con el backend Node.js cuando ambos corren en el mismo host.
+# Si está configurado, /ocr/process acepta {"imagePath": "..."} (relativo a este
+# directorio) y lee el archivo con mmap en lugar de recibirlo en base64.
+OCR_SPOOL_DIR = os.environ.get('OCR_SPOOL_DIR')
+
+class SpoolPathError(ValueError):
+    """Ruta de spool inválida o fuera del directorio configurado"""
+
+class ImageDecodeError(ValueError):
+    """Los bytes recibidos no son una imagen que PIL pueda decodificar"""
+
+# Campos de invoice_data que se pueden pedir con fields=...
+# Por defecto se devuelve la versión compacta (sin structure ni tables);
+# fields=all devuelve todos los campos
+INVOICE_FIELDS = ('establishment', 'date', 'total', 'subtotal', 'tax', 'taxRate',
+                  'rawText', 'confidence', 'structure', 'tables', 'rows')
+DEFAULT_FIELDS = ('establishment', 'date', 'total', 'subtotal', 'tax', 'taxRate',
+                  'rawText', 'confidence')
+
+class FieldSelectionError(ValueError):
+    """Parámetro fields con campos desconocidos"""
+
+# Cuándo ejecutar PP-StructureV3: 'always' (por defecto), 'never' o 'auto'
+# ('auto' lo omite si el texto OCR ya proporciona todos los campos clave)
+OCR_STRUCTURE_MODE = os.environ.get('OCR_STRUCTURE_MODE', 'always').lower()
+STRUCTURE_KEY_FIELDS = ('establishment', 'date', 'total', 'subtotal', 'tax')
+
+# Presupuesto de tiempo por defecto de cada petición en ms (0 = sin límite).
+# El cliente puede indicar otro con la cabecera X-OCR-Deadline-Ms o el parámetro deadlineMs
+OCR_DEFAULT_DEADLINE_MS = float(os.environ.get('OCR_DEFAULT_DEADLINE_MS', '0'))
+
+# Almacén opcional de la salida bruta del OCR (por hash de imagen) para re-extracción
+OCR_STORE_DIR = os.environ.get('OCR_STORE_DIR')
+ocr_store = OcrStore(OCR_STORE_DIR) if OCR_STORE_DIR else None
+
+# Control de calidad previo a la inferencia (ver quality.py). Las peticiones pueden
+# saltárselo con skipQualityCheck=true
+OCR_QUALITY_GATE = os.environ.get('OCR_QUALITY_GATE', '1').lower() in ('1', 'true', 'yes')
+quality_gate = QualityGate(
+    min_sharpness=float(os.environ.get('OCR_QUALITY_MIN_SHARPNESS', '30')),
+    min_brightness=float(os.environ.get('OCR_QUALITY_MIN_BRIGHTNESS', '40')),
+    max_brightness=float(os.environ.get('OCR_QUALITY_MAX_BRIGHTNESS', '250')),
+    min_contrast=float(os.environ.get('OCR_QUALITY_MIN_CONTRAST', '60')),
+    min_edge_density=float(os.environ.get('OCR_QUALITY_MIN_EDGE_DENSITY', '0.002')),
+) if OCR_QUALITY_GATE else None
+
+# Pools de motores (lazy loading). Cada hilo de Flask toma una instancia en exclusiva;
+# Paddle libera el GIL durante la inferencia, así que varias instancias trabajan en paralelo
+OCR_POOL_SIZE = int(os.environ.get('OCR_POOL_SIZE', '1'))
+OCR_STRUCTURE_POOL_SIZE = int(os.environ.get('OCR_STRUCTURE_POOL_SIZE', str(OCR_POOL_SIZE)))
+# Segundos máximos esperando una instancia libre (vacío = esperar indefinidamente)
+OCR_POOL_TIMEOUT = float(os.environ['OCR_POOL_TIMEOUT']) if os.environ.get('OCR_POOL_TIMEOUT') else None
+
+# Idiomas: cada uno con su propio modelo, cargado la primera vez que se pide (parámetro lang).
+# El idioma por defecto siempre está cargado; el resto se descarga en orden LRU al superar
+# OCR_MAX_MODELS u OCR_MODEL_MEMORY_MB, o tras OCR_MODEL_IDLE_SECONDS sin uso
+OCR_LANG = os.environ.get('OCR_LANG', 'es')
+OCR_LANGS = tuple(lang.strip() for lang in os.environ.get('OCR_LANGS', 'es,ca,pt,fr,en').split(',') if lang.strip())
+if OCR_LANG not in OCR_LANGS:
+    OCR_LANGS = (OCR_LANG,) + OCR_LANGS
+OCR_MAX_MODELS = int(os.environ.get('OCR_MAX_MODELS', '3'))
+OCR_MODEL_MEMORY_MB = float(os.environ.get('OCR_MODEL_MEMORY_MB', '0'))
+OCR_MODEL_IDLE_SECONDS = float(os.environ.get('OCR_MODEL_IDLE_SECONDS', '900'))
+
+# Micro-batching: peticiones simultáneas se agrupan en una sola llamada a predict()
+# hasta OCR_BATCH_MAX_SIZE imágenes u OCR_BATCH_MAX_WAIT_MS de espera (1 = desactivado)
+OCR_BATCH_MAX_SIZE = int(os.environ.get('OCR_BATCH_MAX_SIZE', '1'))
+OCR_BATCH_MAX_WAIT_MS = float(os.environ.get('OCR_BATCH_MAX_WAIT_MS', '10'))
+
+# Contabilidad de memoria por petición y etapa (RSS; tracemalloc si está activo).
+# OCR_TRACEMALLOC activa además tracemalloc al arrancar (coste notable de CPU)
+OCR_MEMORY_TRACKING = os.environ.get('OCR_MEMORY_TRACKING', '').lower() in ('1', 'true', 'yes')
+if os.environ.get('OCR_TRACEMALLOC', '').lower() in ('1', 'true', 'yes'):
+    memstats.start_tracing()
+
+# Planificación por prioridad: OCR_SCHEDULER_SLOTS peticiones en inferencia a la vez;
+# las interactivas van primero y bulk recibe al menos OCR_BULK_SHARE de los huecos
+OCR_SCHEDULER_SLOTS = int(os.environ.get('OCR_SCHEDULER_SLOTS', str(OCR_POOL_SIZE * max(1, OCR_BATCH_MAX_SIZE))))
+OCR_BULK_SHARE = float(os.environ.get('OCR_BULK_SHARE', '0.2'))
+scheduler = PriorityScheduler(OCR_SCHEDULER_SLOTS, OCR_BULK_SHARE)
+
+# Segmentación de varios tickets en una foto (parámetro segment=true): área mínima de cada
+# ticket como fracción de la imagen y número máximo de tickets por foto
+OCR_SEGMENT_MIN_AREA = float(os.environ.get('OCR_SEGMENT_MIN_AREA', '0.02'))
+OCR_SEGMENT_MAX_DOCUMENTS = int(os.environ.get('OCR_SEGMENT_MAX_DOCUMENTS', '8'))
+
+# Submódulos de PP-StructureV3 que se cargan (ver structure_profile.py): por defecto solo
+# tablas; 'default' mantiene la tubería completa de PPStructureV3()
+OCR_STRUCTURE_MODULES = os.environ.get('OCR_STRUCTURE_MODULES', 'table')
+structure_profile = StructureProfile(OCR_STRUCTURE_MODULES)
+
+# Descarga de motores ociosos: PP-StructureV3 (y con OCR_UNLOAD_OCR también el OCR del
+# idioma por defecto) se descarga tras OCR_UNLOAD_IDLE_SECONDS sin uso o cuando el RSS supera
+# OCR_UNLOAD_RSS_MB; la siguiente petición lo vuelve a cargar. 0 desactiva cada política
+OCR_UNLOAD_IDLE_SECONDS = float(os.environ.get('OCR_UNLOAD_IDLE_SECONDS', '0'))
+OCR_UNLOAD_RSS_MB = float(os.environ.get('OCR_UNLOAD_RSS_MB', '0'))
+OCR_UNLOAD_OCR = os.environ.get('OCR_UNLOAD_OCR', '').lower() in ('1', 'true', 'yes')
+OCR_UNLOAD_CHECK_SECONDS = float(os.environ.get('OCR_UNLOAD_CHECK_SECONDS', '30'))
+engine_unloader = IdleUnloader(OCR_UNLOAD_IDLE_SECONDS, OCR_UNLOAD_RSS_MB, OCR_UNLOAD_CHECK_SECONDS)
+
+# Peticiones idénticas en vuelo (misma imagen y mismos parámetros) comparten una sola
+# inferencia. Si la primera agota su presupuesto o no obtiene motor, las demás lo reintentan
+OCR_COALESCE = os.environ.get('OCR_COALESCE', '1').lower() in ('1', 'true', 'yes')
+inflight = InflightCoalescer('ocr', retry_on=(DeadlineExceeded, PoolTimeout))
+
+# Tickets muy largos: las imágenes al menos OCR_TILE_MIN_ASPECT veces más altas que anchas
+# se reconocen en franjas de OCR_TILE_ASPECT x ancho con un solapamiento de OCR_TILE_OVERLAP
+OCR_TILING = os.environ.get('OCR_TILING', '1').lower() in ('1', 'true', 'yes')
+OCR_TILE_MIN_ASPECT = float(os.environ.get('OCR_TILE_MIN_ASPECT', '3.0'))
+OCR_TILE_ASPECT = float(os.environ.get('OCR_TILE_ASPECT', '1.5'))
+OCR_TILE_OVERLAP = float(os.environ.get('OCR_TILE_OVERLAP', '0.2'))
+
+# Modo progresivo: los campos del OCR se devuelven al momento y PP-StructureV3 sigue en
+# segundo plano. Los resultados se conservan OCR_JOB_TTL_SECONDS tras terminar
+OCR_JOB_TTL_SECONDS = float(os.environ.get('OCR_JOB_TTL_SECONDS', '600'))
+# Tiempo máximo que un flujo SSE espera a la fase de estructura antes de cerrarse
+OCR_SSE_WAIT_SECONDS = float(os.environ.get('OCR_SSE_WAIT_SECONDS', '120'))
+# Trabajos de estructura pendientes como máximo (cada uno retiene la imagen decodificada).
+# Con la cola llena, la primera respuesta es definitiva y lleva "skipped": ["structure"]
+OCR_STRUCTURE_MAX_PENDING = int(os.environ.get('OCR_STRUCTURE_MAX_PENDING', '16'))
+jobs = JobStore(OCR_JOB_TTL_SECONDS)
+
+# Perfilado bajo demanda: solo si OCR_PROFILE_TOKEN está configurado y la petición lo envía en
+# la cabecera X-OCR-Profile. Se guardan como mucho OCR_PROFILE_MAX_FILES perfiles en OCR_PROFILE_DIR
+OCR_PROFILE_TOKEN = os.environ.get('OCR_PROFILE_TOKEN')
+OCR_PROFILE_DIR = os.environ.get('OCR_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+OCR_PROFILE_MAX_FILES = int(os.environ.get('OCR_PROFILE_MAX_FILES', '20'))
+profiler = Profiler(OCR_PROFILE_TOKEN, OCR_PROFILE_DIR, OCR_PROFILE_MAX_FILES)
+structure_executor = ThreadPoolExecutor(max_workers=max(1, OCR_STRUCTURE_POOL_SIZE),
+                                        thread_name_prefix='structure')
+_structure_pending = 0
+_structure_pending_lock = threading.Lock()
+
+ocr_registry = None
+structure_pool = None
+ocr_batcher = None
+_init_lock = threading.Lock()
+_init_done = False
+
+def _create_ocr_engine(lang=OCR_LANG):
+    logger.info(f"🔄 Inicializando PaddleOCR ({lang})...")
+    # PP-OCRv5 para reconocimiento de texto
+    try:
+        # Intentar con parámetros mínimos primero (más compatible)
+        engine = PaddleOCR(lang=lang)
+        engine_unloader.record_load(f'ocr.{lang}')
+        logger.info("✅ PaddleOCR inicializado")
+        return engine
+    except Exception as e:
+        logger.warning(f"⚠️ Error inicializando PaddleOCR: {e}")
+        raise
+
+def _create_structure_engine():
+    logger.info("🔄 Inicializando PP-StructureV3...")
+    # PP-StructureV3 para parsing de estructura de documentos
+    # Solo se cargan los submódulos de OCR_STRUCTURE_MODULES
+    # Requiere: pip install "paddlex[ocr]"
+    try:
+        engine = PPStructureV3(**structure_profile.init_kwargs())
+    except TypeError as e:
+        # Versiones antiguas (PPStructure) no admiten los flags use_*
+        logger.warning("⚠️ PP-StructureV3 no admite OCR_STRUCTURE_MODULES (%s), se usa la configuración por defecto", e)
+        structure_profile.fall_back()
+        engine = PPStructureV3()
+    metrics.incr('models.structure.loaded')
+    engine_unloader.record_load('structure')
+    if structure_profile.default:
+        logger.info("✅ PP-StructureV3 inicializado correctamente (configuración por defecto)")
+    else:
+        logger.info("✅ PP-StructureV3 inicializado correctamente (submódulos: %s)",
+                    ', '.join(sorted(structure_profile.modules)) or 'ninguno')
+    return engine
+
+def _run_ocr_batch(images):
+    """Ejecuta un lote de imágenes del idioma por defecto (usado por el micro-batcher)"""
+    with ocr_registry.checkout(OCR_LANG) as ocr:
+        return run_ocr_batch(ocr, images)
 
 def init_ocr():
-    """Inicializa los motores de OCR y estructura"""
-    global ocr_engine, structure_engine
+    """
+    Inicializa los pools de OCR y estructura (una sola vez, aunque lleguen
+    varias peticiones a la vez). Devuelve (ocr_registry, structure_pool o None)
+    """
+    global ocr_registry, structure_pool, ocr_batcher, _init_done
     
     if not PADDLEOCR_AVAILABLE:
         raise RuntimeError("PaddleOCR no está disponible")
     
-    if ocr_engine is None:
-        print("🔄 Inicializando PaddleOCR...")
-        # PP-OCRv5 para reconocimiento de texto
-        try:
-            # Intentar con parámetros mínimos primero (más compatible)
-            ocr_engine = PaddleOCR(lang='es')
-            print("✅ PaddleOCR inicializado")
-        except Exception as e:
-            print(f"⚠️ Error inicializando PaddleOCR: {e}")
-            raise
+    if _init_done:
+        return ocr_registry, structure_pool
     
-    if structure_engine is None and PPSTRUCTURE_AVAILABLE:
-        print("🔄 Inicializando PP-StructureV3...")
-        # PP-StructureV3 para parsing de estructura de documentos
-        try:
-            # PP-StructureV3 se inicializa sin parámetros
-            # Requiere: pip install "paddlex[ocr]"
-            structure_engine = PPStructureV3()
-            print("✅ PP-StructureV3 inicializado correctamente")
-        except Exception as e:
-            error_msg = str(e)
-            print(f"❌ Error inicializando PP-StructureV3: {error_msg}")
-            
-            # Verificar si es un error de dependencias
-            if 'dependency' in error_msg.lower() or 'DependencyError' in error_msg:
-                print(f"💡 ERROR DE DEPENDENCIAS DETECTADO")
-                print(f"💡 Solución: Instala las dependencias adicionales:")
-                print(f"   pip install \"paddlex[ocr]\"")
-                print(f"   O ejecuta: pip install --upgrade paddleocr \"paddlex[ocr]\"")
-            else:
-                print(f"💡 Detalles del error:")
-                import traceback
-                traceback.print_exc()
-            
-            structure_engine = None  # Continuar sin estructura si falla
-    elif not PPSTRUCTURE_AVAILABLE:
-        print("ℹ️ PP-StructureV3 no disponible, usando solo OCR")
-        structure_engine = None
+    with _init_lock:
+        if _init_done:
+            return ocr_registry, structure_pool
+        
+        registry = EngineRegistry('ocr', _create_ocr_engine, OCR_LANGS, OCR_LANG, OCR_POOL_SIZE,
+                                  OCR_POOL_TIMEOUT, max_models=OCR_MAX_MODELS,
+                                  memory_budget_mb=OCR_MODEL_MEMORY_MB,
+                                  idle_seconds=OCR_MODEL_IDLE_SECONDS)
+        # La primera instancia del idioma por defecto se carga ya; el resto bajo demanda
+        registry.preload(OCR_LANG, 1)
+        ocr_registry = registry
+        
+        if OCR_BATCH_MAX_SIZE > 1:
+            # Un lote en vuelo por instancia del pool (solo el idioma por defecto se agrupa)
+            ocr_batcher = MicroBatcher('ocr', _run_ocr_batch, OCR_BATCH_MAX_SIZE,
+                                       OCR_BATCH_MAX_WAIT_MS, workers=OCR_POOL_SIZE)
+        
+        if PPSTRUCTURE_AVAILABLE:
+            pool = EnginePool('structure', _create_structure_engine, OCR_STRUCTURE_POOL_SIZE, OCR_POOL_TIMEOUT)
+            try:
+                pool.preload(1)
+                structure_pool = pool
+            except Exception as e:
+                error_msg = str(e)
+                # Verificar si es un error de dependencias
+                if 'dependency' in error_msg.lower() or 'DependencyError' in error_msg:
+                    logger.error("❌ Error inicializando PP-StructureV3: %s. Faltan dependencias: "
+                                 "pip install \"paddlex[ocr]\" (o pip install --upgrade paddleocr "
+                                 "\"paddlex[ocr]\")", error_msg)
+                else:
+                    logger.error("❌ Error inicializando PP-StructureV3: %s", error_msg, exc_info=True)
+                
+                structure_pool = None  # Continuar sin estructura si falla
+        else:
+            logger.info("ℹ️ PP-StructureV3 no disponible, usando solo OCR")
+            structure_pool = None
+        
+        # Orden de descarga bajo presión de memoria: primero la estructura, luego el OCR
+        if structure_pool is not None:
+            engine_unloader.add('structure', structure_pool.idle_time, structure_pool.unload,
+                                lambda: structure_pool.stats()['created'])
+        if OCR_UNLOAD_OCR:
+            engine_unloader.add(f'ocr.{OCR_LANG}', lambda: registry.idle_time(OCR_LANG),
+                                lambda: registry.unload(OCR_LANG), lambda: registry.instances(OCR_LANG))
+        # Sin esto los idiomas ociosos solo se desalojarían al terminar otra petición
+        engine_unloader.add_task(registry.evict)
+        engine_unloader.start()
+        
+        _init_done = True
     
-    return ocr_engine, structure_engine
+    return ocr_registry, structure_pool
 
-def preprocess_image(image):
+def preprocess_image(image, check_quality=True):
     """
     Preprocesa la imagen para mejorar el reconocimiento OCR
     SIMPLIFICADO: No hacer preprocesamiento agresivo que pueda empeorar la imagen
     PaddleOCR funciona mejor con imágenes originales
+    Con check_quality (y OCR_QUALITY_GATE activo) lanza ImageQualityError si la imagen
+    es claramente inutilizable (desenfocada, oscura, quemada o sin texto)
     """
     # Solo redimensionar si es muy pequeña (menos de 50px en cualquier dimensión)
     h, w = image.shape[:2]
@@ -107,7 +341,7 @@ def preprocess_image(image):
         scale = max(50 / h, 50 / w)
         new_h, new_w = int(h * scale), int(w * scale)
         image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
-        print(f"📏 Imagen redimensionada de {w}x{h} a {new_w}x{new_h}")
+        logger.debug(f"📏 Imagen redimensionada de {w}x{h} a {new_w}x{new_h}")
     
     # Asegurar que la imagen esté en RGB (PaddleOCR espera RGB)
     if len(image.shape) == 2:
@@ -120,745 +354,1214 @@ def preprocess_image(image):
         # Ya está en RGB, no hacer nada
         pass
     
+    # Rechazar en milisegundos lo que el OCR no va a poder leer
+    if check_quality and quality_gate is not None:
+        quality_gate.check(image)
+    
     # NO hacer más preprocesamiento - PaddleOCR funciona mejor con imágenes originales
     return image
 
-def image_from_base64(base64_string):
-    """Convierte base64 a imagen y la preprocesa"""
+def image_from_buffer(buffer, check_quality=True):
+    """
+    Decodifica la imagen desde bytes o un archivo mapeado y la preprocesa.
+    Devuelve (imagen, hash SHA-256 de los bytes originales)
+    """
+    image_hash = hashlib.sha256(buffer).hexdigest()
+    try:
+        image = Image.open(io.BytesIO(buffer) if isinstance(buffer, bytes) else buffer)
+        
+        # Convertir a RGB si es necesario
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # Convertir a numpy array (PIL decodifica aquí: un archivo truncado falla en este punto)
+        image_array = np.array(image)
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        # Entrada no válida, no un fallo del servicio (p. ej. "seek out of range" al leer del mmap)
+        raise ImageDecodeError(f'No se pudo decodificar la imagen: {e}') from e
+    
+    # Preprocesar la imagen para mejorar OCR
+    processed_image = preprocess_image(image_array, check_quality)
+    
+    return processed_image, image_hash
+
+def image_from_base64(base64_string, check_quality=True):
+    """Convierte base64 a imagen y la preprocesa. Devuelve (imagen, hash)"""
     if ',' in base64_string:
         base64_string = base64_string.split(',')[1]
     
     image_data = base64.b64decode(base64_string)
-    image = Image.open(io.BytesIO(image_data))
-    
-    # Convertir a RGB si es necesario
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # Convertir a numpy array
-    image_array = np.array(image)
-    
-    # Preprocesar la imagen para mejorar OCR
-    processed_image = preprocess_image(image_array)
+    return image_from_buffer(image_data, check_quality)
+
+def resolve_spool_path(relative_path):
+    """
+    Valida una ruta recibida del backend contra OCR_SPOOL_DIR.
+    Solo se aceptan archivos regulares dentro del directorio (sin escapar con ../ ni symlinks)
+    """
+    if not OCR_SPOOL_DIR:
+        raise SpoolPathError('El servicio no tiene configurado OCR_SPOOL_DIR')
+    if not isinstance(relative_path, str) or not relative_path:
+        raise SpoolPathError('imagePath debe ser una ruta no vacía')
     
-    return processed_image
+    root = os.path.realpath(OCR_SPOOL_DIR)
+    candidate = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.commonpath([root, candidate]) != root:
+        raise SpoolPathError(f'Ruta fuera del directorio spool: {relative_path}')
+    if not os.path.isfile(candidate):
+        raise SpoolPathError(f'Archivo no encontrado en spool: {relative_path}')
+    return candidate
 
-def extract_invoice_data_from_structure(structure_result):
+def image_from_spool(relative_path, check_quality=True):
     """
-    Extrae datos de factura de la estructura parseada por PP-StructureV3
-    El resultado de predict() es una lista de LayoutParsingResultV2
+    Lee la imagen del directorio spool con mmap: PIL decodifica directamente
+    desde las páginas mapeadas, sin pasar por base64 ni copias intermedias.
+    Devuelve (imagen, hash)
     """
-    invoice_data = {
-        'establishment': None,
-        'date': None,
-        'total': None,
-        'subtotal': None,
-        'tax': None,
-        'taxRate': None,
-        'rawText': '',
-        'structure': {},
-        'tables': []
-    }
+    path = resolve_spool_path(relative_path)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ImageDecodeError(f'Archivo vacío en spool: {relative_path}')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return image_from_buffer(mapped, check_quality)
+
+def run_ocr(ocr, image_input):
+    """
+    Ejecuta el motor OCR con la API disponible.
+    La nueva API usa predict() en lugar de ocr(); predict() NO acepta el parámetro cls
+    """
+    if hasattr(ocr, 'predict'):
+        logger.debug("📝 Usando predict() (API nueva)")
+        ocr_result = ocr.predict(image_input)
+        logger.debug(f"✅ OCR completado con predict(), resultado tipo: {type(ocr_result)}")
+    else:
+        # Fallback a la API antigua si predict() no existe
+        logger.debug("📝 Usando ocr() (API antigua)")
+        try:
+            ocr_result = ocr.ocr(image_input, cls=True)
+            logger.debug(f"✅ OCR completado (con cls), resultado tipo: {type(ocr_result)}")
+        except TypeError:
+            ocr_result = ocr.ocr(image_input)
+            logger.debug(f"✅ OCR completado (sin cls), resultado tipo: {type(ocr_result)}")
+    return ocr_result
+
+def run_ocr_batch(ocr, images):
+    """
+    Ejecuta el OCR sobre varias imágenes en una sola llamada cuando la API lo permite.
+    Devuelve un resultado por imagen, con el mismo formato que run_ocr()
+    """
+    if len(images) == 1:
+        return [run_ocr(ocr, images[0])]
+    if hasattr(ocr, 'predict'):
+        # predict() con una lista devuelve un resultado (página) por imagen, en orden
+        return [[page_result] for page_result in run_ocr(ocr, images)]
+    # La API antigua no acepta lotes
+    return [run_ocr(ocr, image) for image in images]
+
+def _box_from_points(points):
+    """Convierte un polígono [[x, y], ...] o una caja [x1, y1, x2, y2] a caja alineada a los ejes"""
+    try:
+        coords = np.asarray(points, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    if coords.ndim == 1 and coords.size == 4:
+        return [int(round(float(v))) for v in coords]
+    if coords.ndim == 2 and coords.shape[1] == 2 and len(coords) > 0:
+        x_min, y_min = coords.min(axis=0)
+        x_max, y_max = coords.max(axis=0)
+        return [int(round(float(x_min))), int(round(float(y_min))), int(round(float(x_max))), int(round(float(y_max)))]
+    return None
+
+def extract_ocr_lines(ocr_result):
+    """
+    Normaliza el resultado de ocr.predict()/ocr.ocr() a una lista de líneas
+    {'text', 'score', 'box'} en el orden del detector.
+    'score' y 'box' son None cuando el formato del resultado no los incluye
+    """
+    def add_line(text, score=None, box=None):
+        ocr_lines.append({
+            'text': text,
+            'score': float(score) if score is not None else None,
+            'box': box
+        })
     
-    all_text = []
-    tables = []
-    
-    # Procesar la estructura del documento
-    # structure_result es una lista de LayoutParsingResultV2 (objetos con atributos)
-    if isinstance(structure_result, list):
-        for page_result in structure_result:
-            # El resultado puede ser un objeto con atributos o un diccionario
-            # Intentar acceder como objeto primero
-            if hasattr(page_result, 'overall_ocr_res'):
-                ocr_res = page_result.overall_ocr_res
-                # Extraer textos reconocidos
-                if hasattr(ocr_res, 'rec_texts'):
-                    rec_texts = ocr_res.rec_texts
-                    if isinstance(rec_texts, list):
-                        all_text.extend([str(text) for text in rec_texts if text])
-                elif isinstance(ocr_res, dict) and 'rec_texts' in ocr_res:
-                    rec_texts = ocr_res['rec_texts']
-                    if isinstance(rec_texts, list):
-                        all_text.extend([str(text) for text in rec_texts if text])
+    ocr_lines = []
+    if ocr_result:
+        try:
+            # La nueva API de PaddleOCR devuelve objetos con método .text
+            # o puede devolver listas con el formato antiguo
+            # Volcado del resultado bruto: solo con OCR_LOG_LEVEL=DEBUG (str() es caro)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📋 Tipo de resultado OCR: %s", type(ocr_result))
+                if isinstance(ocr_result, list) and len(ocr_result) > 0:
+                    logger.debug("📋 Lista con %d elementos; primero: tipo=%s", len(ocr_result), type(ocr_result[0]))
+                logger.debug("📋 Resultado completo (primeros 2000 chars): %s", str(ocr_result)[:2000])
             
-            # Intentar acceder como diccionario
-            elif isinstance(page_result, dict):
-                # Texto de OCR general
-                if 'overall_ocr_res' in page_result:
-                    ocr_res = page_result['overall_ocr_res']
-                    if isinstance(ocr_res, dict) and 'rec_texts' in ocr_res:
-                        rec_texts = ocr_res['rec_texts']
-                        if isinstance(rec_texts, list):
-                            all_text.extend([str(text) for text in rec_texts if text])
-                
-                # Texto detectado (formato antiguo)
-                if 'text' in page_result:
-                    text_info = page_result.get('text', {})
-                    if isinstance(text_info, dict):
-                        text_content = text_info.get('content', '')
-                    else:
-                        text_content = str(text_info)
-                    if text_content:
-                        all_text.append(text_content)
+            # Si es una lista (formato nuevo de predict() - lista de diccionarios)
+            if isinstance(ocr_result, list):
+                logger.debug("📋 Formato: lista")
+                logger.debug(f"📋 Longitud de lista: {len(ocr_result)}")
                 
-                # Tablas detectadas
-                if 'table' in page_result:
-                    tables.append(page_result['table'])
-                elif 'table_res_list' in page_result:
-                    tables.extend(page_result['table_res_list'])
-                
-                # Estructura completa
-                if 'structure' in page_result:
-                    invoice_data['structure'] = page_result['structure']
+                # predict() devuelve una lista de diccionarios, uno por página
+                for idx, page_result in enumerate(ocr_result):
+                    if not page_result:
+                        continue
+                    
+                    logger.debug(f"📋 Página {idx}: tipo={type(page_result)}")
+                    
+                    # El formato nuevo de predict() es un objeto OCRResult (no dict)
+                    # PRIMERO intentar como objeto (atributo) - esto es lo correcto
+                    rec_texts = None
+                    rec_scores = []
+                    rec_boxes = None
+                    
+                    # Intentar acceder como objeto (atributo) - FORMATO CORRECTO
+                    if hasattr(page_result, 'rec_texts'):
+                        rec_texts = page_result.rec_texts
+                        rec_scores = getattr(page_result, 'rec_scores', [])
+                        rec_boxes = getattr(page_result, 'rec_boxes', None)
+                        if rec_boxes is None:
+                            rec_boxes = getattr(page_result, 'rec_polys', None)
+                        logger.debug(f"📋 Acceso como objeto: rec_texts tiene {len(rec_texts) if isinstance(rec_texts, list) else 'N/A'} elementos")
+                    
+                    # Fallback: intentar acceder como diccionario (key)
+                    elif isinstance(page_result, dict) and 'rec_texts' in page_result:
+                        rec_texts = page_result['rec_texts']
+                        rec_scores = page_result.get('rec_scores', [])
+                        rec_boxes = page_result.get('rec_boxes')
+                        if rec_boxes is None:
+                            rec_boxes = page_result.get('rec_polys')
+                        logger.debug(f"📋 Acceso como dict: rec_texts tiene {len(rec_texts) if isinstance(rec_texts, list) else 'N/A'} elementos")
+                    
+                    # Extraer textos reconocidos
+                    if rec_texts is not None:
+                        if isinstance(rec_texts, list) and len(rec_texts) > 0:
+                            for text_idx, text in enumerate(rec_texts):
+                                if text and text.strip():
+                                    confidence = rec_scores[text_idx] if text_idx < len(rec_scores) else 0.0
+                                    box = None
+                                    if rec_boxes is not None and text_idx < len(rec_boxes):
+                                        box = _box_from_points(rec_boxes[text_idx])
+                                    add_line(text.strip(), confidence, box)
+                                    logger.debug("✅ Texto %d: '%s' (conf: %.2f)", text_idx, text.strip(), confidence)
+                        elif isinstance(rec_texts, str) and rec_texts.strip():
+                            add_line(rec_texts.strip())
+                            logger.debug(f"✅ Texto directo: '{rec_texts.strip()}'")
+                    
+                    # Fallback: buscar en otras keys/atributos comunes
+                    if not ocr_lines:
+                        # Intentar como objeto
+                        for attr_name in ['text', 'rec_text', 'content', 'result', 'ocr_text']:
+                            if hasattr(page_result, attr_name):
+                                value = getattr(page_result, attr_name)
+                                if isinstance(value, list) and len(value) > 0:
+                                    for item in value:
+                                        if isinstance(item, str) and item.strip():
+                                            add_line(item.strip())
+                                elif isinstance(value, str) and value.strip():
+                                    add_line(value.strip())
+                                if ocr_lines:
+                                    logger.debug(f"✅ Texto encontrado en atributo '{attr_name}'")
+                                    break
+                        
+                        # Intentar como diccionario
+                        if not ocr_lines and isinstance(page_result, dict):
+                            for key in ['text', 'rec_text', 'content', 'result', 'ocr_text']:
+                                if key in page_result and page_result[key]:
+                                    value = page_result[key]
+                                    if isinstance(value, list):
+                                        for item in value:
+                                            if isinstance(item, str) and item.strip():
+                                                add_line(item.strip())
+                                    elif isinstance(value, str) and value.strip():
+                                        add_line(value.strip())
+                                    if ocr_lines:
+                                        logger.debug(f"✅ Texto encontrado en key '{key}'")
+                                        break
+                    
+                    # Si el item es una lista anidada (formato antiguo de ocr())
+                    elif isinstance(page_result, list):
+                        logger.debug(f"📋 Formato antiguo: lista anidada con {len(page_result)} elementos")
+                        for line_result in page_result:
+                            if not line_result:
+                                continue
+                            
+                            text = None
+                            confidence = 0.0
+                            box = None
+                            
+                            # Formato antiguo: [coordenadas, (texto, confianza)]
+                            if isinstance(line_result, (list, tuple)) and len(line_result) >= 2:
+                                box = _box_from_points(line_result[0])
+                                text_data = line_result[1]
+                                if isinstance(text_data, (list, tuple)) and len(text_data) >= 1:
+                                    text = text_data[0]
+                                    confidence = text_data[1] if len(text_data) > 1 else 0.0
+                                elif isinstance(text_data, str):
+                                    text = text_data
+                            
+                            if text and text.strip():
+                                if confidence == 0.0 or confidence > 0.1:
+                                    add_line(text.strip(), confidence, box)
+                                    logger.debug("✅ Texto: '%s' (conf: %.2f)", text.strip(), confidence)
+                    
+                    # Si el item es una string directamente
+                    elif isinstance(page_result, str) and page_result.strip():
+                        add_line(page_result.strip())
+                        logger.debug(f"✅ Texto (directo): '{page_result.strip()}'")
+                    
+                    # Debug: mostrar estructura si no se pudo extraer
+                    if idx == 0 and len(ocr_lines) == 0:
+                        logger.debug(f"⚠️ No se pudo extraer texto de la página {idx}")
+                        logger.debug(f"⚠️ Estructura: {str(page_result)[:500]}")
             
-            # Extraer tablas de table_res_list (atributo del objeto)
-            if hasattr(page_result, 'table_res_list'):
-                table_list = page_result.table_res_list
-                if isinstance(table_list, list):
-                    tables.extend(table_list)
-    
-    # Combinar todo el texto
-    invoice_data['rawText'] = '\n'.join(all_text)
-    if tables:
-        invoice_data['tables'] = tables
-    
-    # Intentar extraer datos específicos del texto
-    text_combined = invoice_data['rawText'].upper()
-    
-    # Extraer establecimiento (primera línea con texto significativo)
-    lines = [line.strip() for line in all_text if line.strip()]
-    if lines:
-        # Buscar nombre de empresa en las primeras líneas
-        for line in lines[:10]:
-            if len(line) > 3 and len(line) < 80:
-                # Excluir palabras comunes de facturas
-                excluded = ['FACTURA', 'TICKET', 'RECIBO', 'FECHA', 'TOTAL', 'IVA', 'SUBTOTAL']
-                if not any(word in line.upper() for word in excluded):
-                    if not line.upper().startswith(('C/', 'CALLE', 'AVDA', 'AVENIDA')):
-                        invoice_data['establishment'] = line
+            # Si tiene atributo text (nueva API predict())
+            elif hasattr(ocr_result, 'text'):
+                logger.debug("📋 Formato: objeto con .text")
+                text_value = ocr_result.text
+                if isinstance(text_value, str):
+                    add_line(text_value)
+                elif isinstance(text_value, list):
+                    for item in text_value:
+                        if item:
+                            add_line(str(item))
+            
+            # Si es un objeto con método get_text
+            elif hasattr(ocr_result, 'get_text'):
+                logger.debug("📋 Formato: objeto con .get_text()")
+                add_line(ocr_result.get_text())
+            
+            # Si es un diccionario (resultado de predict() puede ser dict)
+            elif isinstance(ocr_result, dict):
+                logger.debug("📋 Formato: diccionario")
+                # Buscar texto en diferentes keys comunes
+                for key in ['text', 'result', 'data', 'ocr_text', 'content', 'rec_text']:
+                    if key in ocr_result and ocr_result[key]:
+                        if isinstance(ocr_result[key], str):
+                            add_line(ocr_result[key])
+                        elif isinstance(ocr_result[key], list):
+                            for item in ocr_result[key]:
+                                if item:
+                                    add_line(str(item))
                         break
+                # Si no encontramos texto, buscar en toda la estructura
+                if not ocr_lines:
+                    logger.debug("📋 Buscando texto en toda la estructura del dict...")
+                    for key, value in ocr_result.items():
+                        if isinstance(value, str) and len(value) > 3:
+                            add_line(value)
+                        elif isinstance(value, list):
+                            for item in value:
+                                if isinstance(item, str) and len(item) > 3:
+                                    add_line(item)
+                                elif isinstance(item, dict):
+                                    # Buscar en sub-diccionarios
+                                    for sub_key, sub_value in item.items():
+                                        if isinstance(sub_value, str) and len(sub_value) > 3:
+                                            add_line(sub_value)
+            
+            # Si es un objeto, intentar acceder a atributos comunes
+            elif hasattr(ocr_result, '__dict__'):
+                logger.debug("📋 Formato: objeto con __dict__")
+                for attr_name in ['text', 'result', 'data', 'ocr_text', 'content']:
+                    if hasattr(ocr_result, attr_name):
+                        attr_value = getattr(ocr_result, attr_name)
+                        if isinstance(attr_value, str) and attr_value:
+                            add_line(attr_value)
+                            break
+            
+            else:
+                logger.warning("⚠️ Formato desconocido de resultado OCR")
+                logger.debug(f"📋 Contenido completo (primeros 1000 chars): {str(ocr_result)[:1000]}")
+                # Intentar convertir a string como último recurso
+                result_str = str(ocr_result)
+                if result_str and result_str != 'None' and len(result_str) > 10:
+                    add_line(result_str)
+                
+        except Exception as e:
+            logger.warning(f"⚠️ Error extrayendo texto de OCR result: {e}", exc_info=True)
+            # Intentar convertir a string como último recurso
+            ocr_lines = [{'text': str(ocr_result), 'score': None, 'box': None}]
     
-    # Extraer fecha
-    import re
-    date_patterns = [
-        r'(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',
-        r'(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})',
-        r'FECHA[:\\s]*(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, text_combined)
-        if match:
-            try:
-                groups = match.groups()
-                if len(groups) >= 3:
-                    if int(groups[0]) > 31:  # Formato YYYY-MM-DD
-                        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
-                    else:  # Formato DD-MM-YYYY
-                        day, month, year = int(groups[0]), int(groups[1]), int(groups[2])
-                        if year < 100:
-                            year += 2000
-                    invoice_data['date'] = f"{year}-{month:02d}-{day:02d}"
-                    break
-            except:
-                pass
-    
-    # Extraer valores monetarios
-    # Total
-    total_patterns = [
-        r'TOTAL[^\n]*?([\d]+[.,]\d{2})',
-        r'TOTAL\s+A\s+PAGAR[^\n]*?([\d]+[.,]\d{2})',
-        r'TOTAL\s+EUR[^\n]*?([\d]+[.,]\d{2})',
-    ]
-    
-    for pattern in total_patterns:
-        match = re.search(pattern, text_combined)
-        if match:
-            try:
-                value_str = match.group(1).replace(',', '.')
-                invoice_data['total'] = float(value_str)
-                break
-            except:
-                pass
-    
-    # Subtotal/Base Imponible
-    subtotal_patterns = [
-        r'BASE\s*IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
-        r'B\.?IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
-        r'SUBTOTAL[^\n]*?([\d]+[.,]\d{2})',
-    ]
-    
-    for pattern in subtotal_patterns:
-        match = re.search(pattern, text_combined)
-        if match:
-            try:
-                value_str = match.group(1).replace(',', '.')
-                invoice_data['subtotal'] = float(value_str)
-                break
-            except:
-                pass
-    
-    # IVA
-    tax_patterns = [
-        r'I\.?V\.?A\.?\s*\d+[,.]?\d*\s*%[^\n]*?([\d]+[.,]\d{2})',
-        r'CUOTA[^\n]*?([\d]+[.,]\d{2})',
-        r'IVA[^\n]*?([\d]+[.,]\d{2})',
-    ]
-    
-    for pattern in tax_patterns:
-        match = re.search(pattern, text_combined)
-        if match:
-            try:
-                value_str = match.group(1).replace(',', '.')
-                invoice_data['tax'] = float(value_str)
-                break
-            except:
-                pass
-    
-    # Tasa IVA
-    tax_rate_patterns = [
-        r'I\.?V\.?A\.?\s*([\d.,]+)\s*%',
-        r'(\d+)\s*%\s*:?\s*BASE',
-    ]
-    
-    for pattern in tax_rate_patterns:
-        match = re.search(pattern, text_combined)
-        if match:
-            try:
-                rate_str = match.group(1).replace(',', '.')
-                rate = float(rate_str)
-                if 1 <= rate <= 25:
-                    invoice_data['taxRate'] = rate / 100.0
-                    break
-            except:
-                pass
-    
-    # Si tenemos tablas, intentar extraer datos de ellas
-    if tables:
-        invoice_data['tables'] = tables
     
-    return invoice_data
+    return ocr_lines
 
-def extract_data_from_text(text, invoice_data):
-    """
-    Extrae datos de factura directamente del texto OCR
-    """
-    import re
-    text_upper = text.upper()
-    
-    # Extraer establecimiento (mejorado)
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    excluded_words = ['FACTURA', 'TICKET', 'RECIBO', 'FECHA', 'TOTAL', 'IVA', 'SUBTOTAL', 
-                      'BASE', 'IMPONIBLE', 'C/', 'CALLE', 'AVDA', 'AVENIDA']
-    
-    for line in lines[:15]:
-        line_upper = line.upper()
-        # Buscar líneas con texto significativo que no sean números o direcciones
-        if (len(line) > 3 and len(line) < 80 and 
-            not re.match(r'^[\d\s.,€$]+$', line) and
-            not any(word in line_upper for word in excluded_words) and
-            not line_upper.startswith(('C/', 'CALLE', 'AVDA', 'AVENIDA', 'PLAZA'))):
-            # Verificar que tenga al menos algunas letras
-            if re.search(r'[A-Za-z]{3,}', line):
-                invoice_data['establishment'] = line
-                break
-    
-    # Extraer fecha (mejorado)
-    date_patterns = [
-        r'FECHA[:\\s]*(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',  # "FECHA 09/08/2025" - PRIORIDAD
-        r'(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',  # "09/08/2025"
-        r'(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})',  # "2025/08/09"
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, text_upper)
-        if match:
-            try:
-                groups = match.groups()
-                if len(groups) >= 3:
-                    if int(groups[0]) > 31:  # Formato YYYY-MM-DD
-                        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
-                    else:  # Formato DD-MM-YYYY o MM-DD-YYYY
-                        # Intentar determinar el formato
-                        first = int(groups[0])
-                        second = int(groups[1])
-                        third = int(groups[2])
-                        
-                        if first > 12:  # Primer número > 12, debe ser día
-                            day, month, year = first, second, third
-                        elif second > 12:  # Segundo número > 12, debe ser día
-                            month, day, year = first, second, third
-                        else:  # Ambos < 12, asumir DD-MM-YYYY (formato español)
-                            day, month, year = first, second, third
-                        
-                        if year < 100:
-                            year += 2000
-                    
-                    # Validar que la fecha sea razonable
-                    if 2000 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
-                        invoice_data['date'] = f"{year}-{month:02d}-{day:02d}"
-                        print(f"  ✅ Fecha extraída: {invoice_data['date']}")
-                        break
-            except Exception as e:
-                print(f"  ⚠️ Error extrayendo fecha: {e}")
-                pass
-    
-    # Extraer valores monetarios (mejorado)
-    # PRIMERO: Intentar capturar el formato completo "BASE IMP IVA 36,82 10% 3,68"
-    # El texto puede tener espacios o no: "BASE IMP IVA" o "BASEIMPIVA"
-    base_iva_patterns = [
-        r'BASE\s+IMP\s+IVA\s+([\d]+[.,]\d{2})\s+(\d+)\s*%\s+([\d]+[.,]\d{2})',  # Con espacios
-        r'BASE\s*IMP\s*IVA\s+([\d]+[.,]\d{2})\s+(\d+)\s*%\s+([\d]+[.,]\d{2})',  # Espacios opcionales
-        r'BASE\s*IMP\s*IVA[^\d]*([\d]+[.,]\d{2})[^\d]*(\d+)\s*%[^\d]*([\d]+[.,]\d{2})',  # Más flexible
-    ]
-    
-    for base_iva_pattern in base_iva_patterns:
-        match = re.search(base_iva_pattern, text_upper)
-        if match:
-            try:
-                # Base imponible
-                base_str = match.group(1).replace(',', '.').replace(' ', '')
-                invoice_data['subtotal'] = float(base_str)
-                print(f"  ✅ Subtotal extraído: {invoice_data['subtotal']}")
-                
-                # Tasa IVA
-                rate_str = match.group(2).replace(',', '.').replace(' ', '')
-                rate = float(rate_str)
-                if 1 <= rate <= 25:
-                    invoice_data['taxRate'] = rate / 100.0
-                    print(f"  ✅ Tasa IVA extraída: {invoice_data['taxRate']*100}%")
-                
-                # IVA
-                tax_str = match.group(3).replace(',', '.').replace(' ', '')
-                invoice_data['tax'] = float(tax_str)
-                print(f"  ✅ IVA extraído: {invoice_data['tax']}")
-                break  # Si encontramos el patrón completo, no buscar más
-            except Exception as e:
-                print(f"  ⚠️ Error extrayendo BASE IMP IVA: {e}")
-                continue
-    
-    # Total - buscar después de "TOTAL"
-    total_patterns = [
-        r'TOTAL[^\n]*?([\d]+[.,]\d{2})\s*€?',  # Mejorado: captura después de TOTAL
-        r'TOTAL\s+A\s+PAGAR[^\n]*?([\d]+[.,]\d{2})',
-        r'TOTAL\s+EUR[^\n]*?([\d]+[.,]\d{2})',
-        r'TOTAL\s+([\d]+[.,]\d{2})\s*€',  # Formato: "TOTAL 40,50 €"
-    ]
-    
-    for pattern in total_patterns:
-        matches = re.finditer(pattern, text_upper)
-        for match in matches:
-            try:
-                value_str = match.group(1).replace(',', '.').replace(' ', '')
-                value = float(value_str)
-                # Solo actualizar si es mayor que el actual o si no hay total
-                if value > 0 and (invoice_data['total'] is None or value > invoice_data['total']):
-                    invoice_data['total'] = value
-                    print(f"  ✅ Total extraído: {invoice_data['total']}")
-            except Exception as e:
-                print(f"  ⚠️ Error extrayendo total: {e}")
-    
-    # Subtotal (si no se extrajo antes)
-    if invoice_data['subtotal'] is None:
-        subtotal_patterns = [
-            r'BASE\s*IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
-            r'B\.?IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
-            r'BASE\s+IMP[^\n]*?([\d]+[.,]\d{2})',  # Formato: "BASE IMP 36,82"
-            r'SUBTOTAL[^\n]*?([\d]+[.,]\d{2})',
-        ]
-        
-        for pattern in subtotal_patterns:
-            match = re.search(pattern, text_upper)
-            if match:
-                try:
-                    value_str = match.group(1).replace(',', '.').replace(' ', '')
-                    invoice_data['subtotal'] = float(value_str)
-                    print(f"  ✅ Subtotal extraído: {invoice_data['subtotal']}")
-                    break
-                except Exception as e:
-                    print(f"  ⚠️ Error extrayendo subtotal: {e}")
-    
-    # IVA (si no se extrajo antes)
-    if invoice_data['tax'] is None:
-        tax_patterns = [
-            r'CUOTA[^\n]*?([\d]+[.,]\d{2})',  # "CUOTA 3,68"
-            r'I\.?V\.?A\.?\s*\d+[,.]?\d*\s*%[^\n]*?([\d]+[.,]\d{2})',
-            r'IVA[^\n]*?([\d]+[.,]\d{2})',
-        ]
-        
-        for pattern in tax_patterns:
-            match = re.search(pattern, text_upper)
-            if match:
-                try:
-                    value_str = match.group(1).replace(',', '.').replace(' ', '')
-                    invoice_data['tax'] = float(value_str)
-                    print(f"  ✅ IVA extraído: {invoice_data['tax']}")
-                    break
-                except Exception as e:
-                    print(f"  ⚠️ Error extrayendo IVA: {e}")
-    
-    # Tasa IVA (si no se extrajo antes)
-    if invoice_data['taxRate'] is None:
-        tax_rate_patterns = [
-            r'I\.?V\.?A\.?\s*(\d+)\s*%',  # "IVA 10%"
-            r'(\d+)\s*%\s*:?\s*BASE',
-            r'BASE\s+IMP\s+IVA[^\n]*?(\d+)\s*%',  # En el contexto de "BASE IMP IVA"
-        ]
-        
-        for pattern in tax_rate_patterns:
-            match = re.search(pattern, text_upper)
-            if match:
+class _TableHTMLParser(HTMLParser):
+    """Convierte el HTML de tabla de PP-StructureV3 en una lista de filas de texto"""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._row = []
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self._row is not None and self._cell is not None:
+            self._row.append(' '.join(''.join(self._cell).split()))
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+def table_to_rows(table):
+    """Formato compacto de una tabla: {'rows': [[celda, ...], ...]}"""
+    html = None
+    if isinstance(table, dict):
+        html = table.get('pred_html')
+    elif hasattr(table, 'pred_html'):
+        html = table.pred_html
+    if not html:
+        return {'rows': []}
+    parser = _TableHTMLParser()
+    parser.feed(html)
+    parser.close()
+    return {'rows': parser.rows}
+
+def parse_fields(value):
+    """
+    Interpreta fields (lista o cadena separada por comas).
+    None o vacío = campos por defecto; 'all' = todos
+    """
+    if value is None or value == '' or value == []:
+        return DEFAULT_FIELDS
+    names = value.split(',') if isinstance(value, str) else list(value)
+    names = [str(name).strip() for name in names if str(name).strip()]
+    if 'all' in names:
+        return INVOICE_FIELDS
+    unknown = [name for name in names if name not in INVOICE_FIELDS]
+    if unknown:
+        raise FieldSelectionError(
+            f"Campos desconocidos: {', '.join(unknown)}. Válidos: {', '.join(INVOICE_FIELDS)} o all"
+        )
+    return tuple(names)
+
+def select_fields(invoice_data, fields):
+    """
+    Devuelve solo los campos pedidos. Las tablas se convierten a filas y la
+    estructura a JSON solo si se solicitan
+    """
+    selected = {}
+    for name in fields:
+        if name == 'tables':
+            selected['tables'] = [table_to_rows(table) for table in invoice_data.get('tables') or []]
+        elif name == 'structure':
+            selected['structure'] = json_safe(invoice_data.get('structure') or {})
+        else:
+            selected[name] = invoice_data.get(name)
+    return selected
+
+def parse_deadline(data):
+    """Presupuesto de la petición: cabecera, luego parámetro, luego OCR_DEFAULT_DEADLINE_MS"""
+    value = request.headers.get('X-OCR-Deadline-Ms') or request.args.get('deadlineMs') or data.get('deadlineMs')
+    if value in (None, ''):
+        return Deadline(OCR_DEFAULT_DEADLINE_MS)
+    try:
+        return Deadline(float(value))
+    except (TypeError, ValueError):
+        raise ValueError(f'deadlineMs inválido: {value!r}')
+
+def parse_priority(data):
+    """Clase de prioridad: cabecera X-OCR-Priority (la fija el backend Node.js) o parámetro priority"""
+    value = (request.headers.get('X-OCR-Priority') or request.args.get('priority')
+             or data.get('priority') or INTERACTIVE)
+    value = str(value).strip().lower()
+    if value not in PRIORITY_CLASSES:
+        raise ValueError(f"Prioridad desconocida: {value!r}. Válidas: {', '.join(PRIORITY_CLASSES)}")
+    return value
+
+def parse_flag(value):
+    """Interpreta un parámetro booleano (true/1/yes, también como booleano JSON)"""
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes')
+
+def parse_lang(data):
+    """Idioma del documento (parámetro lang); por defecto OCR_LANG"""
+    value = request.args.get('lang') or data.get('lang') or OCR_LANG
+    value = str(value).strip().lower()
+    if value not in OCR_LANGS:
+        raise ValueError(f"Idioma no soportado: {value!r}. Soportados: {', '.join(OCR_LANGS)}")
+    return value
+
+RESPONSE_MODES = ('sync', 'progressive', 'sse')
+
+def parse_response_mode(data):
+    """
+    Modo de respuesta: 'sync' (por defecto, todo en una respuesta), 'progressive'
+    (campos del OCR ya y jobId para consultar la estructura) o 'sse' (ambas fases
+    como eventos). Parámetro mode o cabecera Accept: text/event-stream
+    """
+    value = request.args.get('mode') or data.get('mode')
+    if not value:
+        return 'sse' if 'text/event-stream' in request.headers.get('Accept', '') else 'sync'
+    value = str(value).strip().lower()
+    if value not in RESPONSE_MODES:
+        raise ValueError(f"Modo desconocido: {value!r}. Válidos: {', '.join(RESPONSE_MODES)}")
+    return value
+
+def _json_default(value):
+    """Tipos sin equivalente JSON: numpy (solo en json) y objetos de PaddleOCR (str)"""
+    if isinstance(value, (np.ndarray, np.floating)) and value.dtype.kind == 'f' and value.dtype.itemsize < 8:
+        # Como orjson: el decimal más corto del float32 (0.95, no 0.949999988079071)
+        if isinstance(value, np.ndarray):
+            return [_json_default(item) for item in value] if value.ndim else _json_default(value[()])
+        return float(str(value))
+    if isinstance(value, (np.ndarray, np.generic)):
+        return json_safe(value)
+    return str(value)
+
+def dumps_json(payload):
+    """
+    Serializa a JSON con orjson (más rápido en respuestas grandes) o, si no está
+    instalado, con json. Ambos producen el mismo documento
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+def json_response(payload, status=200):
+    """Respuesta JSON (ver dumps_json)"""
+    return app.response_class(dumps_json(payload), status=status, mimetype='application/json')
+
+def sse_event(event, payload):
+    """Un evento server-sent events con datos JSON"""
+    data = dumps_json(payload)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return f"event: {event}\ndata: {data}\n\n"
+
+def run_ocr_phase(image_array, ocr_engines, deadline, stages, lang=OCR_LANG):
+    """
+    Fase 1: OCR de la imagen y reconstrucción del texto.
+    Devuelve (líneas OCR, texto para la extracción, filas o None)
+    """
+    # Procesar con PP-OCRv5 (reconocimiento de texto)
+    logger.debug(f"📝 Procesando con PP-OCRv5 ({lang})...")
+    logger.debug(f"📷 Tamaño de imagen: {image_array.shape}")
+    
+    # El OCR es obligatorio: si el presupuesto ya se agotó no tiene sentido empezar
+    deadline.check('ocr')
+    tiles = plan_ocr_tiles(image_array)
+    try:
+        with stages.stage('ocr'):
+            if len(tiles) > 1:
+                # Ticket muy largo: todas las franjas en una sola llamada por lotes
+                with ocr_engines.checkout(lang, timeout=deadline.timeout(OCR_POOL_TIMEOUT)) as ocr:
+                    results = run_ocr_batch(ocr, tiling.split(image_array, tiles))
+            elif ocr_batcher is not None and lang == OCR_LANG and not profiling.active():
+                # Al perfilar, el OCR se ejecuta en este hilo (cProfile no ve los hilos del batcher)
+                future = ocr_batcher.submit(image_array, deadline.expires_at)
                 try:
-                    rate_str = match.group(1).replace(',', '.').replace(' ', '')
-                    rate = float(rate_str)
-                    if 1 <= rate <= 25:
-                        invoice_data['taxRate'] = rate / 100.0
-                        print(f"  ✅ Tasa IVA extraída: {invoice_data['taxRate']*100}%")
-                        break
-                except Exception as e:
-                    print(f"  ⚠️ Error extrayendo tasa IVA: {e}")
+                    ocr_result = future.result(timeout=deadline.remaining())
+                except FutureTimeoutError:
+                    # La petición responde 504: que su imagen no ocupe un hueco de un lote
+                    future.cancel()
+                    raise
+            else:
+                with ocr_engines.checkout(lang, timeout=deadline.timeout(OCR_POOL_TIMEOUT)) as ocr:
+                    ocr_result = run_ocr(ocr, image_array)
+    except FutureTimeoutError:
+        raise DeadlineExceeded(f'Presupuesto de {deadline.budget_ms:.0f} ms agotado durante el OCR')
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error crítico en OCR: {e}", exc_info=True)
+        raise
+    
+    # El resultado bruto (mapas de detección, imágenes intermedias) no debe sobrevivir a la extracción
+    if len(tiles) == 1:
+        results = [ocr_result]
+        del ocr_result
+    return pop_ocr_lines(results, stages, tiles)
+
+def plan_ocr_tiles(image_array):
+    """Franjas [(y1, y2), ...] en las que se reconoce la imagen (una sola si no es un ticket largo)"""
+    h, w = image_array.shape[:2]
+    if not OCR_TILING:
+        return [(0, h)]
+    return tiling.plan_tiles(h, w, OCR_TILE_MIN_ASPECT, OCR_TILE_ASPECT, OCR_TILE_OVERLAP)
+
+def pop_ocr_lines(results, stages, tiles=None):
+    """
+    Saca el primer resultado OCR de la lista `results` y devuelve (líneas OCR, texto para
+    la extracción, filas o None). Al sacarlo de la lista el resultado bruto se libera en
+    cuanto se extraen las líneas. Con varias franjas en `tiles` se saca un resultado por
+    franja y sus líneas se unen en coordenadas de la imagen completa
+    """
+    with stages.stage('ocr_lines'):
+        if tiles is None or len(tiles) == 1:
+            ocr_lines = extract_ocr_lines(results.pop(0))
+        else:
+            tile_lines = [extract_ocr_lines(results.pop(0)) for _ in tiles]
+            ocr_lines = tiling.merge_lines(tile_lines, tiles)
+            metrics.incr('ocr.tiled')
+            metrics.incr('ocr.tiles', len(tiles))
+            logger.debug(f"🧩 {len(tiles)} franjas, {sum(map(len, tile_lines))} líneas → {len(ocr_lines)} tras unir")
+        ocr_raw_text, rows = build_ocr_text(ocr_lines)
+    
+    row_info = f", {len(rows)} filas" if rows is not None else ""
+    logger.debug(f"📄 Texto extraído ({len(ocr_raw_text)} caracteres, {len(ocr_lines)} líneas{row_info})")
+    if ocr_raw_text:
+        logger.debug(f"📝 Primeras líneas: {ocr_raw_text[:300]}")
+    else:
+        logger.info("⚠️ No se extrajo ningún texto")
+    
+    return ocr_lines, ocr_raw_text, rows
+
+def structure_needed(ocr_raw_text, text_only_data, structure_engines):
+    """¿Aporta algo ejecutar PP-StructureV3? (según OCR_STRUCTURE_MODE y el texto ya extraído)"""
+    if not ocr_raw_text or structure_engines is None or OCR_STRUCTURE_MODE == 'never':
+        return False
+    if OCR_STRUCTURE_MODE == 'auto' and all(text_only_data[field] for field in STRUCTURE_KEY_FIELDS):
+        logger.debug("⏭️ Campos completos con el texto OCR, se omite PP-StructureV3")
+        metrics.incr('structure.skipped')
+        return False
+    return True
+
+def run_structure_phase(image_array, structure_engines, deadline, stages, skipped, structure_modules=None):
+    """
+    Fase 2 (opcional): PP-StructureV3. Devuelve structure_data o None si se omite o falla.
+    Las omisiones por falta de presupuesto se añaden a `skipped`. `structure_modules`
+    limita los submódulos que se ejecutan (None = todos los cargados)
+    """
+    # PP-StructureV3 es opcional: se omite si no cabe en el presupuesto restante
+    if not deadline.allows(metrics.average('stage.structure')):
+        logger.info(f"⏱️ Presupuesto insuficiente para PP-StructureV3 ({deadline.remaining():.2f}s restantes)")
+        skipped.append('structure')
+        metrics.incr('deadline.skipped.structure')
+        return None
+    
+    try:
+        logger.debug("📊 Procesando con PP-StructureV3...")
+        with stages.stage('structure'):
+            with structure_engines.checkout(timeout=deadline.timeout(OCR_POOL_TIMEOUT)) as structure:
+                # PP-StructureV3 usa el método predict(), no es callable directamente
+                structure_result = structure.predict(image_array,
+                                                     **structure_profile.predict_kwargs(structure_modules))
+            structure_data = extract_invoice_data_from_structure(structure_result)
+            # No retener los objetos de PP-StructureV3 más allá de esta etapa
+            del structure_result
+        logger.debug("✅ PP-StructureV3 procesado correctamente")
+        return structure_data
+    except PoolTimeout as e:
+        # Sin instancia libre a tiempo: devolver el resultado del OCR
+        logger.warning(f"⏱️ {e}")
+        skipped.append('structure')
+        metrics.incr('deadline.skipped.structure')
+    except Exception as e:
+        logger.warning(f"⚠️ Error procesando estructura: {e}", exc_info=True)
+        # Continuar solo con OCR si falla la estructura
+    return None
+
+def finish_pipeline(image_hash, ocr_lines, ocr_raw_text, rows, structure_data, stages):
+    """Guarda la salida bruta (si hay almacén) y construye invoice_data final"""
+    # Guardar la salida bruta para poder re-extraer campos sin repetir el OCR
+    if ocr_store is not None:
+        try:
+            with stages.stage('store'):
+                ocr_store.save(image_hash, ocr_lines, normalize_structure_data(structure_data))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar el resultado OCR ({image_hash}): {e}")
+    
+    with stages.stage('extract'):
+        invoice_data = build_invoice_data(ocr_raw_text, structure_data)
+    invoice_data['rows'] = rows or []
+    return invoice_data
+
+def run_pipeline(image_array, image_hash, ocr_engines, structure_engines, deadline, stages, lang=OCR_LANG,
+                 structure_modules=None):
+    """
+    Ejecuta OCR, PP-StructureV3 (si procede) y la extracción de campos sobre una imagen ya
+    decodificada. Devuelve (invoice_data, etapas opcionales omitidas por el presupuesto)
+    """
+    ocr_lines, ocr_raw_text, rows = run_ocr_phase(image_array, ocr_engines, deadline, stages, lang)
+    return complete_pipeline(image_array, image_hash, ocr_lines, ocr_raw_text, rows,
+                             structure_engines, deadline, stages, structure_modules)
+
+def complete_pipeline(image_array, image_hash, ocr_lines, ocr_raw_text, rows, structure_engines,
+                      deadline, stages, structure_modules=None):
+    """PP-StructureV3 (si procede), almacén y extracción a partir del OCR ya hecho"""
+    skipped = []
+    structure_data = None
+    text_only_data = None
+    if ocr_raw_text and structure_engines is not None and OCR_STRUCTURE_MODE == 'auto':
+        with stages.stage('extract'):
+            text_only_data = build_invoice_data(ocr_raw_text)
+    if structure_needed(ocr_raw_text, text_only_data, structure_engines):
+        structure_data = run_structure_phase(image_array, structure_engines, deadline, stages, skipped,
+                                             structure_modules)
+    elif ocr_raw_text and structure_engines is None:
+        logger.debug("ℹ️ PP-StructureV3 no disponible, usando solo OCR")
+    
+    invoice_data = finish_pipeline(image_hash, ocr_lines, ocr_raw_text, rows, structure_data, stages)
+    return invoice_data, skipped
+
+def run_segmented_pipeline(image_array, image_hash, boxes, ocr_engines, structure_engines, deadline,
+                           stages, lang=OCR_LANG, structure_modules=None):
+    """
+    Varios tickets en una foto: recorta cada caja de `boxes`, pasa todos los recortes por
+    el OCR en una sola llamada por lotes y extrae un invoice_data por recorte.
+    Devuelve (lista de {'box', 'imageHash', 'data'}, etapas omitidas)
+    """
+    crops = [segmentation.crop(image_array, box) for box in boxes]
+    # Los tickets largos se trocean igual que en run_ocr_phase; todas las franjas van en el mismo lote
+    crop_tiles = [plan_ocr_tiles(crop) for crop in crops]
+    
+    deadline.check('ocr')
+    with stages.stage('ocr'):
+        with ocr_engines.checkout(lang, timeout=deadline.timeout(OCR_POOL_TIMEOUT)) as ocr:
+            results = run_ocr_batch(ocr, [tile for crop, tiles in zip(crops, crop_tiles)
+                                          for tile in tiling.split(crop, tiles)])
+    
+    receipts = []
+    skipped = []
+    for box, crop, tiles in zip(boxes, crops, crop_tiles):
+        # Hash propio por recorte: el almacén y /ocr/reextract funcionan por ticket
+        crop_hash = hashlib.sha256(f'{image_hash}:{box}'.encode('ascii')).hexdigest()
+        ocr_lines, ocr_raw_text, rows = pop_ocr_lines(results, stages, tiles)
+        invoice_data, crop_skipped = complete_pipeline(crop, crop_hash, ocr_lines, ocr_raw_text, rows,
+                                                       structure_engines, deadline, stages, structure_modules)
+        skipped.extend(stage for stage in crop_skipped if stage not in skipped)
+        receipts.append({'box': box, 'imageHash': crop_hash, 'data': invoice_data})
+    return receipts, skipped
+
+def run_sync_pipeline(image_array, image_hash, segment, ocr_engines, structure_engines, deadline, stages,
+                      priority, lang=OCR_LANG, structure_modules=None):
+    """
+    Pipeline completo de una petición síncrona dentro de un hueco del planificador.
+    Devuelve (invoice_data, receipts o None si no se segmenta, etapas omitidas)
+    """
+    with scheduler.slot(priority, timeout=deadline.timeout(OCR_POOL_TIMEOUT)):
+        if not segment:
+            invoice_data, skipped = run_pipeline(image_array, image_hash, ocr_engines, structure_engines,
+                                                 deadline, stages, lang, structure_modules)
+            return invoice_data, None, skipped
+        with stages.stage('segment'):
+            boxes = segmentation.find_documents(image_array, OCR_SEGMENT_MIN_AREA, OCR_SEGMENT_MAX_DOCUMENTS)
+        if len(boxes) > 1:
+            receipts, skipped = run_segmented_pipeline(image_array, image_hash, boxes, ocr_engines,
+                                                       structure_engines, deadline, stages, lang,
+                                                       structure_modules)
+            return None, receipts, skipped
+        invoice_data, skipped = run_pipeline(image_array, image_hash, ocr_engines, structure_engines,
+                                             deadline, stages, lang, structure_modules)
+        return invoice_data, [{'box': boxes[0], 'imageHash': image_hash, 'data': invoice_data}], skipped
+
+def run_progressive_pipeline(image_array, image_hash, ocr_engines, structure_engines, deadline, stages,
+                             lang=OCR_LANG, structure_modules=None):
+    """
+    Fase 1 del modo progresivo: OCR y campos de texto dentro del presupuesto de la petición.
+    Devuelve (invoice_data solo con OCR, etapas omitidas, estado para la fase 2 o None si
+    PP-StructureV3 no aporta nada y el resultado ya es definitivo)
+    """
+    ocr_lines, ocr_raw_text, rows = run_ocr_phase(image_array, ocr_engines, deadline, stages, lang)
+    with stages.stage('extract'):
+        text_only_data = build_invoice_data(ocr_raw_text)
+    text_only_data['rows'] = rows or []
+    
+    if not structure_needed(ocr_raw_text, text_only_data, structure_engines):
+        invoice_data = finish_pipeline(image_hash, ocr_lines, ocr_raw_text, rows, None, stages)
+        return invoice_data, [], None
+    
+    pending = (image_array, image_hash, ocr_lines, ocr_raw_text, rows, structure_modules)
+    return text_only_data, [], pending
+
+def reserve_structure_job():
+    """Reserva un puesto en la cola de trabajos de estructura; False si está llena"""
+    global _structure_pending
+    with _structure_pending_lock:
+        if _structure_pending >= max(1, OCR_STRUCTURE_MAX_PENDING):
+            return False
+        _structure_pending += 1
+        metrics.set_gauge('structure.jobs_pending', _structure_pending)
+        return True
+
+def release_structure_job():
+    global _structure_pending
+    with _structure_pending_lock:
+        _structure_pending -= 1
+        metrics.set_gauge('structure.jobs_pending', _structure_pending)
+
+def run_structure_job(job_id, pending, structure_engines, priority):
+    """
+    Fase 2 del modo progresivo (en structure_executor): PP-StructureV3 y extracción completa.
+    Vuelve a pasar por el planificador con la misma prioridad; no hay presupuesto porque el
+    cliente ya recibió la primera respuesta. Mide sus propias etapas: las de la petición
+    las sigue leyendo el hilo que responde
+    """
+    image_array, image_hash, ocr_lines, ocr_raw_text, rows, structure_modules = pending
+    del pending
+    stages = RequestStages(track_memory=OCR_MEMORY_TRACKING)
+    try:
+        skipped = []
+        with scheduler.slot(priority, timeout=OCR_POOL_TIMEOUT):
+            structure_data = run_structure_phase(image_array, structure_engines, Deadline(), stages, skipped,
+                                                 structure_modules)
+        del image_array
+        invoice_data = finish_pipeline(image_hash, ocr_lines, ocr_raw_text, rows, structure_data, stages)
+        jobs.complete(job_id, {'imageHash': image_hash, 'partial': bool(skipped),
+                               'skipped': skipped, 'data': invoice_data})
+        logger.info("✅ Trabajo %s completado (estructura)", job_id, extra={'fields': {
+            'event': 'ocr_job',
+            'job_id': job_id,
+            'image_hash': image_hash,
+            'skipped': skipped,
+            'stages_ms': {name: round(seconds * 1000, 1) for name, seconds in stages.timings.items()},
+        }})
+    except Exception as e:
+        logger.error("❌ Error en el trabajo %s: %s", job_id, e, exc_info=True)
+        jobs.fail(job_id, e)
+    finally:
+        release_structure_job()
+
+def job_payload(job, fields):
+    """Respuesta pública de un trabajo, con la selección de campos aplicada"""
+    payload = {'jobId': job['jobId'], 'status': job['status']}
+    if job['error']:
+        payload['error'] = job['error']
+    result = job['result']
+    if result is not None:
+        payload.update(success=True, imageHash=result['imageHash'], partial=result['partial'],
+                       skipped=result['skipped'], data=select_fields(result['data'], fields))
+    return payload
+
+def profile_payload(profile_report, stages):
+    """Resumen del perfil para la respuesta: tiempos por etapa y funciones más costosas"""
+    return {
+        'id': profile_report['id'],
+        'file': profile_report['file'],
+        'wall_seconds': profile_report['wall_seconds'],
+        'stages': {name: round(seconds, 4) for name, seconds in stages.timings.items()},
+        'top': profile_report['top'],
+    }
+
+def progressive_response(mode, first_payload, job_id, fields):
+    """
+    Primera respuesta del modo progresivo: JSON con jobId (mode=progressive) o un flujo
+    SSE con los eventos 'ocr', 'structure' (o 'error') y 'done'
+    """
+    if mode == 'progressive':
+        return json_response(first_payload)
+    
+    def generate():
+        yield sse_event('ocr', first_payload)
+        if job_id is not None:
+            job = jobs.get(job_id, wait=OCR_SSE_WAIT_SECONDS)
+            if job is None or job['status'] == PENDING:
+                yield sse_event('error', {'jobId': job_id, 'code': 'JOB_TIMEOUT',
+                                          'error': 'La fase de estructura no terminó a tiempo'})
+            elif job['result'] is None:
+                yield sse_event('error', job_payload(job, fields))
+            else:
+                yield sse_event('structure', job_payload(job, fields))
+        yield sse_event('done', {'jobId': job_id})
+    
+    return app.response_class(stream_with_context(generate()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/health', methods=['GET'])
 def health():
     """Endpoint de salud"""
     return jsonify({
         'status': 'ok',
-        'paddleocr_available': PADDLEOCR_AVAILABLE
+        'paddleocr_available': PADDLEOCR_AVAILABLE,
+        'spool_enabled': bool(OCR_SPOOL_DIR),
+        'store_enabled': ocr_store is not None,
+        'row_reconstruction': OCR_ROW_RECONSTRUCTION,
+        'structure_mode': OCR_STRUCTURE_MODE,
+        # Submódulos de PP-StructureV3 cargados ('default': tubería completa sin perfil)
+        'structure_profile': structure_profile.describe(),
+        'languages': list(OCR_LANGS),
+        'default_lang': OCR_LANG,
+        # Modelos cargados ahora mismo (del más al menos recientemente usado)
+        'resident_models': [model['lang'] for model in ocr_registry.resident()] if ocr_registry else [],
+        # Política de descarga por inactividad: residencia de cada motor y cargas/descargas recientes
+        'engines': engine_unloader.status()
     })
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas del servicio (contadores, tiempos y estado de los pools)"""
+    snapshot = metrics.snapshot()
+    snapshot['pools'] = {
+        'ocr': ocr_registry.stats() if ocr_registry else None,
+        'structure': structure_pool.stats() if structure_pool else None
+    }
+    snapshot['scheduler'] = scheduler.stats()
+    snapshot['jobs'] = jobs.stats()
+    snapshot['coalesce'] = inflight.stats()
+    snapshot['engines'] = engine_unloader.status()['engines']
+    return jsonify(snapshot)
+
+@app.before_request
+def assign_request_id():
+    """Id de petición para los logs: el de la cabecera X-Request-Id (p. ej. del backend Node.js) o uno nuevo"""
+    request_id_var.set(request.headers.get('X-Request-Id') or uuid.uuid4().hex[:16])
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers['X-Request-Id'] = request_id_var.get()
+    return response
+
+def summary_result(summary, image_hash, invoice_data, skipped, stages):
+    """Añade al resumen el resultado: campos encontrados, confianza y tiempos por etapa"""
+    summary.update(
+        image_hash=image_hash,
+        confidence=round(invoice_data.get('confidence') or 0.0, 3),
+        found={field: invoice_data.get(field) is not None for field in STRUCTURE_KEY_FIELDS},
+        partial=bool(skipped),
+        skipped=skipped,
+        stages_ms={name: round(seconds * 1000, 1) for name, seconds in stages.timings.items()},
+    )
+
+def log_request_summary(summary, response, started):
+    """Una línea estructurada por petición OCR: tiempos, campos encontrados y confianza"""
+    summary['status'] = response.status_code
+    summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    level = logging.ERROR if response.status_code >= 500 else logging.INFO
+    logger.log(level, 'ocr_request', extra={'fields': summary})
+
 @app.route('/ocr/process', methods=['POST'])
 def process_ocr():
     """
     Procesa una imagen con PaddleOCR y PP-StructureV3
     """
-    print("=" * 60)
-    print("🔔 RECIBIDA PETICIÓN OCR")
-    print(f"📥 Método: {request.method}")
-    print(f"📥 Content-Type: {request.content_type}")
-    print(f"📥 Headers: {dict(request.headers)}")
+    started = time.perf_counter()
+    summary = {'event': 'ocr_request'}
+    response = app.make_response(handle_ocr_request(summary))
+    log_request_summary(summary, response, started)
+    return response
+
+def handle_ocr_request(summary):
+    """Cuerpo de /ocr/process; rellena `summary` con los datos de la línea de resumen"""
+    logger.debug("🔔 Petición OCR: %s %s", request.method, request.content_type)
+    
+    deadline = Deadline()
+    skipped = []
     
     try:
         if not PADDLEOCR_AVAILABLE:
-            print("❌ PaddleOCR no está disponible")
+            logger.error("❌ PaddleOCR no está disponible")
+            summary['error'] = 'PADDLEOCR_UNAVAILABLE'
             return jsonify({
                 'error': 'PaddleOCR no está disponible. Instala las dependencias con: pip install -r requirements.txt'
             }), 500
         
-        print("📥 Obteniendo datos JSON...")
         data = request.get_json()
-        print(f"📥 Datos recibidos: {type(data)}, keys: {list(data.keys()) if isinstance(data, dict) else 'No es dict'}")
         
-        if not data or 'image' not in data:
-            print("❌ No se recibió imagen en los datos")
-            return jsonify({'error': 'Se requiere una imagen en base64'}), 400
+        if not data or ('image' not in data and 'imagePath' not in data):
+            logger.warning("❌ No se recibió imagen en los datos")
+            return jsonify({'error': 'Se requiere una imagen en base64 o imagePath'}), 400
         
-        image_data_len = len(data['image']) if data.get('image') else 0
-        print(f"📷 Imagen recibida: {image_data_len} caracteres en base64")
+        try:
+            fields = parse_fields(request.args.get('fields', data.get('fields')))
+            deadline = parse_deadline(data)
+            priority = parse_priority(data)
+            mode = parse_response_mode(data)
+            lang = parse_lang(data)
+            check_quality = not parse_flag(request.args.get('skipQualityCheck', data.get('skipQualityCheck')))
+            segment = parse_flag(request.args.get('segment', data.get('segment')))
+            structure_modules = structure_profile.resolve(
+                request.args.get('structureModules', data.get('structureModules')))
+            if segment and mode != 'sync':
+                raise ValueError('segment=true solo admite mode=sync')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        summary.update(mode=mode, lang=lang, priority=priority,
+                       source='spool' if 'imagePath' in data else 'base64')
         
-        # Inicializar OCR si no está inicializado
-        ocr, structure = init_ocr()
+        if 'imagePath' in data:
+            logger.debug("📷 Imagen recibida por spool: %s", data['imagePath'])
+        else:
+            logger.debug("📷 Imagen recibida: %d caracteres en base64", len(data['image']) if data.get('image') else 0)
         
-        # Convertir base64 a imagen
-        image_array = image_from_base64(data['image'])
+        # Inicializar OCR si no está inicializado
+        ocr_engines, structure_engines = init_ocr()
         
-        # Procesar con PP-OCRv5 (reconocimiento de texto)
-        print("📝 Procesando con PP-OCRv5...")
-        print(f"📷 Tamaño de imagen: {image_array.shape}")
+        # Perfilado opcional de esta petición (solo con el token de administración)
+        profile_header = request.headers.get('X-OCR-Profile')
+        if profile_header and not profiler.authorized(profile_header):
+            return jsonify({'error': 'Perfilado no autorizado', 'code': 'PROFILE_FORBIDDEN'}), 403
         
-        try:
-            # La nueva API usa predict() en lugar de ocr()
-            # predict() NO acepta el parámetro cls
-            if hasattr(ocr, 'predict'):
-                print("📝 Usando predict() (API nueva)")
-                ocr_result = ocr.predict(image_array)
-                print(f"✅ OCR completado con predict(), resultado tipo: {type(ocr_result)}")
-            else:
-                # Fallback a la API antigua si predict() no existe
-                print("📝 Usando ocr() (API antigua)")
-                try:
-                    ocr_result = ocr.ocr(image_array, cls=True)
-                    print(f"✅ OCR completado (con cls), resultado tipo: {type(ocr_result)}")
-                except TypeError:
-                    ocr_result = ocr.ocr(image_array)
-                    print(f"✅ OCR completado (sin cls), resultado tipo: {type(ocr_result)}")
-        except Exception as e:
-            print(f"❌ Error crítico en OCR: {e}")
-            import traceback
-            traceback.print_exc()
-            raise
+        stages = RequestStages(track_memory=OCR_MEMORY_TRACKING)
         
-        # Extraer texto del resultado de OCR
-        ocr_text_lines = []
-        if ocr_result:
-            try:
-                # La nueva API de PaddleOCR devuelve objetos con método .text
-                # o puede devolver listas con el formato antiguo
-                print(f"📋 Tipo de resultado OCR: {type(ocr_result)}")
-                print(f"📋 Resultado es None/False/Empty: {not ocr_result}")
-                if isinstance(ocr_result, list):
-                    print(f"📋 Lista tiene {len(ocr_result)} elementos")
-                    if len(ocr_result) > 0:
-                        print(f"📋 Primer elemento: tipo={type(ocr_result[0])}, valor={str(ocr_result[0])[:500]}")
-                print(f"📋 Resultado completo (primeros 2000 chars): {str(ocr_result)[:2000]}")
-                print(f"📋 Resultado es None/False/Empty: {not ocr_result}")
-                print(f"📋 Resultado completo (primeros 2000 chars): {str(ocr_result)[:2000]}")
-                
-                # Si es una lista (formato nuevo de predict() - lista de diccionarios)
-                if isinstance(ocr_result, list):
-                    print("📋 Formato: lista")
-                    print(f"📋 Longitud de lista: {len(ocr_result)}")
-                    
-                    # predict() devuelve una lista de diccionarios, uno por página
-                    for idx, page_result in enumerate(ocr_result):
-                        if not page_result:
-                            continue
-                        
-                        print(f"📋 Página {idx}: tipo={type(page_result)}")
-                        
-                        # El formato nuevo de predict() es un objeto OCRResult (no dict)
-                        # PRIMERO intentar como objeto (atributo) - esto es lo correcto
-                        rec_texts = None
-                        rec_scores = []
-                        
-                        # Intentar acceder como objeto (atributo) - FORMATO CORRECTO
-                        if hasattr(page_result, 'rec_texts'):
-                            rec_texts = page_result.rec_texts
-                            rec_scores = getattr(page_result, 'rec_scores', [])
-                            print(f"  📋 Acceso como objeto: rec_texts tiene {len(rec_texts) if isinstance(rec_texts, list) else 'N/A'} elementos")
-                        
-                        # Fallback: intentar acceder como diccionario (key)
-                        elif isinstance(page_result, dict) and 'rec_texts' in page_result:
-                            rec_texts = page_result['rec_texts']
-                            rec_scores = page_result.get('rec_scores', [])
-                            print(f"  📋 Acceso como dict: rec_texts tiene {len(rec_texts) if isinstance(rec_texts, list) else 'N/A'} elementos")
-                        
-                        # Extraer textos reconocidos
-                        if rec_texts is not None:
-                            if isinstance(rec_texts, list) and len(rec_texts) > 0:
-                                for text_idx, text in enumerate(rec_texts):
-                                    if text and text.strip():
-                                        confidence = rec_scores[text_idx] if text_idx < len(rec_scores) else 0.0
-                                        ocr_text_lines.append(text.strip())
-                                        print(f"    ✅ Texto {text_idx}: '{text.strip()}' (conf: {confidence:.2f})")
-                            elif isinstance(rec_texts, str) and rec_texts.strip():
-                                ocr_text_lines.append(rec_texts.strip())
-                                print(f"    ✅ Texto directo: '{rec_texts.strip()}'")
-                        
-                        # Fallback: buscar en otras keys/atributos comunes
-                        if not ocr_text_lines:
-                            # Intentar como objeto
-                            for attr_name in ['text', 'rec_text', 'content', 'result', 'ocr_text']:
-                                if hasattr(page_result, attr_name):
-                                    value = getattr(page_result, attr_name)
-                                    if isinstance(value, list) and len(value) > 0:
-                                        for item in value:
-                                            if isinstance(item, str) and item.strip():
-                                                ocr_text_lines.append(item.strip())
-                                    elif isinstance(value, str) and value.strip():
-                                        ocr_text_lines.append(value.strip())
-                                    if ocr_text_lines:
-                                        print(f"  ✅ Texto encontrado en atributo '{attr_name}'")
-                                        break
-                            
-                            # Intentar como diccionario
-                            if not ocr_text_lines and isinstance(page_result, dict):
-                                for key in ['text', 'rec_text', 'content', 'result', 'ocr_text']:
-                                    if key in page_result and page_result[key]:
-                                        value = page_result[key]
-                                        if isinstance(value, list):
-                                            for item in value:
-                                                if isinstance(item, str) and item.strip():
-                                                    ocr_text_lines.append(item.strip())
-                                        elif isinstance(value, str) and value.strip():
-                                            ocr_text_lines.append(value.strip())
-                                        if ocr_text_lines:
-                                            print(f"  ✅ Texto encontrado en key '{key}'")
-                                            break
-                        
-                        # Si el item es una lista anidada (formato antiguo de ocr())
-                        elif isinstance(page_result, list):
-                            print(f"  📋 Formato antiguo: lista anidada con {len(page_result)} elementos")
-                            for line_result in page_result:
-                                if not line_result:
-                                    continue
-                                
-                                text = None
-                                confidence = 0.0
-                                
-                                # Formato antiguo: [coordenadas, (texto, confianza)]
-                                if isinstance(line_result, (list, tuple)) and len(line_result) >= 2:
-                                    text_data = line_result[1]
-                                    if isinstance(text_data, (list, tuple)) and len(text_data) >= 1:
-                                        text = text_data[0]
-                                        confidence = text_data[1] if len(text_data) > 1 else 0.0
-                                    elif isinstance(text_data, str):
-                                        text = text_data
-                                
-                                if text and text.strip():
-                                    if confidence == 0.0 or confidence > 0.1:
-                                        ocr_text_lines.append(text.strip())
-                                        print(f"    ✅ Texto: '{text.strip()}' (conf: {confidence:.2f})")
-                        
-                        # Si el item es una string directamente
-                        elif isinstance(page_result, str) and page_result.strip():
-                            ocr_text_lines.append(page_result.strip())
-                            print(f"  ✅ Texto (directo): '{page_result.strip()}'")
-                        
-                        # Debug: mostrar estructura si no se pudo extraer
-                        if idx == 0 and len(ocr_text_lines) == 0:
-                            print(f"  ⚠️ No se pudo extraer texto de la página {idx}")
-                            print(f"  ⚠️ Estructura: {str(page_result)[:500]}")
-                
-                # Si tiene atributo text (nueva API predict())
-                elif hasattr(ocr_result, 'text'):
-                    print("📋 Formato: objeto con .text")
-                    text_value = ocr_result.text
-                    if isinstance(text_value, str):
-                        ocr_text_lines.append(text_value)
-                    elif isinstance(text_value, list):
-                        ocr_text_lines.extend([str(item) for item in text_value if item])
-                
-                # Si es un objeto con método get_text
-                elif hasattr(ocr_result, 'get_text'):
-                    print("📋 Formato: objeto con .get_text()")
-                    ocr_text_lines.append(ocr_result.get_text())
-                
-                # Si es un diccionario (resultado de predict() puede ser dict)
-                elif isinstance(ocr_result, dict):
-                    print("📋 Formato: diccionario")
-                    # Buscar texto en diferentes keys comunes
-                    for key in ['text', 'result', 'data', 'ocr_text', 'content', 'rec_text']:
-                        if key in ocr_result and ocr_result[key]:
-                            if isinstance(ocr_result[key], str):
-                                ocr_text_lines.append(ocr_result[key])
-                            elif isinstance(ocr_result[key], list):
-                                ocr_text_lines.extend([str(item) for item in ocr_result[key] if item])
-                            break
-                    # Si no encontramos texto, buscar en toda la estructura
-                    if not ocr_text_lines:
-                        print("📋 Buscando texto en toda la estructura del dict...")
-                        for key, value in ocr_result.items():
-                            if isinstance(value, str) and len(value) > 3:
-                                ocr_text_lines.append(value)
-                            elif isinstance(value, list):
-                                for item in value:
-                                    if isinstance(item, str) and len(item) > 3:
-                                        ocr_text_lines.append(item)
-                                    elif isinstance(item, dict):
-                                        # Buscar en sub-diccionarios
-                                        for sub_key, sub_value in item.items():
-                                            if isinstance(sub_value, str) and len(sub_value) > 3:
-                                                ocr_text_lines.append(sub_value)
-                
-                # Si es un objeto, intentar acceder a atributos comunes
-                elif hasattr(ocr_result, '__dict__'):
-                    print("📋 Formato: objeto con __dict__")
-                    for attr_name in ['text', 'result', 'data', 'ocr_text', 'content']:
-                        if hasattr(ocr_result, attr_name):
-                            attr_value = getattr(ocr_result, attr_name)
-                            if isinstance(attr_value, str) and attr_value:
-                                ocr_text_lines.append(attr_value)
-                                break
-                
+        with (profiler.profile() if profile_header else nullcontext()) as profile_report:
+            # Leer la imagen del spool compartido (mismo host) o decodificar base64 (remoto)
+            with stages.stage('decode'):
+                if 'imagePath' in data:
+                    try:
+                        image_array, image_hash = image_from_spool(data['imagePath'], check_quality)
+                    except SpoolPathError as e:
+                        logger.warning("❌ %s", e)
+                        summary['error'] = 'SPOOL_PATH_INVALID'
+                        return jsonify({'error': str(e), 'code': 'SPOOL_PATH_INVALID'}), 400
                 else:
-                    print(f"⚠️ Formato desconocido de resultado OCR")
-                    print(f"📋 Contenido completo (primeros 1000 chars): {str(ocr_result)[:1000]}")
-                    # Intentar convertir a string como último recurso
-                    result_str = str(ocr_result)
-                    if result_str and result_str != 'None' and len(result_str) > 10:
-                        ocr_text_lines.append(result_str)
-                    
-            except Exception as e:
-                print(f"⚠️ Error extrayendo texto de OCR result: {e}")
-                import traceback
-                traceback.print_exc()
-                # Intentar convertir a string como último recurso
-                ocr_text_lines = [str(ocr_result)]
-        
-        ocr_raw_text = '\n'.join(ocr_text_lines)
-        print(f"📄 Texto extraído ({len(ocr_raw_text)} caracteres, {len(ocr_text_lines)} líneas)")
-        if ocr_raw_text:
-            print(f"📝 Primeras líneas: {ocr_raw_text[:300]}")
-        else:
-            print("⚠️ No se extrajo ningún texto")
-        
-        # Procesar con PP-StructureV3 (estructura del documento) - solo si tenemos texto
-        invoice_data = {
-            'establishment': None,
-            'date': None,
-            'total': None,
-            'subtotal': None,
-            'tax': None,
-            'taxRate': None,
-            'rawText': ocr_raw_text,
-            'structure': {},
-            'tables': []
-        }
-        
-        if ocr_raw_text:
-            # Intentar extraer datos del texto usando el parser mejorado
-            if structure is not None:
+                    image_array, image_hash = image_from_base64(data['image'], check_quality)
+                    # Liberar la cadena base64 (puede ocupar varios MB) antes de la inferencia
+                    del data['image']
+            
+            # Esperar turno según la prioridad (las peticiones interactivas se atienden primero)
+            pending = None
+            receipts = None
+            if mode != 'sync':
+                with scheduler.slot(priority, timeout=deadline.timeout(OCR_POOL_TIMEOUT)):
+                    invoice_data, skipped, pending = run_progressive_pipeline(
+                        image_array, image_hash, ocr_engines, structure_engines, deadline, stages, lang,
+                        structure_modules)
+            elif OCR_COALESCE and profile_report is None:
+                # Reintentos y subidas dobles: la misma imagen con los mismos parámetros espera
+                # a la inferencia en curso en lugar de lanzar otra. La prioridad forma parte de la
+                # clave: una interactiva no debe esperar a una bulk que el planificador retrasa
+                key = (image_hash, lang, segment, structure_modules, priority)
                 try:
-                    print("📊 Procesando con PP-StructureV3...")
-                    # PP-StructureV3 usa el método predict(), no es callable directamente
-                    structure_result = structure.predict(image_array)
-                    structure_data = extract_invoice_data_from_structure(structure_result)
-                    # Combinar datos de estructura con texto OCR
-                    if structure_data.get('rawText'):
-                        invoice_data['rawText'] = ocr_raw_text  # Preferir texto de OCR directo
-                    invoice_data.update(structure_data)
-                    print("✅ PP-StructureV3 procesado correctamente")
-                except Exception as e:
-                    print(f"⚠️ Error procesando estructura: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    # Continuar solo con OCR si falla la estructura
+                    (invoice_data, receipts, skipped), coalesced = inflight.run(
+                        key, partial(run_sync_pipeline, image_array, image_hash, segment, ocr_engines,
+                                     structure_engines, deadline, stages, priority, lang, structure_modules),
+                        timeout=deadline.remaining())
+                except CoalesceTimeout:
+                    raise DeadlineExceeded(f'Presupuesto de {deadline.budget_ms:.0f} ms agotado esperando '
+                                           f'a una petición idéntica en curso')
+                summary['coalesced'] = coalesced
             else:
-                print("ℹ️ PP-StructureV3 no disponible, usando solo OCR")
-            
-            # Extraer datos del texto OCR directamente
-            print("🔍 Extrayendo datos del texto OCR...")
-            extract_data_from_text(ocr_raw_text, invoice_data)
+                invoice_data, receipts, skipped = run_sync_pipeline(
+                    image_array, image_hash, segment, ocr_engines, structure_engines, deadline, stages,
+                    priority, lang, structure_modules)
+        del image_array
         
-        # Calcular confianza basada en datos extraídos
-        confidence = 0.0
-        if invoice_data['establishment']:
-            confidence += 0.2
-        if invoice_data['date']:
-            confidence += 0.2
-        if invoice_data['total']:
-            confidence += 0.25
-        if invoice_data['subtotal']:
-            confidence += 0.2
-        if invoice_data['tax']:
-            confidence += 0.15
+        if mode != 'sync':
+            # Lanzar PP-StructureV3 en segundo plano (el hueco del planificador ya se liberó)
+            job_id = None
+            if pending is not None and reserve_structure_job():
+                job_id = jobs.create()
+                # copy_context: los logs del trabajo conservan el id de la petición
+                structure_executor.submit(contextvars.copy_context().run, run_structure_job, job_id,
+                                          pending, structure_engines, priority)
+            elif pending is not None:
+                # PP-StructureV3 va por detrás: no acumular más imágenes en memoria, el
+                # resultado del OCR pasa a ser el definitivo
+                _, _, ocr_lines, ocr_raw_text, rows, _ = pending
+                invoice_data = finish_pipeline(image_hash, ocr_lines, ocr_raw_text, rows, None, stages)
+                skipped.append('structure')
+                metrics.incr('structure.backlog_full')
+            del pending
+            summary_result(summary, image_hash, invoice_data, skipped, stages)
+            summary['job_id'] = job_id
+            first_payload = {
+                'success': True,
+                'imageHash': image_hash,
+                'partial': bool(skipped),
+                'skipped': skipped,
+                'jobId': job_id,
+                'pending': ['structure'] if job_id else [],
+                'data': select_fields(invoice_data, fields)
+            }
+            if profile_report is not None:
+                first_payload['profile'] = profile_payload(profile_report, stages)
+            return progressive_response(mode, first_payload, job_id, fields)
         
-        invoice_data['confidence'] = min(confidence, 1.0)
+        if OCR_MEMORY_TRACKING:
+            rss = memstats.current_rss_bytes()
+            if rss is not None:
+                metrics.set_gauge('memory.rss_mb', round(rss / 2**20, 1))
         
-        print(f"✅ Procesamiento completado")
-        print(f"📊 Confianza: {invoice_data['confidence']:.2%}")
-        print(f"🏢 Establecimiento: {invoice_data['establishment']}")
-        print(f"📅 Fecha: {invoice_data['date']}")
-        print(f"💰 Total: {invoice_data['total']}")
-        print("=" * 60)
+        if receipts is not None:
+            # Los clientes que solo leen `data` reciben el ticket de mayor superficie
+            main = max(receipts, key=lambda receipt: (receipt['box'][2] - receipt['box'][0]) *
+                                                      (receipt['box'][3] - receipt['box'][1]))
+            summary_result(summary, image_hash, main['data'], skipped, stages)
+            summary['receipts'] = len(receipts)
+            payload = {
+                'success': True,
+                'imageHash': image_hash,
+                'partial': bool(skipped),
+                'skipped': skipped,
+                'data': select_fields(main['data'], fields),
+                # Un resultado por ticket detectado, en orden de lectura
+                'receipts': [dict(receipt, data=select_fields(receipt['data'], fields)) for receipt in receipts]
+            }
+            if profile_report is not None:
+                payload['profile'] = profile_payload(profile_report, stages)
+            return json_response(payload)
         
-        return jsonify({
+        summary_result(summary, image_hash, invoice_data, skipped, stages)
+        
+        payload = {
             'success': True,
-            'data': invoice_data
-        })
+            'imageHash': image_hash,
+            # partial: se omitieron etapas opcionales (listadas en skipped) por falta de tiempo
+            'partial': bool(skipped),
+            'skipped': skipped,
+            'data': select_fields(invoice_data, fields)
+        }
+        if profile_report is not None:
+            payload['profile'] = profile_payload(profile_report, stages)
+        return json_response(payload)
+    
+    except ImageDecodeError as e:
+        # Entrada inválida (también en el spool: reenviarla en base64 no la arregla)
+        logger.warning("❌ %s", e)
+        summary['error'] = 'INVALID_IMAGE'
+        return jsonify({'error': str(e), 'code': 'INVALID_IMAGE'}), 400
+    
+    except ImageQualityError as e:
+        summary.update(error='IMAGE_QUALITY', reason=e.reason, quality=e.measurements)
+        return jsonify({
+            'error': str(e),
+            'code': 'IMAGE_QUALITY',
+            'reason': e.reason,
+            'quality': e.measurements
+        }), 422
+    
+    except ProfilerBusy as e:
+        summary['error'] = 'PROFILER_BUSY'
+        return jsonify({'error': str(e), 'code': 'PROFILER_BUSY'}), 409
+    
+    except DeadlineExceeded as e:
+        summary['error'] = 'DEADLINE_EXCEEDED'
+        metrics.incr('deadline.exceeded')
+        return jsonify({'error': str(e), 'code': 'DEADLINE_EXCEEDED'}), 504
+    
+    except PoolTimeout as e:
+        if deadline.expired():
+            summary['error'] = 'DEADLINE_EXCEEDED'
+            metrics.incr('deadline.exceeded')
+            return jsonify({'error': str(e), 'code': 'DEADLINE_EXCEEDED'}), 504
+        summary['error'] = 'OCR_BUSY'
+        return jsonify({'error': str(e), 'code': 'OCR_BUSY'}), 503
     
     except Exception as e:
-        print(f"❌ Error procesando OCR: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        print("=" * 60)
+        logger.exception("❌ Error procesando OCR: %s", e)
+        summary['error'] = type(e).__name__
         return jsonify({
             'error': f'Error procesando imagen: {str(e)}'
         }), 500
 
+@app.route('/ocr/jobs/<job_id>', methods=['GET'])
+def get_ocr_job(job_id):
+    """
+    Resultado de la fase de estructura de una petición progresiva.
+    ?wait=ms espera hasta ese tiempo a que termine; ?fields=... como en /ocr/process
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    wait_ms = request.args.get('wait', default=0, type=float)
+    job = jobs.get(job_id, wait=min(wait_ms, OCR_SSE_WAIT_SECONDS * 1000.0) / 1000.0 if wait_ms > 0 else None)
+    if job is None:
+        return jsonify({'error': 'Trabajo desconocido o caducado', 'code': 'JOB_NOT_FOUND'}), 404
+    return json_response(job_payload(job, fields))
+
+def debug_forbidden():
+    """
+    Respuesta 403 si la petición no trae el token de depuración (cabecera X-OCR-Profile
+    igual a OCR_PROFILE_TOKEN); None si está autorizada. Sin token configurado, los
+    endpoints /debug/* quedan cerrados
+    """
+    if not profiler.authorized(request.headers.get('X-OCR-Profile')):
+        return jsonify({'error': 'Depuración no autorizada', 'code': 'DEBUG_FORBIDDEN'}), 403
+    return None
+
+@app.route('/debug/memory', methods=['GET'])
+def debug_memory():
+    """
+    Estado de memoria del proceso, variación media por etapa y, si tracemalloc
+    está activo, los principales puntos de asignación (?top=N, por defecto 20).
+    Requiere X-OCR-Profile (recorrer el heap es caro)
+    """
+    forbidden = debug_forbidden()
+    if forbidden is not None:
+        return forbidden
+    top = request.args.get('top', default=20, type=int)
+    snapshot = memstats.memory_snapshot()
+    snapshot['tracking_enabled'] = OCR_MEMORY_TRACKING
+    snapshot['stages'] = {
+        name: timing for name, timing in metrics.snapshot()['timings'].items()
+        if name.startswith('memory.')
+    }
+    snapshot['top_allocations'] = memstats.top_allocations(top) if top > 0 else []
+    return jsonify(snapshot)
+
+@app.route('/debug/memory/tracemalloc', methods=['POST'])
+def debug_tracemalloc():
+    """Activa o desactiva tracemalloc: {"enabled": true, "frames": 10} (requiere X-OCR-Profile)"""
+    forbidden = debug_forbidden()
+    if forbidden is not None:
+        return forbidden
+    data = request.get_json(silent=True) or {}
+    if data.get('enabled', True):
+        memstats.start_tracing(int(data.get('frames', 10)))
+    else:
+        memstats.stop_tracing()
+    return jsonify({'success': True, 'tracing': memstats.traced_bytes() is not None})
+
+@app.route('/debug/profiles', methods=['GET'])
+def list_profiles():
+    """Perfiles guardados, del más reciente al más antiguo (requiere X-OCR-Profile)"""
+    if not profiler.authorized(request.headers.get('X-OCR-Profile')):
+        return jsonify({'error': 'Perfilado no autorizado', 'code': 'PROFILE_FORBIDDEN'}), 403
+    return jsonify({'profiles': profiler.list_profiles(), 'max_files': profiler.max_files})
+
+@app.route('/debug/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Descarga un perfil en formato pstats (requiere X-OCR-Profile)"""
+    if not profiler.authorized(request.headers.get('X-OCR-Profile')):
+        return jsonify({'error': 'Perfilado no autorizado', 'code': 'PROFILE_FORBIDDEN'}), 403
+    path = profiler.path_for(profile_id)
+    if path is None:
+        return jsonify({'error': 'Perfil no encontrado'}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'{profile_id}.prof')
+
+@app.route('/ocr/reextract', methods=['POST'])
+def reextract_ocr():
+    """
+    Re-ejecuta la extracción de campos sobre resultados OCR guardados, sin inferencia.
+    Acepta {"hash": "..."} o {"hashes": ["...", ...]}
+    """
+    if ocr_store is None:
+        return jsonify({'error': 'El almacén OCR no está habilitado (configura OCR_STORE_DIR)'}), 400
+    
+    data = request.get_json(silent=True) or {}
+    hashes = data.get('hashes') or ([data['hash']] if data.get('hash') else [])
+    if not hashes:
+        return jsonify({'error': 'Se requiere hash o hashes'}), 400
+    try:
+        fields = parse_fields(request.args.get('fields', data.get('fields')))
+    except FieldSelectionError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results = {}
+    missing = []
+    for image_hash in hashes:
+        try:
+            record = ocr_store.load(image_hash)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if record is None:
+            missing.append(image_hash)
+            continue
+        results[image_hash] = select_fields(reextract_from_record(record), fields)
+    
+    if 'hash' in data and not data.get('hashes'):
+        if missing:
+            return jsonify({'error': f'No hay resultado OCR guardado para {missing[0]}'}), 404
+        return json_response({'success': True, 'imageHash': hashes[0], 'data': results[hashes[0]]})
+    
+    return json_response({'success': True, 'results': results, 'missing': missing})
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    print(f"🚀 Servicio OCR iniciando en puerto {port}...")
-    print(f"📝 Usando PaddleOCR con PP-StructureV3")
-    app.run(host='0.0.0.0', port=port, debug=False)
+    logger.info("🚀 Servicio OCR iniciando en puerto %d (PaddleOCR con PP-StructureV3)", port)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
 
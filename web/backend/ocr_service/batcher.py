@@ -0,0 +1,100 @@
+"""
+Micro-batching dinámico de peticiones concurrentes.
+
+Las peticiones que llegan a la vez se agrupan durante una ventana corta
+(hasta `max_batch_size` elementos o `max_wait_ms` milisegundos) y se procesan
+en una sola llamada a `run_batch`. Cada petición recibe su propio resultado.
+
+Los elementos cuyo Future se canceló (la petición ya respondió, p. ej. con 504
+por su presupuesto de tiempo) o cuyo instante límite `expires_at` ya pasó no
+entran en ningún lote: bajo carga, que es cuando vencen los plazos, no ocupan
+huecos de las peticiones que siguen esperando.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from metrics import metrics
+
+class MicroBatcher:
+    """Agrupa elementos enviados con submit() y los procesa por lotes en segundo plano"""
+
+    def __init__(self, name, run_batch, max_batch_size=8, max_wait_ms=10, workers=1):
+        self.name = name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._run_batch = run_batch
+        self._queue = queue.Queue()
+        # Un lote en curso por worker: mientras todos están ocupados, las
+        # peticiones se acumulan y el siguiente lote sale más grande
+        self._free_workers = threading.Semaphore(max(1, int(workers)))
+        self._thread = threading.Thread(target=self._dispatch_loop, name=f'batcher-{name}', daemon=True)
+        self._thread.start()
+
+    def submit(self, item, expires_at=None):
+        """
+        Encola un elemento; devuelve un Future con su resultado individual. Si
+        `expires_at` (time.monotonic()) pasa antes de que entre en un lote, el Future
+        falla con TimeoutError sin procesarse; cancelarlo también lo retira
+        """
+        future = Future()
+        self._queue.put((item, future, time.monotonic(), expires_at))
+        return future
+
+    def _admit(self, entry):
+        """Marca el Future como en curso; False si ya no hay que procesar el elemento"""
+        _, future, _, expires_at = entry
+        if not future.set_running_or_notify_cancel():
+            metrics.incr(f'batch.{self.name}.cancelled')
+            return False
+        if expires_at is not None and time.monotonic() >= expires_at:
+            future.set_exception(FutureTimeoutError('Plazo vencido antes de entrar en un lote'))
+            metrics.incr(f'batch.{self.name}.expired')
+            return False
+        return True
+
+    def _dispatch_loop(self):
+        while True:
+            self._free_workers.acquire()
+            batch = []
+            while not batch:
+                entry = self._queue.get()
+                if self._admit(entry):
+                    batch.append(entry)
+            window_end = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = window_end - time.monotonic()
+                try:
+                    if remaining > 0:
+                        entry = self._queue.get(timeout=remaining)
+                    else:
+                        entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if self._admit(entry):
+                    batch.append(entry)
+            threading.Thread(target=self._run, args=(batch,), name=f'batch-{self.name}', daemon=True).start()
+
+    def _run(self, batch):
+        try:
+            now = time.monotonic()
+            for _, _, enqueued_at, _ in batch:
+                metrics.observe(f'batch.{self.name}.queue_wait', now - enqueued_at)
+            metrics.incr(f'batch.{self.name}.batches')
+            metrics.incr(f'batch.{self.name}.items', len(batch))
+            metrics.set_gauge(f'batch.{self.name}.last_size', len(batch))
+
+            try:
+                results = self._run_batch([item for item, _, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f'El lote devolvió {len(results)} resultados para {len(batch)} elementos')
+            except BaseException as e:
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                return
+
+            for (_, future, _, _), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            self._free_workers.release()
@@ -0,0 +1,78 @@
+"""
+Agrupación de peticiones idénticas en vuelo.
+
+Cuando el backend reintenta una llamada lenta o el usuario sube dos veces la
+misma foto, llega una segunda petición con la misma imagen mientras la primera
+sigue en inferencia. Las peticiones se identifican por una clave (el hash de la
+imagen junto con los parámetros que cambian el resultado): la primera ejecuta
+el cálculo y las que llegan mientras tanto esperan su resultado y lo comparten.
+
+Si el cálculo falla con una de las excepciones de `retry_on` (p. ej. el
+presupuesto de tiempo de la primera petición, que puede ser menor que el de
+las demás), las que esperaban lo repiten por su cuenta en lugar de heredar el
+error.
+"""
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from metrics import metrics
+
+class CoalesceTimeout(RuntimeError):
+    """Se agotó la espera al cálculo en curso de otra petición con la misma clave"""
+
+class InflightCoalescer:
+    """Comparte el resultado de `fn()` entre las llamadas concurrentes con la misma clave"""
+
+    def __init__(self, name, retry_on=()):
+        self.name = name
+        self.retry_on = tuple(retry_on)
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def run(self, key, fn, timeout=None):
+        """
+        Ejecuta `fn()` o espera al cálculo en curso con la misma clave. Devuelve
+        (resultado, compartido). Si la espera supera `timeout` segundos lanza
+        CoalesceTimeout; los errores del propio cálculo se propagan tal cual
+        """
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._inflight[key] = future
+
+            if leader:
+                try:
+                    result = fn()
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                else:
+                    future.set_result(result)
+                    return result, False
+                finally:
+                    with self._lock:
+                        self._inflight.pop(key, None)
+
+            metrics.incr(f'coalesce.{self.name}.waiting')
+            remaining = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            try:
+                result = future.result(timeout=remaining)
+            except self.retry_on:
+                # El error depende de la petición que calculaba, no de la imagen: repetir
+                continue
+            except FutureTimeoutError:
+                # En 3.11+ es el TimeoutError estándar: puede ser el error del cálculo
+                if future.done():
+                    raise
+                raise CoalesceTimeout(f'Sin resultado de la petición idéntica en curso tras {remaining:.1f}s')
+            metrics.incr(f'coalesce.{self.name}.coalesced')
+            return result, True
+
+    def stats(self):
+        with self._lock:
+            return {'inflight': len(self._inflight)}
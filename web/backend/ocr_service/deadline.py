@@ -0,0 +1,50 @@
+"""
+Presupuesto de tiempo por petición.
+
+El cliente indica cuánto tiempo está dispuesto a esperar (cabecera
+X-OCR-Deadline-Ms o parámetro deadlineMs); el pipeline lo consulta entre
+etapas y omite las opcionales (p. ej. PP-StructureV3) si no caben.
+"""
+import time
+
+class DeadlineExceeded(TimeoutError):
+    """Se agotó el presupuesto antes de completar una etapa obligatoria"""
+
+class Deadline:
+    """Instante límite de una petición (sin límite si budget_ms es None o <= 0)"""
+
+    def __init__(self, budget_ms=None):
+        self.budget_ms = budget_ms if budget_ms and budget_ms > 0 else None
+        self.expires_at = None if self.budget_ms is None else time.monotonic() + self.budget_ms / 1000.0
+
+    def remaining(self):
+        """Segundos restantes (None si no hay límite; nunca negativo)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, default=None):
+        """Tiempo máximo de espera para una operación: el menor entre lo restante y `default`"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return remaining if default is None else min(remaining, default)
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def allows(self, estimated_seconds):
+        """¿Queda tiempo para una etapa que se estima que tarda `estimated_seconds`?"""
+        remaining = self.remaining()
+        if remaining is None:
+            return True
+        if estimated_seconds is None:
+            # Sin historial no se puede estimar: solo se descarta si ya no queda tiempo
+            return remaining > 0
+        return remaining >= estimated_seconds
+
+    def check(self, stage):
+        """Lanza DeadlineExceeded si el presupuesto ya se agotó antes de `stage`"""
+        if self.expired():
+            raise DeadlineExceeded(f'Presupuesto de {self.budget_ms:.0f} ms agotado antes de {stage}')
@@ -0,0 +1,122 @@
+"""
+Pool de instancias de motores OCR con semántica de préstamo (checkout/return).
+
+Flask atiende peticiones en varios hilos; cada hilo toma una instancia del pool
+en exclusiva mientras ejecuta predict() y la devuelve al terminar. Las instancias
+se crean bajo demanda hasta `size`, y cada una se construye una sola vez (salvo
+que se descarguen con unload(): la siguiente petición las vuelve a crear).
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import metrics
+
+class PoolTimeout(RuntimeError):
+    """No se obtuvo una instancia del pool dentro del tiempo de espera"""
+
+class EnginePool:
+    """Pool de tamaño fijo de instancias creadas con `factory()`"""
+
+    def __init__(self, name, factory, size=1, timeout=None):
+        self.name = name
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self._factory = factory
+        self._cond = threading.Condition()
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._last_used = time.monotonic()
+
+    def preload(self, count=1):
+        """Crea instancias por adelantado (hasta `size`); los errores se propagan"""
+        for _ in range(min(count, self.size)):
+            with self.checkout():
+                pass
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Presta una instancia en exclusiva durante el bloque `with`"""
+        start = time.monotonic()
+        engine = self._acquire(self.timeout if timeout is None else timeout)
+        metrics.observe(f'pool.{self.name}.wait', time.monotonic() - start)
+        try:
+            yield engine
+        finally:
+            self._release(engine)
+
+    def _acquire(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._in_use += 1
+                    return self._idle.pop()
+                if self._created < self.size:
+                    # Reservar el hueco bajo el lock: la carga ocurre fuera para no
+                    # bloquear al resto, pero ningún otro hilo puede crear esta instancia
+                    self._created += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    metrics.incr(f'pool.{self.name}.timeouts')
+                    raise PoolTimeout(f'Sin instancias libres de {self.name} tras {timeout}s')
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            engine = self._factory()
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+        metrics.incr(f'pool.{self.name}.created')
+        with self._cond:
+            self._in_use += 1
+        return engine
+
+    def _release(self, engine):
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append(engine)
+            self._last_used = time.monotonic()
+            self._cond.notify()
+
+    def idle_time(self):
+        """Segundos desde la última devolución al pool (0 si hay instancias prestadas o esperas)"""
+        with self._cond:
+            if self._in_use or self._waiting:
+                return 0.0
+            return time.monotonic() - self._last_used
+
+    def unload(self):
+        """
+        Descarta las instancias ociosas si no hay ninguna prestada ni peticiones
+        esperando. Devuelve cuántas se descartaron; se recrean bajo demanda
+        """
+        with self._cond:
+            if self._in_use or self._waiting or not self._idle:
+                return 0
+            count = len(self._idle)
+            self._idle.clear()
+            self._created -= count
+        metrics.incr(f'pool.{self.name}.unloaded', count)
+        return count
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'idle_seconds': round(time.monotonic() - self._last_used, 1),
+            }
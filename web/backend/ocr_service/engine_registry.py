@@ -0,0 +1,223 @@
+"""
+Registro de motores OCR por idioma.
+
+Cada idioma tiene su propio EnginePool, que se crea la primera vez que llega
+una petición en ese idioma. Los idiomas residentes se mantienen en orden LRU y
+se descargan los menos usados cuando se supera el número máximo de modelos o
+el presupuesto de memoria, o cuando llevan demasiado tiempo sin usarse. Un
+idioma con peticiones en curso nunca se descarga; el idioma por defecto
+tampoco (siempre está cargado). Antes de cargar un idioma nuevo se hace sitio
+para él, y evict() debe llamarse también periódicamente (IdleUnloader) para
+que los idiomas ociosos se descarguen aunque no lleguen más peticiones.
+
+La memoria de cada modelo se estima por la variación de RSS al cargarlo.
+"""
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import memstats
+from engine_pool import EnginePool
+from metrics import metrics
+
+logger = logging.getLogger('ocr.engine_registry')
+
+class _Entry:
+    __slots__ = ('lang', 'pool', 'active', 'last_used', 'memory_bytes', 'loaded_at')
+
+    def __init__(self, lang, pool):
+        self.lang = lang
+        self.pool = pool
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.memory_bytes = 0
+        self.loaded_at = time.time()
+
+class EngineRegistry:
+    """
+    Pools de motores por idioma con desalojo LRU.
+
+    `factory(lang)` crea una instancia para un idioma. `max_models` limita los
+    idiomas residentes, `memory_budget_mb` la memoria estimada total (0 = sin
+    límite) e `idle_seconds` el tiempo sin uso antes de descargar un idioma
+    (0 = nunca)
+    """
+
+    def __init__(self, name, factory, languages, default_lang, pool_size=1, timeout=None,
+                 max_models=3, memory_budget_mb=0, idle_seconds=0):
+        self.name = name
+        self.languages = tuple(languages)
+        self.default_lang = default_lang
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_models = max(1, int(max_models))
+        self.memory_budget = int(memory_budget_mb * 2**20) if memory_budget_mb and memory_budget_mb > 0 else None
+        self.idle_seconds = idle_seconds if idle_seconds and idle_seconds > 0 else None
+        self._factory = factory
+        self._lock = threading.Lock()
+        # Del menos al más recientemente usado
+        self._entries = OrderedDict()
+
+    def _create_engine(self, entry):
+        """Crea una instancia para el pool de `entry` y acumula su memoria estimada"""
+        rss_before = memstats.current_rss_bytes()
+        engine = self._factory(entry.lang)
+        rss_after = memstats.current_rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            with self._lock:
+                entry.memory_bytes += max(0, rss_after - rss_before)
+        metrics.incr(f'models.{self.name}.loaded')
+        return engine
+
+    def _entry(self, lang):
+        """Entrada residente de `lang`, creándola si no existe (llamar con el lock tomado)"""
+        entry = self._entries.get(lang)
+        if entry is None:
+            entry = _Entry(lang, None)
+            entry.pool = EnginePool(f'{self.name}.{lang}', lambda: self._create_engine(entry),
+                                    self.pool_size, self.timeout)
+            self._entries[lang] = entry
+        else:
+            self._entries.move_to_end(lang)
+        return entry
+
+    def _make_room(self, lang):
+        """Si `lang` no está cargado, desaloja lo necesario para que quepa sin exceder los límites"""
+        with self._lock:
+            resident = lang in self._entries
+        if not resident:
+            self.evict(reserve=1)
+
+    def pool(self, lang):
+        """Pool del idioma (sin reservarlo: puede desalojarse en cuanto se libera)"""
+        if lang not in self.languages:
+            raise ValueError(f'Idioma no soportado: {lang}')
+        self._make_room(lang)
+        with self._lock:
+            return self._entry(lang).pool
+
+    @contextmanager
+    def checkout(self, lang=None, timeout=None):
+        """Presta una instancia del idioma `lang` (por defecto, el idioma por defecto)"""
+        lang = lang or self.default_lang
+        if lang not in self.languages:
+            raise ValueError(f'Idioma no soportado: {lang}')
+        self._make_room(lang)
+        with self._lock:
+            entry = self._entry(lang)
+            # Mientras haya peticiones en curso el idioma no se puede desalojar
+            entry.active += 1
+        try:
+            with entry.pool.checkout(timeout=timeout) as engine:
+                yield engine
+        finally:
+            with self._lock:
+                entry.active -= 1
+                entry.last_used = time.monotonic()
+            self.evict()
+
+    def preload(self, lang=None, count=1):
+        """Carga por adelantado `count` instancias de un idioma; los errores se propagan"""
+        pool = self.pool(lang or self.default_lang)
+        pool.preload(count)
+
+    def evict(self, reserve=0):
+        """
+        Descarga idiomas ociosos y, en orden LRU, los que excedan los límites.
+        `reserve` deja sitio para ese número de idiomas más (con la memoria media
+        de los cargados)
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for lang, entry in list(self._entries.items()):
+                if self._evictable(entry) and self.idle_seconds is not None \
+                        and now - entry.last_used > self.idle_seconds:
+                    evicted.append((self._entries.pop(lang), 'idle'))
+            for lang, entry in list(self._entries.items()):
+                if not self._over_limits(reserve):
+                    break
+                if self._evictable(entry):
+                    evicted.append((self._entries.pop(lang), 'lru'))
+            self._publish()
+        count = len(evicted)
+        for lang, memory_bytes, reason in [(e.lang, e.memory_bytes, r) for e, r in evicted]:
+            logger.info("♻️ Modelo %s '%s' descargado (%s, ~%.0f MB)", self.name, lang, reason, memory_bytes / 2**20)
+            metrics.incr(f'models.{self.name}.evicted.{reason}')
+        if count:
+            # Las instancias solo se liberan cuando desaparecen todas las referencias
+            del evicted, entry
+            gc.collect()
+        return count
+
+    def idle_time(self, lang=None):
+        """Segundos sin uso del idioma (0 si tiene peticiones en curso o no está cargado)"""
+        with self._lock:
+            entry = self._entries.get(lang or self.default_lang)
+            if entry is None or entry.active:
+                return 0.0
+            return time.monotonic() - entry.last_used
+
+    def instances(self, lang=None):
+        """Instancias cargadas del idioma"""
+        with self._lock:
+            entry = self._entries.get(lang or self.default_lang)
+            return entry.pool.stats()['created'] if entry is not None else 0
+
+    def unload(self, lang=None):
+        """
+        Descarta las instancias del idioma (por defecto, el idioma por defecto) sin
+        quitarlo del registro: la siguiente petición las vuelve a cargar. Devuelve
+        cuántas se descartaron (0 si el idioma tiene peticiones en curso)
+        """
+        with self._lock:
+            entry = self._entries.get(lang or self.default_lang)
+            if entry is None or entry.active:
+                return 0
+            count = entry.pool.unload()
+            if count:
+                entry.memory_bytes = 0
+                self._publish()
+        return count
+
+    def _evictable(self, entry):
+        return entry.active == 0 and entry.lang != self.default_lang
+
+    def _over_limits(self, reserve=0):
+        if len(self._entries) + reserve > self.max_models:
+            return True
+        if self.memory_budget is not None:
+            sizes = [entry.memory_bytes for entry in self._entries.values()]
+            expected = reserve * (sum(sizes) / len(sizes)) if reserve and sizes else 0
+            return sum(sizes) + expected > self.memory_budget
+        return False
+
+    def _publish(self):
+        metrics.set_gauge(f'models.{self.name}.resident', len(self._entries))
+        metrics.set_gauge(f'models.{self.name}.memory_mb', round(
+            sum(entry.memory_bytes for entry in self._entries.values()) / 2**20, 1))
+
+    def resident(self):
+        """Idiomas cargados, del más al menos recientemente usado"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'lang': entry.lang,
+                'active': entry.active,
+                'idle_seconds': round(now - entry.last_used, 1),
+                'memory_mb': round(entry.memory_bytes / 2**20, 1),
+                'instances': entry.pool.stats()['created'],
+            } for entry in reversed(self._entries.values())]
+
+    def stats(self):
+        return {
+            'default': self.default_lang,
+            'languages': list(self.languages),
+            'max_models': self.max_models,
+            'memory_budget_mb': round(self.memory_budget / 2**20) if self.memory_budget else None,
+            'idle_seconds': self.idle_seconds,
+            'resident': self.resident(),
+        }
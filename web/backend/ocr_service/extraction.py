@@ -0,0 +1,502 @@
+"""
+Extracción de campos de factura a partir del texto OCR y del resultado de
+PP-StructureV3.
+
+No ejecuta inferencia ni importa PaddleOCR: la usan tanto /ocr/process como la
+re-extracción sobre resultados guardados (reextract.py, /ocr/reextract), cuyos
+procesos no necesitan cargar los modelos ni el servicio Flask.
+"""
+import logging
+import os
+
+import numpy as np
+
+from layout import build_rows
+from ocr_store import record_lines
+
+logger = logging.getLogger('ocr.extraction')
+
+# Reconstrucción de filas visuales a partir de las cajas del detector antes de
+# extraer campos (OCR_ROW_TOLERANCE: fracción de la altura mediana de línea)
+OCR_ROW_RECONSTRUCTION = os.environ.get('OCR_ROW_RECONSTRUCTION', '1').lower() in ('1', 'true', 'yes')
+OCR_ROW_TOLERANCE = float(os.environ.get('OCR_ROW_TOLERANCE', '0.5'))
+
+def extract_invoice_data_from_structure(structure_result):
+    """
+    Extrae datos de factura de la estructura parseada por PP-StructureV3
+    El resultado de predict() es una lista de LayoutParsingResultV2
+    """
+    invoice_data = {
+        'establishment': None,
+        'date': None,
+        'total': None,
+        'subtotal': None,
+        'tax': None,
+        'taxRate': None,
+        'rawText': '',
+        'structure': {},
+        'tables': []
+    }
+    
+    all_text = []
+    tables = []
+    
+    # Procesar la estructura del documento
+    # structure_result es una lista de LayoutParsingResultV2 (objetos con atributos)
+    if isinstance(structure_result, list):
+        for page_result in structure_result:
+            # El resultado puede ser un objeto con atributos o un diccionario
+            # Intentar acceder como objeto primero
+            if hasattr(page_result, 'overall_ocr_res'):
+                ocr_res = page_result.overall_ocr_res
+                # Extraer textos reconocidos
+                if hasattr(ocr_res, 'rec_texts'):
+                    rec_texts = ocr_res.rec_texts
+                    if isinstance(rec_texts, list):
+                        all_text.extend([str(text) for text in rec_texts if text])
+                elif isinstance(ocr_res, dict) and 'rec_texts' in ocr_res:
+                    rec_texts = ocr_res['rec_texts']
+                    if isinstance(rec_texts, list):
+                        all_text.extend([str(text) for text in rec_texts if text])
+            
+            # Intentar acceder como diccionario
+            elif isinstance(page_result, dict):
+                # Texto de OCR general
+                if 'overall_ocr_res' in page_result:
+                    ocr_res = page_result['overall_ocr_res']
+                    if isinstance(ocr_res, dict) and 'rec_texts' in ocr_res:
+                        rec_texts = ocr_res['rec_texts']
+                        if isinstance(rec_texts, list):
+                            all_text.extend([str(text) for text in rec_texts if text])
+                
+                # Texto detectado (formato antiguo)
+                if 'text' in page_result:
+                    text_info = page_result.get('text', {})
+                    if isinstance(text_info, dict):
+                        text_content = text_info.get('content', '')
+                    else:
+                        text_content = str(text_info)
+                    if text_content:
+                        all_text.append(text_content)
+                
+                # Tablas detectadas
+                if 'table' in page_result:
+                    tables.append(page_result['table'])
+                elif 'table_res_list' in page_result:
+                    tables.extend(page_result['table_res_list'])
+                
+                # Estructura completa
+                if 'structure' in page_result:
+                    invoice_data['structure'] = page_result['structure']
+            
+            # Extraer tablas de table_res_list (atributo del objeto)
+            if hasattr(page_result, 'table_res_list'):
+                table_list = page_result.table_res_list
+                if isinstance(table_list, list):
+                    tables.extend(table_list)
+    
+    # Combinar todo el texto
+    invoice_data['rawText'] = '\n'.join(all_text)
+    if tables:
+        invoice_data['tables'] = tables
+    
+    # Intentar extraer datos específicos del texto
+    text_combined = invoice_data['rawText'].upper()
+    
+    # Extraer establecimiento (primera línea con texto significativo)
+    lines = [line.strip() for line in all_text if line.strip()]
+    if lines:
+        # Buscar nombre de empresa en las primeras líneas
+        for line in lines[:10]:
+            if len(line) > 3 and len(line) < 80:
+                # Excluir palabras comunes de facturas
+                excluded = ['FACTURA', 'TICKET', 'RECIBO', 'FECHA', 'TOTAL', 'IVA', 'SUBTOTAL']
+                if not any(word in line.upper() for word in excluded):
+                    if not line.upper().startswith(('C/', 'CALLE', 'AVDA', 'AVENIDA')):
+                        invoice_data['establishment'] = line
+                        break
+    
+    # Extraer fecha
+    import re
+    date_patterns = [
+        r'(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',
+        r'(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})',
+        r'FECHA[:\\s]*(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',
+    ]
+    
+    for pattern in date_patterns:
+        match = re.search(pattern, text_combined)
+        if match:
+            try:
+                groups = match.groups()
+                if len(groups) >= 3:
+                    if int(groups[0]) > 31:  # Formato YYYY-MM-DD
+                        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
+                    else:  # Formato DD-MM-YYYY
+                        day, month, year = int(groups[0]), int(groups[1]), int(groups[2])
+                        if year < 100:
+                            year += 2000
+                    invoice_data['date'] = f"{year}-{month:02d}-{day:02d}"
+                    break
+            except:
+                pass
+    
+    # Extraer valores monetarios
+    # Total
+    total_patterns = [
+        r'TOTAL[^\n]*?([\d]+[.,]\d{2})',
+        r'TOTAL\s+A\s+PAGAR[^\n]*?([\d]+[.,]\d{2})',
+        r'TOTAL\s+EUR[^\n]*?([\d]+[.,]\d{2})',
+    ]
+    
+    for pattern in total_patterns:
+        match = re.search(pattern, text_combined)
+        if match:
+            try:
+                value_str = match.group(1).replace(',', '.')
+                invoice_data['total'] = float(value_str)
+                break
+            except:
+                pass
+    
+    # Subtotal/Base Imponible
+    subtotal_patterns = [
+        r'BASE\s*IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
+        r'B\.?IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
+        r'SUBTOTAL[^\n]*?([\d]+[.,]\d{2})',
+    ]
+    
+    for pattern in subtotal_patterns:
+        match = re.search(pattern, text_combined)
+        if match:
+            try:
+                value_str = match.group(1).replace(',', '.')
+                invoice_data['subtotal'] = float(value_str)
+                break
+            except:
+                pass
+    
+    # IVA
+    tax_patterns = [
+        r'I\.?V\.?A\.?\s*\d+[,.]?\d*\s*%[^\n]*?([\d]+[.,]\d{2})',
+        r'CUOTA[^\n]*?([\d]+[.,]\d{2})',
+        r'IVA[^\n]*?([\d]+[.,]\d{2})',
+    ]
+    
+    for pattern in tax_patterns:
+        match = re.search(pattern, text_combined)
+        if match:
+            try:
+                value_str = match.group(1).replace(',', '.')
+                invoice_data['tax'] = float(value_str)
+                break
+            except:
+                pass
+    
+    # Tasa IVA
+    tax_rate_patterns = [
+        r'I\.?V\.?A\.?\s*([\d.,]+)\s*%',
+        r'(\d+)\s*%\s*:?\s*BASE',
+    ]
+    
+    for pattern in tax_rate_patterns:
+        match = re.search(pattern, text_combined)
+        if match:
+            try:
+                rate_str = match.group(1).replace(',', '.')
+                rate = float(rate_str)
+                if 1 <= rate <= 25:
+                    invoice_data['taxRate'] = rate / 100.0
+                    break
+            except:
+                pass
+    
+    # Si tenemos tablas, intentar extraer datos de ellas
+    if tables:
+        invoice_data['tables'] = tables
+    
+    return invoice_data
+
+def extract_data_from_text(text, invoice_data):
+    """
+    Extrae datos de factura directamente del texto OCR
+    """
+    import re
+    text_upper = text.upper()
+    
+    # Extraer establecimiento (mejorado)
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    excluded_words = ['FACTURA', 'TICKET', 'RECIBO', 'FECHA', 'TOTAL', 'IVA', 'SUBTOTAL', 
+                      'BASE', 'IMPONIBLE', 'C/', 'CALLE', 'AVDA', 'AVENIDA']
+    
+    for line in lines[:15]:
+        line_upper = line.upper()
+        # Buscar líneas con texto significativo que no sean números o direcciones
+        if (len(line) > 3 and len(line) < 80 and 
+            not re.match(r'^[\d\s.,€$]+$', line) and
+            not any(word in line_upper for word in excluded_words) and
+            not line_upper.startswith(('C/', 'CALLE', 'AVDA', 'AVENIDA', 'PLAZA'))):
+            # Verificar que tenga al menos algunas letras
+            if re.search(r'[A-Za-z]{3,}', line):
+                invoice_data['establishment'] = line
+                break
+    
+    # Extraer fecha (mejorado)
+    date_patterns = [
+        r'FECHA[:\\s]*(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',  # "FECHA 09/08/2025" - PRIORIDAD
+        r'(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})',  # "09/08/2025"
+        r'(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})',  # "2025/08/09"
+    ]
+    
+    for pattern in date_patterns:
+        match = re.search(pattern, text_upper)
+        if match:
+            try:
+                groups = match.groups()
+                if len(groups) >= 3:
+                    if int(groups[0]) > 31:  # Formato YYYY-MM-DD
+                        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
+                    else:  # Formato DD-MM-YYYY o MM-DD-YYYY
+                        # Intentar determinar el formato
+                        first = int(groups[0])
+                        second = int(groups[1])
+                        third = int(groups[2])
+                        
+                        if first > 12:  # Primer número > 12, debe ser día
+                            day, month, year = first, second, third
+                        elif second > 12:  # Segundo número > 12, debe ser día
+                            month, day, year = first, second, third
+                        else:  # Ambos < 12, asumir DD-MM-YYYY (formato español)
+                            day, month, year = first, second, third
+                        
+                        if year < 100:
+                            year += 2000
+                    
+                    # Validar que la fecha sea razonable
+                    if 2000 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
+                        invoice_data['date'] = f"{year}-{month:02d}-{day:02d}"
+                        logger.debug(f"✅ Fecha extraída: {invoice_data['date']}")
+                        break
+            except Exception as e:
+                logger.debug(f"⚠️ Error extrayendo fecha: {e}")
+                pass
+    
+    # Extraer valores monetarios (mejorado)
+    # PRIMERO: Intentar capturar el formato completo "BASE IMP IVA 36,82 10% 3,68"
+    # El texto puede tener espacios o no: "BASE IMP IVA" o "BASEIMPIVA"
+    base_iva_patterns = [
+        r'BASE\s+IMP\s+IVA\s+([\d]+[.,]\d{2})\s+(\d+)\s*%\s+([\d]+[.,]\d{2})',  # Con espacios
+        r'BASE\s*IMP\s*IVA\s+([\d]+[.,]\d{2})\s+(\d+)\s*%\s+([\d]+[.,]\d{2})',  # Espacios opcionales
+        r'BASE\s*IMP\s*IVA[^\d]*([\d]+[.,]\d{2})[^\d]*(\d+)\s*%[^\d]*([\d]+[.,]\d{2})',  # Más flexible
+    ]
+    
+    for base_iva_pattern in base_iva_patterns:
+        match = re.search(base_iva_pattern, text_upper)
+        if match:
+            try:
+                # Base imponible
+                base_str = match.group(1).replace(',', '.').replace(' ', '')
+                invoice_data['subtotal'] = float(base_str)
+                logger.debug(f"✅ Subtotal extraído: {invoice_data['subtotal']}")
+                
+                # Tasa IVA
+                rate_str = match.group(2).replace(',', '.').replace(' ', '')
+                rate = float(rate_str)
+                if 1 <= rate <= 25:
+                    invoice_data['taxRate'] = rate / 100.0
+                    logger.debug(f"✅ Tasa IVA extraída: {invoice_data['taxRate']*100}%")
+                
+                # IVA
+                tax_str = match.group(3).replace(',', '.').replace(' ', '')
+                invoice_data['tax'] = float(tax_str)
+                logger.debug(f"✅ IVA extraído: {invoice_data['tax']}")
+                break  # Si encontramos el patrón completo, no buscar más
+            except Exception as e:
+                logger.debug(f"⚠️ Error extrayendo BASE IMP IVA: {e}")
+                continue
+    
+    # Total - buscar después de "TOTAL"
+    total_patterns = [
+        r'TOTAL[^\n]*?([\d]+[.,]\d{2})\s*€?',  # Mejorado: captura después de TOTAL
+        r'TOTAL\s+A\s+PAGAR[^\n]*?([\d]+[.,]\d{2})',
+        r'TOTAL\s+EUR[^\n]*?([\d]+[.,]\d{2})',
+        r'TOTAL\s+([\d]+[.,]\d{2})\s*€',  # Formato: "TOTAL 40,50 €"
+    ]
+    
+    for pattern in total_patterns:
+        matches = re.finditer(pattern, text_upper)
+        for match in matches:
+            try:
+                value_str = match.group(1).replace(',', '.').replace(' ', '')
+                value = float(value_str)
+                # Solo actualizar si es mayor que el actual o si no hay total
+                if value > 0 and (invoice_data['total'] is None or value > invoice_data['total']):
+                    invoice_data['total'] = value
+                    logger.debug(f"✅ Total extraído: {invoice_data['total']}")
+            except Exception as e:
+                logger.debug(f"⚠️ Error extrayendo total: {e}")
+    
+    # Subtotal (si no se extrajo antes)
+    if invoice_data['subtotal'] is None:
+        subtotal_patterns = [
+            r'BASE\s*IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
+            r'B\.?IMPONIBLE[^\n]*?([\d]+[.,]\d{2})',
+            r'BASE\s+IMP[^\n]*?([\d]+[.,]\d{2})',  # Formato: "BASE IMP 36,82"
+            r'SUBTOTAL[^\n]*?([\d]+[.,]\d{2})',
+        ]
+        
+        for pattern in subtotal_patterns:
+            match = re.search(pattern, text_upper)
+            if match:
+                try:
+                    value_str = match.group(1).replace(',', '.').replace(' ', '')
+                    invoice_data['subtotal'] = float(value_str)
+                    logger.debug(f"✅ Subtotal extraído: {invoice_data['subtotal']}")
+                    break
+                except Exception as e:
+                    logger.debug(f"⚠️ Error extrayendo subtotal: {e}")
+    
+    # IVA (si no se extrajo antes)
+    if invoice_data['tax'] is None:
+        tax_patterns = [
+            r'CUOTA[^\n]*?([\d]+[.,]\d{2})',  # "CUOTA 3,68"
+            r'I\.?V\.?A\.?\s*\d+[,.]?\d*\s*%[^\n]*?([\d]+[.,]\d{2})',
+            r'IVA[^\n]*?([\d]+[.,]\d{2})',
+        ]
+        
+        for pattern in tax_patterns:
+            match = re.search(pattern, text_upper)
+            if match:
+                try:
+                    value_str = match.group(1).replace(',', '.').replace(' ', '')
+                    invoice_data['tax'] = float(value_str)
+                    logger.debug(f"✅ IVA extraído: {invoice_data['tax']}")
+                    break
+                except Exception as e:
+                    logger.debug(f"⚠️ Error extrayendo IVA: {e}")
+    
+    # Tasa IVA (si no se extrajo antes)
+    if invoice_data['taxRate'] is None:
+        tax_rate_patterns = [
+            r'I\.?V\.?A\.?\s*(\d+)\s*%',  # "IVA 10%"
+            r'(\d+)\s*%\s*:?\s*BASE',
+            r'BASE\s+IMP\s+IVA[^\n]*?(\d+)\s*%',  # En el contexto de "BASE IMP IVA"
+        ]
+        
+        for pattern in tax_rate_patterns:
+            match = re.search(pattern, text_upper)
+            if match:
+                try:
+                    rate_str = match.group(1).replace(',', '.').replace(' ', '')
+                    rate = float(rate_str)
+                    if 1 <= rate <= 25:
+                        invoice_data['taxRate'] = rate / 100.0
+                        logger.debug(f"✅ Tasa IVA extraída: {invoice_data['taxRate']*100}%")
+                        break
+                except Exception as e:
+                    logger.debug(f"⚠️ Error extrayendo tasa IVA: {e}")
+
+def json_safe(value):
+    """Convierte resultados de PaddleOCR (numpy, objetos) a tipos serializables en JSON"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(k): json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    return str(value)
+
+def _compact_table(table):
+    """Conserva solo el HTML reconocido de una tabla (lo único que se usa después)"""
+    if isinstance(table, dict) and 'pred_html' in table:
+        return {'pred_html': table['pred_html']}
+    if hasattr(table, 'pred_html'):
+        return {'pred_html': table.pred_html}
+    return json_safe(table)
+
+def normalize_structure_data(structure_data):
+    """
+    Convierte el resultado de extract_invoice_data_from_structure() en una página
+    con formato de diccionario serializable, que extract_invoice_data_from_structure()
+    vuelve a aceptar en la re-extracción
+    """
+    if structure_data is None:
+        return None
+    raw_text = structure_data.get('rawText') or ''
+    return [{
+        'overall_ocr_res': {'rec_texts': raw_text.split('\n') if raw_text else []},
+        'table_res_list': [_compact_table(table) for table in structure_data.get('tables') or []],
+        'structure': json_safe(structure_data.get('structure') or {}),
+    }]
+
+def compute_confidence(invoice_data):
+    """Calcula la confianza basada en los datos extraídos"""
+    confidence = 0.0
+    if invoice_data['establishment']:
+        confidence += 0.2
+    if invoice_data['date']:
+        confidence += 0.2
+    if invoice_data['total']:
+        confidence += 0.25
+    if invoice_data['subtotal']:
+        confidence += 0.2
+    if invoice_data['tax']:
+        confidence += 0.15
+    return min(confidence, 1.0)
+
+def build_invoice_data(ocr_raw_text, structure_data=None):
+    """
+    Construye invoice_data a partir del texto OCR y, si existe, del resultado
+    de extract_invoice_data_from_structure(). No ejecuta inferencia: se usa tanto
+    en /ocr/process como en la re-extracción sobre resultados guardados
+    """
+    invoice_data = {
+        'establishment': None,
+        'date': None,
+        'total': None,
+        'subtotal': None,
+        'tax': None,
+        'taxRate': None,
+        'rawText': ocr_raw_text,
+        'structure': {},
+        'tables': []
+    }
+    
+    if ocr_raw_text:
+        if structure_data is not None:
+            # Combinar datos de estructura con texto OCR
+            if structure_data.get('rawText'):
+                invoice_data['rawText'] = ocr_raw_text  # Preferir texto de OCR directo
+            invoice_data.update(structure_data)
+        
+        # Extraer datos del texto OCR directamente
+        logger.debug("🔍 Extrayendo datos del texto OCR...")
+        extract_data_from_text(ocr_raw_text, invoice_data)
+    
+    invoice_data['confidence'] = compute_confidence(invoice_data)
+    return invoice_data
+
+def build_ocr_text(ocr_lines):
+    """
+    Construye el texto que se pasa a extract_data_from_text().
+    Con OCR_ROW_RECONSTRUCTION las líneas se agrupan en filas visuales usando sus
+    cajas; sin cajas se mantiene el orden del detector. Devuelve (texto, filas o None)
+    """
+    rows = build_rows(ocr_lines, OCR_ROW_TOLERANCE) if OCR_ROW_RECONSTRUCTION else None
+    if rows is not None:
+        return '\n'.join(row['text'] for row in rows), rows
+    return '\n'.join(line['text'] for line in ocr_lines), None
+
+def reextract_from_record(record):
+    """Repite solo la extracción de campos sobre un registro de OcrStore"""
+    ocr_raw_text, rows = build_ocr_text(record_lines(record))
+    structure_data = None
+    if record.get('structure') is not None:
+        structure_data = extract_invoice_data_from_structure(record['structure'])
+    invoice_data = build_invoice_data(ocr_raw_text, structure_data)
+    invoice_data['rows'] = rows or []
+    return invoice_data
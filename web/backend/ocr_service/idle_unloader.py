@@ -0,0 +1,162 @@
+"""
+Descarga de motores ociosos para liberar memoria fuera de las horas de uso.
+
+Un hilo en segundo plano revisa cada `interval` segundos los motores
+registrados (PP-StructureV3 y, opcionalmente, el OCR del idioma por defecto):
+
+- los que llevan más de `idle_seconds` sin usarse se descargan ('idle')
+- si el RSS del proceso supera `rss_limit_mb`, se descargan en orden de
+  registro los que no están en uso hasta bajar del límite ('memory')
+
+El mismo hilo ejecuta tareas periódicas registradas con add_task() (p. ej. el
+desalojo de idiomas ociosos de EngineRegistry), que funcionan aunque no haya
+ninguna política de descarga activa.
+
+Un motor con peticiones en curso nunca se descarga. La siguiente petición lo
+vuelve a cargar de forma transparente (el pool crea las instancias bajo
+demanda), pagando el tiempo de carga. Las cargas y descargas recientes se
+conservan para /health y se cuentan en /metrics.
+"""
+import gc
+import logging
+import threading
+import time
+from collections import deque
+
+import memstats
+from metrics import metrics
+
+logger = logging.getLogger('ocr.idle_unloader')
+
+class _Target:
+    __slots__ = ('name', 'idle_time', 'unload', 'instances')
+
+    def __init__(self, name, idle_time, unload, instances):
+        self.name = name
+        self.idle_time = idle_time
+        self.unload = unload
+        self.instances = instances
+
+class IdleUnloader:
+    """
+    Política de descarga por inactividad (`idle_seconds`, 0 = desactivada) o por
+    memoria (`rss_limit_mb`, 0 = desactivada), revisada cada `interval` segundos
+    """
+
+    def __init__(self, idle_seconds=0, rss_limit_mb=0, interval=30, max_events=50):
+        self.idle_seconds = idle_seconds if idle_seconds and idle_seconds > 0 else None
+        self.rss_limit = int(rss_limit_mb * 2**20) if rss_limit_mb and rss_limit_mb > 0 else None
+        self.interval = max(1.0, float(interval))
+        self._targets = []
+        self._tasks = []
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.idle_seconds is not None or self.rss_limit is not None
+
+    def add(self, name, idle_time, unload, instances):
+        """
+        Registra un motor: `idle_time()` devuelve su tiempo sin uso, `unload()` lo
+        descarga (devuelve cuántas instancias descartó) e `instances()` cuántas tiene cargadas
+        """
+        with self._lock:
+            self._targets.append(_Target(name, idle_time, unload, instances))
+
+    def add_task(self, task):
+        """Registra una función que se llama en cada revisión"""
+        with self._lock:
+            self._tasks.append(task)
+
+    def start(self):
+        """Arranca el hilo de revisión (una sola vez y solo si hay política activa o tareas)"""
+        with self._lock:
+            if not (self.enabled or self._tasks) or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='idle-unloader', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                tasks = list(self._tasks)
+            for task in tasks:
+                try:
+                    task()
+                except Exception as e:
+                    logger.error("❌ Error en la tarea periódica %s: %s", getattr(task, '__name__', task), e,
+                                 exc_info=True)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("❌ Error revisando motores ociosos: %s", e, exc_info=True)
+
+    def check(self):
+        """Aplica la política una vez. Devuelve el número de motores descargados"""
+        with self._lock:
+            targets = list(self._targets)
+        unloaded = 0
+        if self.idle_seconds is not None:
+            for target in targets:
+                if target.idle_time() >= self.idle_seconds and self._unload(target, 'idle'):
+                    unloaded += 1
+        if self.rss_limit is not None:
+            for target in targets:
+                rss = memstats.current_rss_bytes()
+                if rss is None or rss <= self.rss_limit:
+                    break
+                if self._unload(target, 'memory'):
+                    unloaded += 1
+        return unloaded
+
+    def _unload(self, target, reason):
+        count = target.unload()
+        if not count:
+            return False
+        # Las instancias solo se liberan cuando desaparecen todas las referencias
+        gc.collect()
+        memstats.release_free_memory()
+        self._record(target.name, 'unloaded', reason)
+        metrics.incr(f'models.{target.name}.unloaded.{reason}')
+        logger.info("💤 Motor %s descargado (%s, %d instancias)", target.name, reason, count)
+        return True
+
+    def record_load(self, name):
+        """Registra la carga de una instancia (lo llaman las factorías de motores)"""
+        self._record(name, 'loaded', None)
+
+    def _record(self, name, event, reason):
+        rss = memstats.current_rss_bytes()
+        with self._lock:
+            self._events.append({
+                'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'engine': name,
+                'event': event,
+                'reason': reason,
+                'rss_mb': round(rss / 2**20, 1) if rss is not None else None,
+            })
+
+    def status(self):
+        """Residencia actual de cada motor, política y eventos recientes (para /health)"""
+        with self._lock:
+            targets = list(self._targets)
+            events = list(self._events)
+        rss = memstats.current_rss_bytes()
+        return {
+            'enabled': self.enabled,
+            'idle_seconds': self.idle_seconds,
+            'rss_limit_mb': round(self.rss_limit / 2**20) if self.rss_limit else None,
+            'rss_mb': round(rss / 2**20, 1) if rss is not None else None,
+            'engines': {target.name: {
+                'resident': target.instances() > 0,
+                'instances': target.instances(),
+                'idle_seconds': round(target.idle_time(), 1),
+            } for target in targets},
+            'events': events,
+        }
@@ -0,0 +1,253 @@
+"""
+Ingesta masiva de facturas en la base de datos SQLite del backend (facturas.db).
+
+Procesa un directorio de imágenes con el mismo pipeline que /ocr/process (o lee
+resultados ya extraídos de un JSONL, p. ej. la salida de reextract.py) y las
+inserta en la tabla `facturas` por lotes, cada lote en una sola transacción.
+Cada imagen se identifica por el SHA-256 de sus bytes (el mismo imageHash que
+devuelve el servicio); las ya ingeridas se guardan en `facturas_ocr` y se
+omiten en ejecuciones posteriores, sin volver a pasar por el OCR.
+
+Como en las subidas del backend, cada imagen ingerida se copia a
+web/backend/uploads con un nombre `<milisegundos>-<nombre original>` y ese
+nombre es el que se guarda en `archivo`.
+
+Uso:
+    python ingest.py --images ./historico --db ../facturas.db [--uploads ../uploads] [--workers 2] [--batch-size 500]
+                     [--skip-quality-check]
+    python ingest.py --jsonl resultados.jsonl --db ../facturas.db
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'facturas.db')
+# Directorio que sirve el backend en /uploads (el mismo que usa multer en src/index.js)
+DEFAULT_UPLOADS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'uploads')
+
+# Mismo esquema que web/backend/src/database.js (por si la base de datos aún no existe)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS facturas (
+  id TEXT PRIMARY KEY,
+  establecimiento TEXT,
+  fecha TEXT,
+  total REAL,
+  subtotal REAL,
+  iva REAL,
+  tasa_iva REAL,
+  concepto TEXT,
+  archivo TEXT,
+  tipo TEXT DEFAULT 'recibida',
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS facturas_ocr (
+  image_hash TEXT PRIMARY KEY,
+  factura_id TEXT,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (factura_id) REFERENCES facturas(id) ON DELETE CASCADE
+);
+"""
+
+INSERT_FACTURA = """
+INSERT INTO facturas (id, establecimiento, fecha, total, subtotal, iva, tasa_iva, concepto, archivo, tipo)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'recibida')
+"""
+
+INSERT_HASH = "INSERT INTO facturas_ocr (image_hash, factura_id) VALUES (?, ?)"
+
+def open_database(path):
+    """Abre la base de datos en modo WAL y crea las tablas que falten"""
+    conn = sqlite3.connect(path)
+    # WAL: el backend Node.js puede seguir leyendo mientras se escriben los lotes
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def known_hashes(conn):
+    return {row[0] for row in conn.execute('SELECT image_hash FROM facturas_ocr')}
+
+def factura_row(invoice_data, archivo):
+    """Convierte invoice_data en los valores de INSERT_FACTURA (id incluido)"""
+    return (
+        str(uuid.uuid4()),
+        invoice_data.get('establishment'),
+        invoice_data.get('date'),
+        invoice_data.get('total'),
+        invoice_data.get('subtotal'),
+        invoice_data.get('tax'),
+        # Fracción (0.10), igual que el formulario del frontend
+        invoice_data.get('taxRate'),
+        None,
+        archivo,
+    )
+
+class Ingestor:
+    """Acumula facturas y las escribe en lotes de `batch_size`, una transacción por lote"""
+
+    def __init__(self, conn, batch_size=500):
+        self.conn = conn
+        self.batch_size = max(1, batch_size)
+        self.seen = known_hashes(conn)
+        self.inserted = 0
+        self.skipped = 0
+        self._facturas = []
+        self._hashes = []
+
+    def add(self, image_hash, invoice_data, archivo):
+        if image_hash in self.seen:
+            self.skipped += 1
+            return
+        self.seen.add(image_hash)
+        row = factura_row(invoice_data, archivo)
+        self._facturas.append(row)
+        self._hashes.append((image_hash, row[0]))
+        if len(self._facturas) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._facturas:
+            return
+        with self.conn:
+            self.conn.executemany(INSERT_FACTURA, self._facturas)
+            self.conn.executemany(INSERT_HASH, self._hashes)
+        self.inserted += len(self._facturas)
+        self._facturas.clear()
+        self._hashes.clear()
+
+def copy_to_uploads(path, uploads_dir):
+    """
+    Copia la imagen a `uploads_dir` con un nombre único al estilo de multer
+    (`<milisegundos>-<nombre original>`) y devuelve ese nombre
+    """
+    basename = os.path.basename(path)
+    stamp = int(time.time() * 1000)
+    while True:
+        filename = f'{stamp}-{basename}'
+        target = os.path.join(uploads_dir, filename)
+        try:
+            # 'x': no sobrescribir si otra imagen con el mismo nombre cayó en el mismo milisegundo
+            with open(path, 'rb') as source, open(target, 'xb') as copy:
+                shutil.copyfileobj(source, copy)
+            return filename
+        except FileExistsError:
+            stamp += 1
+
+def iter_images(root):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+def ingest_images(ingestor, root, workers, lang, uploads_dir, check_quality=True):
+    # Import diferido: solo este modo necesita los modelos
+    import app
+    from deadline import Deadline
+    from metrics import RequestStages
+
+    ocr_engines, structure_engines = app.init_ocr()
+    errors = 0
+
+    def process(path):
+        with open(path, 'rb') as f:
+            buffer = f.read()
+        image_hash = hashlib.sha256(buffer).hexdigest()
+        if image_hash in ingestor.seen:
+            return path, image_hash, None
+        image_array, _ = app.image_from_buffer(buffer, check_quality)
+        del buffer
+        invoice_data, _ = app.run_pipeline(image_array, image_hash, ocr_engines, structure_engines,
+                                           Deadline(), RequestStages(), lang)
+        return path, image_hash, invoice_data
+
+    def safe_process(path):
+        try:
+            return process(path)
+        except Exception as e:
+            print(f"❌ {path}: {e}", file=sys.stderr)
+            return path, None, None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for path, image_hash, invoice_data in executor.map(safe_process, iter_images(root)):
+            if image_hash is None:
+                errors += 1
+            elif invoice_data is None or image_hash in ingestor.seen:
+                ingestor.skipped += 1
+            else:
+                try:
+                    archivo = copy_to_uploads(path, uploads_dir)
+                except OSError as e:
+                    print(f"⚠️ {path}: no se pudo copiar a {uploads_dir} ({e}), se guarda sin archivo",
+                          file=sys.stderr)
+                    archivo = None
+                ingestor.add(image_hash, invoice_data, archivo)
+    return errors
+
+def ingest_jsonl(ingestor, path):
+    """
+    Líneas {"imageHash", "data", "archivo" (opcional)}, como las de reextract.py.
+    `archivo`, si se indica, debe ser el nombre de un archivo que ya está en uploads/
+    """
+    errors = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                ingestor.add(record['imageHash'], record['data'], record.get('archivo'))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"❌ Línea inválida: {e}", file=sys.stderr)
+                errors += 1
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingesta masiva de facturas en facturas.db')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--images', help='Directorio con las imágenes de las facturas (se recorre recursivamente)')
+    source.add_argument('--jsonl', help='Resultados ya extraídos (salida de reextract.py)')
+    parser.add_argument('--db', default=DEFAULT_DB, help='Base de datos SQLite (por defecto web/backend/facturas.db)')
+    parser.add_argument('--uploads', default=DEFAULT_UPLOADS,
+                        help='Directorio de archivos del backend al que se copian las imágenes '
+                             '(por defecto web/backend/uploads)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Facturas por transacción')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('OCR_POOL_SIZE', '1')),
+                        help='Imágenes procesadas en paralelo (por defecto OCR_POOL_SIZE)')
+    parser.add_argument('--lang', default=None, help='Idioma de los documentos (por defecto OCR_LANG)')
+    parser.add_argument('--skip-quality-check', action='store_true',
+                        help='Omitir el control de calidad previo (escaneos antiguos que no lo superan)')
+    args = parser.parse_args()
+
+    conn = open_database(args.db)
+    ingestor = Ingestor(conn, args.batch_size)
+    print(f"🔄 Ingiriendo en {args.db} ({len(ingestor.seen)} imágenes ya ingeridas)", file=sys.stderr)
+
+    started = time.monotonic()
+    try:
+        if args.images:
+            import app
+            os.makedirs(args.uploads, exist_ok=True)
+            errors = ingest_images(ingestor, args.images, args.workers, args.lang or app.OCR_LANG, args.uploads,
+                                   check_quality=not args.skip_quality_check)
+        else:
+            errors = ingest_jsonl(ingestor, args.jsonl)
+    finally:
+        ingestor.flush()
+        conn.close()
+
+    print(f"✅ {ingestor.inserted} facturas insertadas, {ingestor.skipped} ya existentes, "
+          f"{errors} errores en {time.monotonic() - started:.1f}s", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+if __name__ == '__main__':
+    main()
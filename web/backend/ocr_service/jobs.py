@@ -0,0 +1,97 @@
+"""
+Trabajos en segundo plano del modo progresivo.
+
+En modo progresivo /ocr/process responde con los campos del OCR en cuanto
+están disponibles y deja PP-StructureV3 ejecutándose en segundo plano. El
+resultado enriquecido se guarda aquí con un identificador (jobId) y se puede
+consultar en GET /ocr/jobs/<jobId> o esperar en el flujo SSE. Los trabajos
+terminados caducan tras `ttl` segundos.
+"""
+import threading
+import time
+import uuid
+
+from metrics import metrics
+
+PENDING = 'pending'
+DONE = 'done'
+ERROR = 'error'
+
+class _Job:
+    __slots__ = ('job_id', 'status', 'result', 'error', 'created_at', 'finished_at')
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    def as_dict(self):
+        return {'jobId': self.job_id, 'status': self.status, 'result': self.result, 'error': self.error}
+
+class JobStore:
+    """Registro de trabajos seguro entre hilos, con caducidad"""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._cond = threading.Condition()
+        self._jobs = {}
+
+    def create(self):
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            self._purge()
+            self._jobs[job_id] = _Job(job_id)
+            metrics.set_gauge('jobs.active', len(self._jobs))
+        metrics.incr('jobs.created')
+        return job_id
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, ERROR, error=str(error))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.monotonic()
+            self._cond.notify_all()
+        metrics.incr(f'jobs.{status}')
+        metrics.observe('jobs.duration', job.finished_at - job.created_at)
+
+    def get(self, job_id, wait=None):
+        """
+        Estado del trabajo como dict (None si no existe o caducó).
+        Con `wait` (segundos) espera a que termine si aún está pendiente
+        """
+        end = None if wait is None else time.monotonic() + wait
+        with self._cond:
+            self._purge()
+            job = self._jobs.get(job_id)
+            while job is not None and job.status == PENDING and end is not None:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return job.as_dict() if job is not None else None
+
+    def _purge(self):
+        """Elimina los trabajos terminados hace más de `ttl` (llamar con el lock tomado)"""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._cond:
+            pending = sum(1 for job in self._jobs.values() if job.status == PENDING)
+            return {'ttl': self.ttl, 'total': len(self._jobs), 'pending': pending}
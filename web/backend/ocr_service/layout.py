@@ -0,0 +1,117 @@
+"""
+Reconstrucción de filas visuales a partir de las cajas de detección del OCR.
+
+El detector devuelve las líneas en su propio orden, por lo que una fila del
+ticket como "BASE IMP IVA 36,82 10% 3,68" puede llegar partida en varias
+líneas. Aquí se agrupan las cajas por su centro vertical y se ordenan de
+izquierda a derecha dentro de cada fila (todo vectorizado con NumPy).
+
+Una foto hecha a mano suele estar girada unos grados: el importe del extremo
+derecho de una fila queda a la altura de la etiqueta de la fila vecina. Antes
+de agrupar se estima la inclinación de las líneas de texto y se corrigen los
+centros verticales.
+"""
+import numpy as np
+
+# Cajas mínimas para estimar la inclinación (con menos, cualquier par "alinea")
+MIN_SKEW_BOXES = 4
+# Vecinas (en orden vertical) con las que se compara cada caja al estimar la inclinación
+SKEW_NEIGHBORS = 32
+
+def _alignment_score(centers_x, centers_y, slope, sigma):
+    """
+    Cuánto coinciden en altura las cajas si las líneas tienen pendiente `slope`.
+    `centers_y` debe venir ordenado: solo se comparan las SKEW_NEIGHBORS siguientes
+    (las de la misma fila están cerca en altura aunque la foto esté girada)
+    """
+    corrected = centers_y - slope * centers_x
+    score = 0.0
+    for offset in range(1, min(SKEW_NEIGHBORS, len(corrected) - 1) + 1):
+        distances = (corrected[offset:] - corrected[:-offset]) / sigma
+        score += float(np.exp(-distances * distances).sum())
+    return score
+
+def estimate_skew(boxes, max_degrees=10.0):
+    """
+    Pendiente (tangente del ángulo) de las líneas de texto a partir de cajas
+    [x1, y1, x2, y2] alineadas a los ejes.
+
+    Perfil de proyección: se prueban ángulos de -max_degrees a max_degrees (primero
+    de grado en grado y después en décimas alrededor del mejor) y se elige el que
+    hace coincidir en altura más centros de caja. Devuelve 0 si hay pocas cajas o
+    si ningún ángulo mejora claramente la imagen sin girar
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) < MIN_SKEW_BOXES or max_degrees <= 0:
+        return 0.0
+    boxes = boxes[np.argsort(boxes[:, 1] + boxes[:, 3], kind='stable')]
+    centers_x = (boxes[:, 0] + boxes[:, 2]) / 2.0
+    centers_x = centers_x - centers_x.mean()
+    centers_y = (boxes[:, 1] + boxes[:, 3]) / 2.0
+    sigma = 0.25 * max(float(np.median(boxes[:, 3] - boxes[:, 1])), 1.0)
+
+    def best_angle(angles):
+        scores = [_alignment_score(centers_x, centers_y, np.tan(np.radians(angle)), sigma) for angle in angles]
+        index = int(np.argmax(scores))
+        return float(angles[index]), scores[index]
+
+    angle, _ = best_angle(np.arange(-max_degrees, max_degrees + 0.5, 1.0))
+    angle, score = best_angle(np.clip(np.arange(angle - 1.0, angle + 1.05, 0.1), -max_degrees, max_degrees))
+    if score < 1.05 * _alignment_score(centers_x, centers_y, 0.0, sigma):
+        return 0.0
+    return float(np.tan(np.radians(angle)))
+
+def group_rows(boxes, tolerance=0.5, max_skew_degrees=10.0):
+    """
+    Agrupa cajas [x1, y1, x2, y2] en filas.
+
+    Los centros verticales se corrigen con la inclinación estimada (estimate_skew,
+    hasta `max_skew_degrees`; 0 desactiva la corrección). Dos cajas consecutivas
+    (ordenadas por centro corregido) pertenecen a la misma fila si la distancia
+    entre sus centros es menor que `tolerance` veces la altura mediana de las
+    cajas. Devuelve una lista de filas; cada fila es una lista de índices de
+    `boxes` ordenados de izquierda a derecha
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return []
+
+    slope = estimate_skew(boxes, max_skew_degrees)
+    centers_x = (boxes[:, 0] + boxes[:, 2]) / 2.0
+    centers_y = (boxes[:, 1] + boxes[:, 3]) / 2.0 - slope * (centers_x - centers_x.mean())
+    # La caja alineada a los ejes de una línea girada es más alta que el texto
+    widths = boxes[:, 2] - boxes[:, 0]
+    heights = np.maximum(boxes[:, 3] - boxes[:, 1] - abs(slope) * widths, 1.0)
+    threshold = tolerance * float(np.median(heights))
+
+    order = np.argsort(centers_y, kind='stable')
+    gaps = np.diff(centers_y[order]) > threshold
+    row_of_sorted = np.concatenate(([0], np.cumsum(gaps)))
+    row_ids = np.empty_like(row_of_sorted)
+    row_ids[order] = row_of_sorted
+
+    # Orden final: por fila y, dentro de la fila, por x1
+    final = np.lexsort((boxes[:, 0], row_ids))
+    boundaries = np.flatnonzero(np.diff(row_ids[final])) + 1
+    return [chunk.tolist() for chunk in np.split(final, boundaries)]
+
+def build_rows(ocr_lines, tolerance=0.5):
+    """
+    Construye filas {'text', 'box'} a partir de líneas {'text', 'score', 'box'}.
+    Devuelve None si alguna línea no tiene caja (no se puede reconstruir la geometría)
+    """
+    if not ocr_lines or any(line.get('box') is None for line in ocr_lines):
+        return None
+
+    boxes = np.asarray([line['box'] for line in ocr_lines], dtype=np.float32)
+    rows = []
+    for indices in group_rows(boxes, tolerance):
+        row_boxes = boxes[indices]
+        rows.append({
+            'text': ' '.join(ocr_lines[i]['text'] for i in indices),
+            'box': [
+                int(row_boxes[:, 0].min()), int(row_boxes[:, 1].min()),
+                int(row_boxes[:, 2].max()), int(row_boxes[:, 3].max()),
+            ],
+        })
+    return rows
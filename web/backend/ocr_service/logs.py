@@ -0,0 +1,92 @@
+"""
+Logging del servicio OCR.
+
+Todos los módulos usan loggers bajo 'ocr' (logging.getLogger('ocr.<módulo>')).
+Los registros se encolan en el hilo que los emite (QueueHandler) y un hilo en
+segundo plano (QueueListener) los escribe en stderr, así la ruta de la petición
+no espera por E/S. Cada registro lleva el id de la petición en curso.
+
+Configuración:
+- OCR_LOG_LEVEL: DEBUG, INFO (por defecto), WARNING o ERROR. Los volcados de
+  resultados OCR y las líneas reconocidas solo se emiten en DEBUG.
+- OCR_LOG_FORMAT: 'text' (por defecto) o 'json' (una línea JSON por registro).
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+# Id de la petición en curso (cabecera X-Request-Id o generado)
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+_listener = None
+
+class RequestIdFilter(logging.Filter):
+    """Añade request_id al registro (se ejecuta en el hilo que emite, antes de encolar)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro; los campos de extra={'fields': {...}} se añaden al objeto"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Formato legible; los campos estructurados se añaden al final como JSON"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = '-'
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + json.dumps(fields, ensure_ascii=False, default=str)
+        return line
+
+def setup_logging(level=None, fmt=None, stream=None):
+    """Configura el logger 'ocr' (idempotente). Devuelve el logger raíz del servicio"""
+    global _listener
+    logger = logging.getLogger('ocr')
+    if _listener is not None:
+        return logger
+
+    level = (level or os.environ.get('OCR_LOG_LEVEL', 'INFO')).upper()
+    fmt = (fmt or os.environ.get('OCR_LOG_FORMAT', 'text')).lower()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    logger.setLevel(getattr(logging, level, logging.INFO))
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    # Vaciar la cola al salir para no perder los últimos registros
+    atexit.register(_listener.stop)
+    return logger
@@ -0,0 +1,96 @@
+"""
+Utilidades de medición de memoria del proceso (RSS y tracemalloc).
+"""
+import ctypes
+import gc
+import os
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss_bytes():
+    """RSS actual del proceso en bytes (None si no se puede medir en esta plataforma)"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+def peak_rss_bytes():
+    """Pico de RSS del proceso en bytes (None si no disponible)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa en KiB, macOS en bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def release_free_memory():
+    """
+    Devuelve al sistema operativo la memoria libre del heap (malloc_trim de glibc).
+    Tras descargar un modelo, sin esto el RSS no baja aunque la memoria esté libre.
+    Devuelve si se liberó algo (False también si la plataforma no lo permite)
+    """
+    try:
+        return bool(ctypes.CDLL('libc.so.6').malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+def traced_bytes():
+    """Memoria asignada actualmente según tracemalloc (None si no está activo)"""
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[0]
+
+def start_tracing(frames=10):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def stop_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def top_allocations(limit=20, group_by='lineno'):
+    """Principales puntos de asignación según tracemalloc"""
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    top = []
+    for stat in snapshot.statistics(group_by)[:limit]:
+        frame = stat.traceback[0]
+        top.append({
+            'location': f'{frame.filename}:{frame.lineno}',
+            'size_kb': round(stat.size / 1024, 1),
+            'count': stat.count,
+        })
+    return top
+
+def memory_snapshot():
+    """Estado actual de memoria del proceso"""
+    rss = current_rss_bytes()
+    peak = peak_rss_bytes()
+    traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+    return {
+        'rss_mb': round(rss / 2**20, 1) if rss is not None else None,
+        'peak_rss_mb': round(peak / 2**20, 1) if peak is not None else None,
+        'tracemalloc': {
+            'tracing': traced is not None,
+            'current_mb': round(traced[0] / 2**20, 2) if traced else None,
+            'peak_mb': round(traced[1] / 2**20, 2) if traced else None,
+        },
+        'gc_counts': gc.get_count(),
+        'gc_objects': len(gc.get_objects()),
+    }
@@ -0,0 +1,101 @@
+"""
+Métricas en memoria del servicio OCR (contadores, valores actuales y tiempos).
+Se exponen en formato JSON en GET /metrics.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import memstats
+
+class Metrics:
+    """Registro de métricas seguro entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, seconds):
+        """
+        Registra una observación (cuenta, total, máximo y último valor).
+        Normalmente una duración en segundos; las métricas de memoria usan MB
+        """
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['last'] = seconds
+            if seconds > timing['max']:
+                timing['max'] = seconds
+
+    def average(self, name):
+        """Media de una observación (None si aún no hay datos)"""
+        with self._lock:
+            timing = self._timings.get(name)
+            if not timing or not timing['count']:
+                return None
+            return timing['total'] / timing['count']
+
+    def snapshot(self):
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                timings[name] = dict(timing, avg=timing['total'] / timing['count'] if timing['count'] else 0.0)
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'timings': timings,
+            }
+
+metrics = Metrics()
+
+class RequestStages:
+    """
+    Mide las etapas de una petición (decodificación, OCR, estructura, extracción...).
+    Siempre registra el tiempo; con track_memory=True registra también la variación
+    de RSS y, si tracemalloc está activo, la de memoria asignada por Python
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.timings = {}
+        self.memory = {}
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = memstats.current_rss_bytes() if self.track_memory else None
+        traced_before = memstats.traced_bytes() if self.track_memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            metrics.observe(f'stage.{name}', elapsed)
+            if self.track_memory:
+                self._record_memory(name, rss_before, traced_before)
+
+    def _record_memory(self, name, rss_before, traced_before):
+        usage = self.memory.setdefault(name, {})
+        rss_after = memstats.current_rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            delta_mb = (rss_after - rss_before) / 2**20
+            usage['rss_delta_mb'] = round(usage.get('rss_delta_mb', 0.0) + delta_mb, 3)
+            metrics.observe(f'memory.{name}.rss_delta_mb', delta_mb)
+        traced_after = memstats.traced_bytes()
+        if traced_before is not None and traced_after is not None:
+            delta_mb = (traced_after - traced_before) / 2**20
+            usage['alloc_delta_mb'] = round(usage.get('alloc_delta_mb', 0.0) + delta_mb, 3)
+            metrics.observe(f'memory.{name}.alloc_delta_mb', delta_mb)
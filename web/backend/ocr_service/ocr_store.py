@@ -0,0 +1,88 @@
+"""
+Almacén en disco de la salida bruta del OCR, indexado por hash de imagen.
+Permite volver a ejecutar solo la extracción de campos (re-extracción) sin repetir la inferencia.
+
+Cada registro es un JSON comprimido con gzip en <raíz>/<2 primeros caracteres del hash>/<hash>.json.gz:
+    {
+      "version": 1,
+      "hash": "...",
+      "lines": {"texts": [...], "scores": [...], "boxes": [[x1, y1, x2, y2], ...]},
+      "structure": [ {página normalizada de PP-StructureV3} ] | null
+    }
+"""
+import gzip
+import json
+import os
+import tempfile
+
+STORE_VERSION = 1
+
+class OcrStore:
+    """Almacén de resultados OCR basado en archivos (un archivo por imagen)"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path_for(self, image_hash):
+        if not image_hash or not all(c in '0123456789abcdef' for c in image_hash):
+            raise ValueError(f'Hash de imagen inválido: {image_hash!r}')
+        return os.path.join(self.root, image_hash[:2], f'{image_hash}.json.gz')
+
+    def save(self, image_hash, ocr_lines, structure=None):
+        """
+        Guarda las líneas OCR normalizadas (lista de {'text', 'score', 'box'})
+        y, opcionalmente, la estructura normalizada. La escritura es atómica
+        """
+        record = {
+            'version': STORE_VERSION,
+            'hash': image_hash,
+            # Formato columnar: más compacto que una lista de diccionarios
+            'lines': {
+                'texts': [line['text'] for line in ocr_lines],
+                'scores': [round(line['score'], 4) if line.get('score') is not None else None for line in ocr_lines],
+                'boxes': [line.get('box') for line in ocr_lines],
+            },
+            'structure': structure,
+        }
+        path = self._path_for(image_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def load(self, image_hash):
+        """Devuelve el registro guardado o None si no existe"""
+        path = self._path_for(image_hash)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def contains(self, image_hash):
+        return os.path.exists(self._path_for(image_hash))
+
+    def iter_hashes(self):
+        """Itera todos los hashes guardados"""
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in sorted(os.listdir(shard_dir)):
+                if name.endswith('.json.gz'):
+                    yield name[:-len('.json.gz')]
+
+def record_lines(record):
+    """Reconstruye la lista de líneas {'text', 'score', 'box'} de un registro"""
+    lines = record['lines']
+    return [
+        {'text': text, 'score': score, 'box': box}
+        for text, score, box in zip(lines['texts'], lines['scores'], lines['boxes'])
+    ]
@@ -0,0 +1,146 @@
+"""
+Perfilado bajo demanda de peticiones individuales.
+
+Una petición a /ocr/process con la cabecera X-OCR-Profile igual a
+OCR_PROFILE_TOKEN se ejecuta bajo cProfile. La respuesta incluye los tiempos
+por etapa y las funciones más costosas, y el perfil completo (formato pstats,
+legible con `python -m pstats` o snakeviz) se guarda en un directorio con un
+número máximo de archivos: al superarlo se borran los más antiguos.
+
+cProfile solo mide el hilo que lo activa, así que mientras se perfila una
+petición su OCR se ejecuta en ese hilo en lugar de pasar por el micro-batcher.
+"""
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from metrics import metrics
+
+logger = logging.getLogger('ocr.profiling')
+
+_local = threading.local()
+
+# cProfile no admite dos perfiles activos a la vez en el mismo proceso
+_profile_lock = threading.Lock()
+
+PROFILE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+class ProfilerBusy(RuntimeError):
+    """Otra petición se está perfilando en este momento"""
+
+def active():
+    """¿Se está perfilando la petición del hilo actual?"""
+    return getattr(_local, 'active', False)
+
+class Profiler:
+    """Perfila peticiones autorizadas y conserva como mucho `max_files` perfiles en `directory`"""
+
+    def __init__(self, token=None, directory=None, max_files=20, top=25):
+        self.token = token or None
+        self.directory = directory
+        self.max_files = max(1, int(max_files))
+        self.top = top
+        if self.enabled and directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.token is not None
+
+    def authorized(self, header_value):
+        """¿La cabecera de la petición coincide con el token? (comparación en tiempo constante)"""
+        if not self.enabled or not header_value:
+            return False
+        return hmac.compare_digest(header_value.encode('utf-8'), self.token.encode('utf-8'))
+
+    @contextmanager
+    def profile(self):
+        """
+        Perfila el bloque `with`. Produce un dict que al terminar contiene 'id',
+        'top' (funciones con más tiempo acumulado) y 'file' si se guardó en disco
+        """
+        if not _profile_lock.acquire(blocking=False):
+            raise ProfilerBusy('Ya hay otra petición perfilándose')
+        report = {'id': uuid.uuid4().hex}
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        _local.active = True
+        try:
+            profiler.enable()
+            try:
+                yield report
+            finally:
+                profiler.disable()
+        finally:
+            _local.active = False
+            _profile_lock.release()
+            report['wall_seconds'] = round(time.perf_counter() - started, 4)
+            report['top'] = self._top_functions(profiler)
+            report['file'] = self._save(report['id'], profiler)
+            metrics.incr('profiling.requests')
+
+    def _top_functions(self, profiler):
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        stats.sort_stats('cumulative')
+        top = []
+        for func in stats.fcn_list[:self.top]:
+            _, calls, tottime, cumtime, _ = stats.stats[func]
+            filename, line, name = func
+            top.append({
+                'function': f'{os.path.basename(filename)}:{line}({name})',
+                'calls': calls,
+                'tottime': round(tottime, 4),
+                'cumtime': round(cumtime, 4),
+            })
+        return top
+
+    def _save(self, profile_id, profiler):
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, f'{profile_id}.prof')
+        try:
+            profiler.dump_stats(path)
+            self._prune()
+        except OSError as e:
+            logger.warning("⚠️ No se pudo guardar el perfil %s: %s", profile_id, e)
+            return None
+        return os.path.basename(path)
+
+    def _prune(self):
+        """Borra los perfiles más antiguos por encima de max_files"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.prof'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def path_for(self, profile_id):
+        """Ruta de un perfil guardado (None si el id no es válido o no existe)"""
+        if not self.directory or not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f'{profile_id}.prof')
+        return path if os.path.exists(path) else None
+
+    def list_profiles(self):
+        if not self.directory:
+            return []
+        names = [name for name in os.listdir(self.directory) if name.endswith('.prof')]
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)), reverse=True)
+        return [name[:-len('.prof')] for name in names]
@@ -0,0 +1,98 @@
+"""
+Control rápido de calidad de imagen antes de la inferencia.
+
+Sobre una versión reducida en escala de grises (lado mayor `max_side`) se miden:
+- nitidez: varianza del Laplaciano (baja = desenfocada o movida)
+- exposición: brillo medio (muy oscura) y contraste del texto (quemada)
+- probabilidad de texto: densidad de bordes de Canny (casi nula = página en blanco,
+  foto sin documento o ruido uniforme)
+
+El brillo medio solo mide cuánta tinta hay: una página blanca con pocas líneas
+impresas (un PDF renderizado, un escaneo de una factura escueta) supera 250 y
+es perfectamente legible. Una foto quemada se distingue porque el reflejo o el
+flash aclaran también la tinta: alrededor de los bordes apenas queda diferencia
+entre el papel y el texto. Por eso OVEREXPOSED exige brillo alto y además poco
+contraste de texto (rango entre los percentiles 2 y 98 de los píxeles junto a
+los bordes; 0 si no hay bordes).
+
+Las imágenes claramente inutilizables se rechazan en milisegundos con un código
+de motivo, en lugar de pasar segundos por PP-OCRv5 y PP-StructureV3 para acabar
+con confianza 0. Los umbrales son conservadores: ante la duda, se procesa.
+"""
+import cv2
+import numpy as np
+
+from metrics import metrics
+
+BLURRY = 'BLURRY'
+TOO_DARK = 'TOO_DARK'
+OVEREXPOSED = 'OVEREXPOSED'
+NO_TEXT = 'NO_TEXT'
+
+MESSAGES = {
+    BLURRY: 'La imagen está desenfocada o movida; vuelve a hacer la foto con el ticket enfocado',
+    TOO_DARK: 'La imagen está demasiado oscura; haz la foto con más luz',
+    OVEREXPOSED: 'La imagen está sobreexpuesta; evita reflejos o flash directo',
+    NO_TEXT: 'No se detecta texto en la imagen; comprueba que el ticket aparece en la foto',
+}
+
+class ImageQualityError(ValueError):
+    """La imagen no supera el control de calidad (`reason` indica el motivo)"""
+
+    def __init__(self, reason, measurements):
+        super().__init__(MESSAGES[reason])
+        self.reason = reason
+        self.measurements = measurements
+
+class QualityGate:
+    """Umbrales del control de calidad (ver módulo)"""
+
+    def __init__(self, min_sharpness=30.0, min_brightness=40.0, max_brightness=250.0,
+                 min_contrast=60.0, min_edge_density=0.002, max_side=512):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast
+        self.min_edge_density = min_edge_density
+        self.max_side = max_side
+
+    def measure(self, image):
+        """Métricas de calidad de una imagen RGB (o escala de grises)"""
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        h, w = gray.shape[:2]
+        scale = self.max_side / max(h, w)
+        if scale < 1:
+            gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))),
+                              interpolation=cv2.INTER_AREA)
+        edges = cv2.Canny(gray, 50, 150)
+        contrast = 0.0
+        if np.count_nonzero(edges):
+            # Píxeles a ambos lados de cada borde: papel y tinta
+            near_edges = gray[cv2.dilate(edges, np.ones((3, 3), np.uint8)) > 0]
+            low, high = np.percentile(near_edges, (2, 98))
+            contrast = float(high - low)
+        return {
+            'sharpness': round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 2),
+            'brightness': round(float(gray.mean()), 2),
+            'contrast': round(contrast, 2),
+            'edge_density': round(np.count_nonzero(edges) / edges.size, 5),
+        }
+
+    def check(self, image):
+        """Devuelve las métricas o lanza ImageQualityError con el primer motivo de rechazo"""
+        measurements = self.measure(image)
+        reason = None
+        if measurements['brightness'] < self.min_brightness:
+            reason = TOO_DARK
+        elif (measurements['brightness'] > self.max_brightness
+              and measurements['contrast'] < self.min_contrast):
+            reason = OVEREXPOSED
+        elif measurements['edge_density'] < self.min_edge_density:
+            reason = NO_TEXT
+        elif measurements['sharpness'] < self.min_sharpness:
+            reason = BLURRY
+        if reason is not None:
+            metrics.incr(f'quality.rejected.{reason}')
+            raise ImageQualityError(reason, measurements)
+        metrics.incr('quality.passed')
+        return measurements
@@ -0,0 +1,57 @@
+"""
+Re-extracción masiva de campos sobre los resultados OCR guardados en OCR_STORE_DIR.
+No ejecuta inferencia: solo vuelve a aplicar extract_data_from_text() y la
+combinación con PP-StructureV3 sobre la salida bruta almacenada.
+
+Uso:
+    python reextract.py --store ./ocr_store --output resultados.jsonl [--workers 4]
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from extraction import reextract_from_record
+from ocr_store import OcrStore
+
+def _init_worker():
+    # Los mensajes de extracción no deben mezclarse con el JSONL de salida
+    sys.stdout = sys.stderr
+
+def _reextract_one(args):
+    store_root, image_hash = args
+    record = OcrStore(store_root).load(image_hash)
+    return image_hash, reextract_from_record(record)
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-extrae campos de factura desde el almacén OCR')
+    parser.add_argument('--store', default=os.environ.get('OCR_STORE_DIR'),
+                        help='Directorio del almacén (por defecto OCR_STORE_DIR)')
+    parser.add_argument('--output', default='-', help='Archivo JSONL de salida (por defecto stdout)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Procesos en paralelo')
+    args = parser.parse_args()
+
+    if not args.store:
+        parser.error('Indica --store o configura OCR_STORE_DIR')
+
+    store = OcrStore(args.store)
+    tasks = [(store.root, image_hash) for image_hash in store.iter_hashes()]
+    print(f"🔄 Re-extrayendo {len(tasks)} resultados con {args.workers} procesos...", file=sys.stderr)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    processed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker) as executor:
+            for image_hash, invoice_data in executor.map(_reextract_one, tasks, chunksize=64):
+                out.write(json.dumps({'imageHash': image_hash, 'data': invoice_data}, ensure_ascii=False) + '\n')
+                processed += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"✅ {processed} resultados re-extraídos", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Planificador por prioridad para el acceso a los motores OCR.
+
+Hay un número limitado de huecos (peticiones en inferencia a la vez). Las
+peticiones esperan en una cola por clase ('interactive' o 'bulk'); al quedar
+un hueco libre se atiende primero la cola interactiva, salvo que la cola bulk
+tenga crédito acumulado: por cada petición interactiva despachada mientras hay
+trabajo bulk esperando, bulk gana `bulk_share / (1 - bulk_share)` de crédito, y
+con un crédito completo recibe el siguiente hueco. Así, de cada 1 / bulk_share
+huecos disputados uno es para bulk: obtiene al menos esa fracción de la
+capacidad y nunca se queda bloqueado (con bulk_share = 1 siempre va primero).
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from engine_pool import PoolTimeout
+from metrics import metrics
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITY_CLASSES = (INTERACTIVE, BULK)
+
+class SchedulerTimeout(PoolTimeout):
+    """La petición no obtuvo hueco dentro del tiempo de espera"""
+
+class _Ticket:
+    __slots__ = ('priority', 'enqueued_at', 'granted')
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+class PriorityScheduler:
+    """Reparte `slots` huecos entre las clases de prioridad"""
+
+    def __init__(self, slots=1, bulk_share=0.2):
+        self.slots = max(1, int(slots))
+        self.bulk_share = min(max(float(bulk_share), 0.0), 1.0)
+        self._cond = threading.Condition()
+        self._free = self.slots
+        self._queues = {name: deque() for name in PRIORITY_CLASSES}
+        self._running = {name: 0 for name in PRIORITY_CLASSES}
+        self._bulk_credit = 0.0
+        # Crédito por hueco interactivo para que bulk reciba bulk_share del total (no de los interactivos)
+        self._credit_step = float('inf') if self.bulk_share >= 1.0 else self.bulk_share / (1.0 - self.bulk_share)
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE, timeout=None):
+        """Ocupa un hueco durante el bloque `with` (espera en la cola de su clase)"""
+        if priority not in self._queues:
+            raise ValueError(f'Prioridad desconocida: {priority}')
+        self._acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    def _acquire(self, priority, timeout):
+        ticket = _Ticket(priority)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._queues[priority].append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._queues[priority].remove(ticket)
+                    self._publish_depth()
+                    metrics.incr(f'scheduler.{priority}.timeouts')
+                    raise SchedulerTimeout(f'Sin hueco para petición {priority} tras {timeout:.1f}s')
+                self._cond.wait(remaining)
+        metrics.observe(f'scheduler.{priority}.wait', time.monotonic() - ticket.enqueued_at)
+
+    def _release(self, priority):
+        with self._cond:
+            self._free += 1
+            self._running[priority] -= 1
+            self._dispatch()
+
+    def _pick_class(self):
+        interactive_waiting = bool(self._queues[INTERACTIVE])
+        bulk_waiting = bool(self._queues[BULK])
+        bulk_first = self.bulk_share >= 1.0 or self._bulk_credit >= 1.0
+        if bulk_waiting and (not interactive_waiting or bulk_first):
+            if interactive_waiting and self.bulk_share < 1.0:
+                self._bulk_credit -= 1.0
+            return BULK
+        if bulk_waiting:
+            self._bulk_credit += self._credit_step
+        return INTERACTIVE
+
+    def _dispatch(self):
+        """Asigna huecos libres a las cabezas de cola (llamar con el lock tomado)"""
+        granted_any = False
+        while self._free > 0 and (self._queues[INTERACTIVE] or self._queues[BULK]):
+            priority = self._pick_class()
+            ticket = self._queues[priority].popleft()
+            ticket.granted = True
+            self._free -= 1
+            self._running[priority] += 1
+            metrics.incr(f'scheduler.{priority}.dispatched')
+            granted_any = True
+        if not self._queues[BULK]:
+            # El crédito solo compensa esperas reales; no se acumula sin trabajo bulk
+            self._bulk_credit = 0.0
+        self._publish_depth()
+        if granted_any:
+            self._cond.notify_all()
+
+    def _publish_depth(self):
+        for name in PRIORITY_CLASSES:
+            metrics.set_gauge(f'scheduler.{name}.queue_depth', len(self._queues[name]))
+            metrics.set_gauge(f'scheduler.{name}.running', self._running[name])
+
+    def stats(self):
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'free': self._free,
+                'bulk_share': self.bulk_share,
+                'queued': {name: len(queue) for name, queue in self._queues.items()},
+                'running': dict(self._running),
+            }
@@ -0,0 +1,69 @@
+"""
+Detección de varios tickets en una misma foto.
+
+Cuando se fotografían varios tickets sobre una mesa, el papel es bastante más
+claro que el fondo. Sobre una versión reducida en escala de grises se umbraliza
+con Otsu, se cierran los huecos del texto con una operación morfológica y cada
+contorno exterior suficientemente grande se toma como un documento. Si solo se
+encuentra una región (o ninguna), se devuelve la imagen completa.
+"""
+import cv2
+import numpy as np
+
+def find_documents(image, min_area_ratio=0.02, max_documents=8, padding=0.01, max_side=1024):
+    """
+    Cajas [x1, y1, x2, y2] (en coordenadas de `image`) de los documentos detectados,
+    ordenadas de arriba abajo y de izquierda a derecha. Una sola caja con la imagen
+    completa si no hay varios documentos separados
+    """
+    h, w = image.shape[:2]
+    full = [[0, 0, w, h]]
+
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    scale = min(1.0, max_side / max(h, w))
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    small_h, small_w = gray.shape[:2]
+
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Cerrar las líneas de texto para que cada ticket quede como una sola mancha
+    kernel_size = max(3, int(round(min(small_h, small_w) * 0.02)) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = min_area_ratio * small_h * small_w
+    boxes = []
+    for contour in contours:
+        x, y, bw, bh = cv2.boundingRect(contour)
+        if bw * bh < min_area:
+            continue
+        boxes.append((x, y, x + bw, y + bh))
+
+    if len(boxes) < 2:
+        return full
+    # Una región que ocupa casi toda la imagen es el fondo claro, no un ticket
+    if any((x2 - x1) * (y2 - y1) > 0.9 * small_h * small_w for x1, y1, x2, y2 in boxes):
+        return full
+
+    boxes.sort(key=lambda b: (b[2] - b[0]) * (b[3] - b[1]), reverse=True)
+    boxes = boxes[:max_documents]
+
+    pad_x = int(round(padding * w))
+    pad_y = int(round(padding * h))
+    result = []
+    for x1, y1, x2, y2 in boxes:
+        result.append([
+            max(0, int(x1 / scale) - pad_x), max(0, int(y1 / scale) - pad_y),
+            min(w, int(np.ceil(x2 / scale)) + pad_x), min(h, int(np.ceil(y2 / scale)) + pad_y),
+        ])
+    # Orden de lectura: por filas (según el centro vertical) y de izquierda a derecha
+    median_height = float(np.median([b[3] - b[1] for b in result]))
+    result.sort(key=lambda b: (round(((b[1] + b[3]) / 2) / max(median_height, 1.0)), b[0]))
+    return result
+
+def crop(image, box):
+    x1, y1, x2, y2 = box
+    # Copia: el recorte no debe retener la imagen completa
+    return image[y1:y2, x1:x2].copy()
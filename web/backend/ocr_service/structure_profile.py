@@ -0,0 +1,89 @@
+"""
+Perfil de PP-StructureV3: qué submódulos se cargan y cuáles se ejecutan.
+
+PPStructureV3() sin argumentos carga la tubería completa de documentos
+(orientación, corrección de deformación, sellos, fórmulas...), pero de su
+resultado solo usamos el texto (`overall_ocr_res`) y las tablas
+(`table_res_list`). OCR_STRUCTURE_MODULES elige los submódulos que se cargan al
+crear el motor; los que no se cargan no ocupan memoria ni tiempo por imagen.
+
+Cada petición puede ejecutar un subconjunto de los cargados (parámetro
+`structureModules`): los flags use_* se pasan a predict(). Un submódulo que no
+se cargó no se puede activar por petición.
+
+Valores: lista separada por comas de los nombres de MODULES, 'none' (solo
+maquetación y texto) o 'default' (PPStructureV3() tal cual, sin perfil).
+"""
+
+# Nombre corto -> argumento de PPStructureV3() y de predict()
+MODULES = {
+    'doc_orientation': 'use_doc_orientation_classify',
+    'doc_unwarping': 'use_doc_unwarping',
+    'textline_orientation': 'use_textline_orientation',
+    'seal': 'use_seal_recognition',
+    'table': 'use_table_recognition',
+    'formula': 'use_formula_recognition',
+    'chart': 'use_chart_recognition',
+    'region': 'use_region_detection',
+}
+
+# Facturas y tickets: basta con las tablas (las líneas de IVA y los artículos)
+INVOICE_MODULES = 'table'
+
+def parse_modules(value):
+    """Conjunto de submódulos de una lista separada por comas o lista JSON ('' o 'none' = ninguno)"""
+    if isinstance(value, (list, tuple)):
+        value = ','.join(str(name) for name in value)
+    value = (value or '').strip().lower()
+    if value in ('', 'none'):
+        return frozenset()
+    modules = frozenset(name.strip() for name in value.split(',') if name.strip())
+    unknown = sorted(modules - MODULES.keys())
+    if unknown:
+        raise ValueError(f"Submódulos de estructura desconocidos: {', '.join(unknown)} "
+                         f"(válidos: {', '.join(MODULES)})")
+    return modules
+
+class StructureProfile:
+    """Submódulos cargados en el motor de estructura (ver módulo)"""
+
+    def __init__(self, spec=INVOICE_MODULES):
+        spec = (spec or '').strip().lower()
+        self.default = spec == 'default'
+        self.modules = frozenset() if self.default else parse_modules(spec)
+
+    def init_kwargs(self):
+        """Argumentos para PPStructureV3(): todos los submódulos explícitos, activados o no"""
+        if self.default:
+            return {}
+        return {flag: name in self.modules for name, flag in MODULES.items()}
+
+    def fall_back(self):
+        """La versión instalada no admite los argumentos: se usa el motor por defecto"""
+        self.default = True
+        self.modules = frozenset()
+
+    def resolve(self, value):
+        """
+        Submódulos que pide una petición (None si no pide nada: se ejecutan todos los
+        cargados). ValueError si el valor no es válido o pide alguno que no está cargado
+        """
+        if value is None:
+            return None
+        if self.default:
+            raise ValueError('structureModules requiere OCR_STRUCTURE_MODULES distinto de default')
+        modules = parse_modules(value)
+        missing = sorted(modules - self.modules)
+        if missing:
+            raise ValueError(f"Submódulos de estructura no cargados: {', '.join(missing)} "
+                             f"(cargados: {', '.join(sorted(self.modules)) or 'ninguno'})")
+        return modules
+
+    def predict_kwargs(self, modules=None):
+        """Flags use_* para predict(); solo los de submódulos cargados (el resto ya está desactivado)"""
+        if modules is None or self.default:
+            return {}
+        return {MODULES[name]: name in modules for name in self.modules}
+
+    def describe(self):
+        return {'default': self.default, 'modules': sorted(self.modules)}
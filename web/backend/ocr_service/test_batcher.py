@@ -0,0 +1,107 @@
+"""
+Test del micro-batching (batcher.py) con una función de lote de prueba.
+
+No necesita PaddleOCR: `run_batch` devuelve el doble de cada elemento y anota
+qué lotes recibió. Un lote bloqueado en un Event mantiene ocupado el único
+worker mientras se encolan los elementos que interesan.
+
+Uso:
+    python test_batcher.py
+"""
+import threading
+import time
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeoutError
+
+from batcher import MicroBatcher
+
+class Recorder:
+    """run_batch de prueba: duplica cada elemento; el elemento 'block' espera a `release`"""
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        if 'block' in items:
+            self.release.wait(5)
+        return [item * 2 for item in items]
+
+def busy_batcher(max_wait_ms=20):
+    """Batcher con un solo worker ocupado en un lote ['block'] hasta recorder.release"""
+    recorder = Recorder()
+    batcher = MicroBatcher('test', recorder, max_batch_size=8, max_wait_ms=max_wait_ms, workers=1)
+    blocked = batcher.submit('block')
+    deadline = time.monotonic() + 5
+    while not recorder.batches and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert recorder.batches == [['block']]
+    return batcher, recorder, blocked
+
+def test_each_item_gets_its_result():
+    batcher, recorder, blocked = busy_batcher()
+    futures = [batcher.submit(n) for n in range(5)]
+    recorder.release.set()
+    assert blocked.result(5) == 'blockblock'
+    assert [future.result(5) for future in futures] == [0, 2, 4, 6, 8]
+    # Mientras el worker estaba ocupado se acumularon en un solo lote
+    assert recorder.batches[1:] == [[0, 1, 2, 3, 4]]
+
+def test_cancelled_items_skipped():
+    batcher, recorder, _ = busy_batcher()
+    dead = batcher.submit(1)
+    live = batcher.submit(2)
+    assert dead.cancel()
+    recorder.release.set()
+    assert live.result(5) == 4
+    assert recorder.batches[1:] == [[2]]
+    try:
+        dead.result(0)
+        raise AssertionError('el elemento cancelado no debe tener resultado')
+    except CancelledError:
+        pass
+
+def test_expired_items_skipped():
+    batcher, recorder, _ = busy_batcher()
+    expired = batcher.submit(1, expires_at=time.monotonic() + 0.01)
+    live = batcher.submit(2, expires_at=time.monotonic() + 60)
+    time.sleep(0.05)
+    recorder.release.set()
+    assert live.result(5) == 4
+    assert recorder.batches[1:] == [[2]]
+    try:
+        expired.result(5)
+        raise AssertionError('el elemento vencido no debe procesarse')
+    except FutureTimeoutError:
+        pass
+
+def test_waiter_timeout_cancels_item():
+    # Como en app.run_ocr_phase: la espera agota el plazo y la petición cancela su elemento
+    batcher, recorder, _ = busy_batcher()
+    future = batcher.submit(1)
+    try:
+        future.result(timeout=0.01)
+        raise AssertionError('el worker está ocupado: la espera debe agotarse')
+    except FutureTimeoutError:
+        assert future.cancel()
+    recorder.release.set()
+    assert batcher.submit(3).result(5) == 6
+    assert all(1 not in batch for batch in recorder.batches)
+
+def test_batch_error_reaches_every_item():
+    def failing(items):
+        raise RuntimeError('fallo del motor')
+    batcher = MicroBatcher('test-error', failing, max_batch_size=4, max_wait_ms=20)
+    futures = [batcher.submit(n) for n in range(3)]
+    for future in futures:
+        try:
+            future.result(5)
+            raise AssertionError('el error del lote debe llegar a cada elemento')
+        except RuntimeError as e:
+            assert str(e) == 'fallo del motor'
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
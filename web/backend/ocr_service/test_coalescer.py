@@ -0,0 +1,137 @@
+"""
+Test de la agrupación de peticiones idénticas en vuelo (coalescer.py).
+
+No necesita PaddleOCR: el cálculo es una función que espera a un Event, de modo
+que la primera petición (la que calcula) sigue en curso mientras llegan las
+demás con la misma clave.
+
+Uso:
+    python test_coalescer.py
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from coalescer import CoalesceTimeout, InflightCoalescer
+
+class Retryable(Exception):
+    """Error que depende de la petición que calculaba (como DeadlineExceeded)"""
+
+class Computation:
+    """fn() de prueba: cuenta las llamadas y espera a `release` antes de devolver o fallar"""
+
+    def __init__(self, result='ok', error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            error, self.error = self.error, None  # solo falla la primera vez
+            raise error
+        return self.result
+
+def test_identical_requests_share_result():
+    coalescer = InflightCoalescer('test')
+    computation = Computation()
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(coalescer.run, 'k', computation)
+        computation.started.wait(5)
+        waiters = [executor.submit(coalescer.run, 'k', computation) for _ in range(3)]
+        time.sleep(0.05)
+        computation.release.set()
+        assert leader.result(5) == ('ok', False)
+        assert [waiter.result(5) for waiter in waiters] == [('ok', True)] * 3
+    assert computation.calls == 1
+    assert coalescer.stats() == {'inflight': 0}
+
+def test_different_keys_not_shared():
+    coalescer = InflightCoalescer('test')
+    computation = Computation()
+    computation.release.set()
+    assert coalescer.run(('hash', 'interactive'), computation) == ('ok', False)
+    assert coalescer.run(('hash', 'bulk'), computation) == ('ok', False)
+    assert computation.calls == 2
+
+def test_waiter_timeout():
+    # El cálculo de la primera petición sigue en curso más allá del plazo de la segunda
+    coalescer = InflightCoalescer('test')
+    computation = Computation()
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(coalescer.run, 'k', computation)
+        computation.started.wait(5)
+        started = time.monotonic()
+        try:
+            coalescer.run('k', computation, timeout=0.05)
+            raise AssertionError('la espera debe agotarse')
+        except CoalesceTimeout:
+            assert time.monotonic() - started >= 0.05
+        computation.release.set()
+        assert leader.result(5) == ('ok', False)
+    assert computation.calls == 1
+
+def test_leader_retryable_failure_is_retried():
+    # La primera petición agota su propio presupuesto: las que esperaban repiten el cálculo
+    coalescer = InflightCoalescer('test', retry_on=(Retryable,))
+    computation = Computation(error=Retryable('presupuesto de la primera agotado'))
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(coalescer.run, 'k', computation)
+        computation.started.wait(5)
+        waiter = executor.submit(coalescer.run, 'k', computation)
+        time.sleep(0.05)
+        computation.release.set()
+        try:
+            leader.result(5)
+            raise AssertionError('la primera petición debe recibir su propio error')
+        except Retryable:
+            pass
+        assert waiter.result(5) == ('ok', False)
+    assert computation.calls == 2
+
+def test_leader_failure_propagates():
+    # Un error de la imagen (no de la petición) se comparte sin repetir el cálculo
+    coalescer = InflightCoalescer('test', retry_on=(Retryable,))
+    computation = Computation(error=ValueError('imagen ilegible'))
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(coalescer.run, 'k', computation)
+        computation.started.wait(5)
+        waiter = executor.submit(coalescer.run, 'k', computation)
+        time.sleep(0.05)
+        computation.release.set()
+        for future in (leader, waiter):
+            try:
+                future.result(5)
+                raise AssertionError('el error del cálculo debe propagarse')
+            except ValueError as e:
+                assert str(e) == 'imagen ilegible'
+    assert computation.calls == 1
+
+def test_leader_timeout_error_not_reported_as_wait():
+    # Un TimeoutError del propio cálculo no es una espera agotada: se propaga tal cual
+    coalescer = InflightCoalescer('test')
+    computation = Computation(error=TimeoutError('agotado antes de ocr'))
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(coalescer.run, 'k', computation)
+        computation.started.wait(5)
+        waiter = executor.submit(coalescer.run, 'k', computation, 5)
+        time.sleep(0.05)
+        computation.release.set()
+        for future in (leader, waiter):
+            try:
+                future.result(5)
+                raise AssertionError('el error del cálculo debe propagarse')
+            except CoalesceTimeout:
+                raise AssertionError('no es una espera agotada')
+            except TimeoutError as e:
+                assert str(e) == 'agotado antes de ocr'
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
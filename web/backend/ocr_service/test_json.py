@@ -0,0 +1,100 @@
+"""
+Test de la serialización de las respuestas (app.dumps_json).
+
+Comprueba que orjson y el respaldo con json producen el mismo documento para
+una respuesta realista: valores numpy (confianzas float32, cajas int64,
+arrays), texto con acentos y símbolos, claves no textuales y el formato
+compacto de `tables` y `structure` de la selección de campos.
+
+Importa app.py, así que necesita Flask, pero no los modelos.
+
+Uso:
+    python test_json.py
+"""
+import json
+
+import numpy as np
+import orjson
+
+import app
+
+TABLE_HTML = ('<html><body><table><tr><td>Concepto</td><td>Importe</td></tr>'
+              '<tr><td>Café   con leche</td><td>1,80 €</td></tr>'
+              '<tr><td>IVA 10%</td><td> 0,16</td></tr></table></body></html>')
+
+class Opaque:
+    """Objeto de PaddleOCR sin equivalente JSON"""
+
+    def __str__(self):
+        return 'LayoutBlock(label=text)'
+
+def invoice_data():
+    return {
+        'establishment': 'Cafetería Núñez',
+        'date': '2025-08-09',
+        'total': np.float64(40.5),
+        'subtotal': 36.82,
+        'tax': np.float32(3.68),
+        'taxRate': 0.1,
+        'rawText': 'CAFETERÍA NÚÑEZ\nTOTAL 40,50 €',
+        'confidence': np.float32(0.95),
+        'rows': [{'text': 'TOTAL 40,50 €', 'score': np.float32(0.98),
+                  'box': [np.int64(12), np.int32(340), 560, 362]}],
+        'tables': [{'pred_html': TABLE_HTML}],
+        'structure': {'layout': [{'box': np.array([[1, 2], [3, 4]], dtype=np.int16),
+                                  'score': np.float32(0.5), 'block': Opaque()}],
+                      1: 'página 1'},
+    }
+
+def encode_both(payload):
+    with_orjson = app.dumps_json(payload)
+    encoder, app.orjson = app.orjson, None
+    try:
+        with_json = app.dumps_json(payload)
+    finally:
+        app.orjson = encoder
+    return with_orjson, with_json
+
+def test_orjson_is_used():
+    assert app.orjson is orjson
+    assert isinstance(app.dumps_json({'a': 1}), bytes)
+
+def test_default_fields_equivalent():
+    payload = {'success': True, 'imageHash': 'ab' * 32, 'partial': False, 'skipped': [],
+               'data': app.select_fields(invoice_data(), app.DEFAULT_FIELDS)}
+    with_orjson, with_json = encode_both(payload)
+    assert json.loads(with_orjson) == json.loads(with_json)
+    data = json.loads(with_orjson)['data']
+    assert data['total'] == 40.5 and data['establishment'] == 'Cafetería Núñez'
+    assert isinstance(data['confidence'], float) and abs(data['confidence'] - 0.95) < 1e-6
+
+def test_compact_tables_and_structure_equivalent():
+    payload = {'success': True, 'data': app.select_fields(invoice_data(), app.INVOICE_FIELDS)}
+    with_orjson, with_json = encode_both(payload)
+    decoded = json.loads(with_orjson)
+    assert decoded == json.loads(with_json)
+    assert decoded['data']['tables'] == [{'rows': [['Concepto', 'Importe'], ['Café con leche', '1,80 €'],
+                                                   ['IVA 10%', '0,16']]}]
+    assert decoded['data']['rows'][0]['box'] == [12, 340, 560, 362]
+    assert decoded['data']['structure']['layout'][0]['box'] == [[1, 2], [3, 4]]
+    assert decoded['data']['structure']['1'] == 'página 1'
+
+def test_raw_numpy_values_equivalent():
+    # Valores numpy que llegan sin pasar por select_fields (p. ej. en los eventos SSE)
+    payload = {'score': np.float32(0.25), 'count': np.int64(7), 'flag': np.bool_(True),
+               'box': np.array([1.5, 2.5]), 'scores': np.array([[0.95, 0.1]], dtype=np.float32),
+               'block': Opaque(), 2: 'dos'}
+    with_orjson, with_json = encode_both(payload)
+    assert json.loads(with_orjson) == json.loads(with_json) == {
+        'score': 0.25, 'count': 7, 'flag': True, 'box': [1.5, 2.5], 'scores': [[0.95, 0.1]],
+        'block': 'LayoutBlock(label=text)', '2': 'dos'}
+
+def test_non_ascii_kept_as_utf8():
+    with_orjson, with_json = encode_both({'establishment': 'Cafetería Núñez €'})
+    assert with_orjson.decode('utf-8') == with_json == '{"establishment":"Cafetería Núñez €"}'
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
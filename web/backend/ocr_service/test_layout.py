@@ -0,0 +1,65 @@
+"""
+Test de la reconstrucción de filas (layout.py) con tickets sintéticos girados.
+
+No necesita PaddleOCR: se generan las cajas que devolvería el detector (cajas
+alineadas a los ejes de cada texto girado) y se comprueba que cada fila une su
+etiqueta con su propio importe.
+
+Uso:
+    python test_layout.py
+"""
+import numpy as np
+
+from layout import build_rows, estimate_skew
+
+# Columnas de un ticket: etiqueta, cantidad e importe (x1, x2)
+COLUMNS = ((20, 260), (300, 340), (480, 560))
+
+def receipt_lines(rows=12, degrees=0.0, pitch=40, height=20, columns=COLUMNS):
+    """Líneas {'text', 'score', 'box'} de un ticket girado `degrees` alrededor de su centro"""
+    angle = np.radians(degrees)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    center = np.array([300.0, rows * pitch / 2.0])
+    lines = []
+    for row in range(rows):
+        y1 = 20 + row * pitch
+        for column, (x1, x2) in enumerate(columns):
+            corners = np.array([[x1, y1], [x2, y1], [x2, y1 + height], [x1, y1 + height]], dtype=np.float64)
+            rotated = (corners - center) @ rotation.T + center
+            lines.append({
+                'text': f'r{row}c{column}',
+                'score': 0.9,
+                'box': [int(round(v)) for v in (*rotated.min(axis=0), *rotated.max(axis=0))],
+            })
+    # El detector no garantiza ningún orden
+    order = np.random.default_rng(int(degrees * 10) + 100).permutation(len(lines))
+    return [lines[i] for i in order]
+
+def expected_rows(rows=12, columns=COLUMNS):
+    return [' '.join(f'r{row}c{column}' for column in range(len(columns))) for row in range(rows)]
+
+def test_rows_without_tilt():
+    assert [row['text'] for row in build_rows(receipt_lines())] == expected_rows()
+
+def test_rows_with_tilt():
+    for degrees in (-6.0, -3.0, -1.5, 1.5, 3.0, 6.0):
+        texts = [row['text'] for row in build_rows(receipt_lines(degrees=degrees))]
+        assert texts == expected_rows(), f'{degrees}°: {texts}'
+
+def test_skew_estimate():
+    for degrees in (-6.0, -3.0, 0.0, 3.0, 6.0):
+        lines = receipt_lines(degrees=degrees)
+        estimated = np.degrees(np.arctan(estimate_skew([line['box'] for line in lines])))
+        assert abs(estimated - degrees) <= 0.5, f'{degrees}°: estimado {estimated:.2f}°'
+
+def test_single_column_not_deskewed():
+    # Una sola columna no tiene pares en la misma fila: no debe inventarse una inclinación
+    lines = receipt_lines(columns=((20, 260),))
+    assert estimate_skew([line['box'] for line in lines]) == 0.0
+    assert [row['text'] for row in build_rows(lines)] == expected_rows(columns=((20, 260),))
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
@@ -0,0 +1,70 @@
+"""
+Test del control de calidad (quality.py) con imágenes sintéticas.
+
+No necesita PaddleOCR: se generan páginas con texto impreso con OpenCV y se
+comprueba qué motivo de rechazo (o ninguno) da QualityGate con los umbrales
+por defecto.
+
+Uso:
+    python test_quality.py
+"""
+import cv2
+import numpy as np
+
+from quality import BLURRY, NO_TEXT, OVEREXPOSED, TOO_DARK, ImageQualityError, QualityGate
+
+def page(height=1754, width=1240, lines=10, paper=255, ink=0):
+    """Página A4 a 150 ppp (RGB) con `lines` líneas impresas"""
+    image = np.full((height, width, 3), paper, dtype=np.uint8)
+    for line in range(lines):
+        cv2.putText(image, f'Concepto {line + 1:02d} ........ {12.5 * (line + 1):8.2f} EUR',
+                    (100, 200 + line * 60), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (ink, ink, ink), 2, cv2.LINE_AA)
+    return image
+
+def photo(paper=185, ink=60, gain=1.0, offset=0.0, seed=0):
+    """Foto de un ticket: papel gris, ruido de sensor y exposición `gain`/`offset` (se satura a 255)"""
+    image = page(height=1200, width=900, lines=14, paper=paper, ink=ink).astype(np.float32)
+    image += np.random.default_rng(seed).normal(0.0, 3.0, image.shape)
+    return np.clip(image * gain + offset, 0, 255).astype(np.uint8)
+
+def rejection(image):
+    try:
+        QualityGate().check(image)
+    except ImageQualityError as e:
+        return e.reason
+    return None
+
+def test_clean_white_page_passes():
+    # Casi toda la página es papel blanco: brillo medio > 250 pero texto nítido
+    for lines in (10, 3):
+        image = page(lines=lines)
+        assert QualityGate().measure(image)['brightness'] > 250
+        assert rejection(image) is None, lines
+
+def test_well_exposed_photo_passes():
+    assert rejection(photo()) is None
+
+def test_overexposed_photo_rejected():
+    # El flash quema el papel y aclara la tinta: quedan bordes, pero sin contraste
+    image = photo(gain=1.4, offset=130)
+    measurements = QualityGate().measure(image)
+    assert measurements['brightness'] > 250 and measurements['contrast'] < 60, measurements
+    assert measurements['edge_density'] > 0.002, measurements
+    assert rejection(image) == OVEREXPOSED
+    # Tan quemada que ya no quedan bordes: sigue siendo sobreexposición, no falta de texto
+    assert rejection(photo(gain=1.6, offset=140)) == OVEREXPOSED
+
+def test_dark_photo_rejected():
+    assert rejection(photo(gain=0.15)) == TOO_DARK
+
+def test_blank_page_rejected():
+    assert rejection(page(lines=0, paper=200)) == NO_TEXT
+
+def test_blurry_photo_rejected():
+    assert rejection(cv2.GaussianBlur(photo(), (0, 0), 4)) == BLURRY
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
@@ -0,0 +1,104 @@
+"""
+Test del planificador por prioridad (scheduler.py).
+
+No necesita PaddleOCR. El reparto de huecos disputados se comprueba de forma
+determinista con un solo hueco y las dos colas siempre llenas: cada vez que se
+libera el hueco se anota qué clase lo recibe y se encola otra petición de esa
+clase. La prioridad y los tiempos de espera se comprueban con hilos reales.
+
+Uso:
+    python test_scheduler.py
+"""
+import threading
+import time
+
+from scheduler import BULK, INTERACTIVE, PriorityScheduler, SchedulerTimeout, _Ticket
+
+def contested_grants(bulk_share, rounds=1000):
+    """Clases que reciben el hueco en `rounds` liberaciones con ambas colas llenas"""
+    scheduler = PriorityScheduler(slots=1, bulk_share=bulk_share)
+    grants = []
+    with scheduler._cond:
+        scheduler._queues[INTERACTIVE].append(_Ticket(INTERACTIVE))
+        scheduler._queues[BULK].append(_Ticket(BULK))
+        scheduler._dispatch()
+        for _ in range(rounds):
+            granted = BULK if scheduler._running[BULK] else INTERACTIVE
+            grants.append(granted)
+            scheduler._queues[granted].append(_Ticket(granted))
+            scheduler._free += 1
+            scheduler._running[granted] -= 1
+            scheduler._dispatch()
+    return grants
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condición no alcanzada'
+        time.sleep(0.001)
+
+def test_contested_bulk_share():
+    for share in (0.1, 0.2, 0.5):
+        grants = contested_grants(share)
+        assert grants.count(BULK) / len(grants) == share, (share, grants.count(BULK))
+        # Reparto regular: nunca más de 1 / share - 1 interactivas seguidas
+        longest = max(len(run) for run in ''.join('i' if g == INTERACTIVE else 'b' for g in grants).split('b'))
+        assert longest <= round(1 / share) - 1, (share, longest)
+
+def test_bulk_share_limits():
+    assert BULK not in contested_grants(0.0, rounds=100)
+    assert set(contested_grants(1.0, rounds=100)) == {BULK}
+
+def test_interactive_goes_first():
+    scheduler = PriorityScheduler(slots=1, bulk_share=0.2)
+    order = []
+
+    def worker(priority):
+        with scheduler.slot(priority, timeout=5):
+            order.append(priority)
+
+    with scheduler.slot(INTERACTIVE):
+        threads = []
+        for priority in (BULK, BULK, INTERACTIVE):
+            threads.append(threading.Thread(target=worker, args=(priority,)))
+            threads[-1].start()
+            wait_until(lambda: sum(scheduler.stats()['queued'].values()) == len(threads))
+    for thread in threads:
+        thread.join(5)
+    # La interactiva llegó la última pero se atiende antes que las bulk que esperaban
+    assert order == [INTERACTIVE, BULK, BULK], order
+
+def test_bulk_runs_when_no_interactive_waits():
+    scheduler = PriorityScheduler(slots=2, bulk_share=0.0)
+    with scheduler.slot(BULK, timeout=1), scheduler.slot(BULK, timeout=1):
+        assert scheduler.stats()['running'] == {INTERACTIVE: 0, BULK: 2}
+
+def test_queue_timeout():
+    scheduler = PriorityScheduler(slots=1)
+    with scheduler.slot(INTERACTIVE):
+        started = time.monotonic()
+        try:
+            with scheduler.slot(BULK, timeout=0.05):
+                raise AssertionError('no hay huecos libres: la espera debe agotarse')
+        except SchedulerTimeout:
+            assert time.monotonic() - started >= 0.05
+        # La petición que se rindió sale de la cola
+        assert scheduler.stats()['queued'] == {INTERACTIVE: 0, BULK: 0}
+    # Y el hueco liberado sigue disponible
+    with scheduler.slot(BULK, timeout=0.05):
+        assert scheduler.stats()['free'] == 0
+    assert scheduler.stats()['free'] == 1
+
+def test_unknown_priority():
+    try:
+        with PriorityScheduler().slot('urgent'):
+            pass
+        raise AssertionError('prioridad desconocida aceptada')
+    except ValueError:
+        pass
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
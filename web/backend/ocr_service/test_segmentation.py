@@ -0,0 +1,88 @@
+"""
+Test de la detección de varios tickets en una foto (segmentation.py).
+
+No necesita PaddleOCR: se generan fotos sintéticas con tickets blancos con
+texto sobre una mesa oscura con algo de ruido y se comprueba que cada ticket
+se detecta una vez, en orden de lectura y con una caja que lo contiene.
+
+Uso:
+    python test_segmentation.py
+"""
+import cv2
+import numpy as np
+
+from segmentation import crop, find_documents
+
+def table_photo(receipts, height=1500, width=2000, background=60, seed=0):
+    """Foto RGB de una mesa con un ticket blanco con texto en cada caja [x1, y1, x2, y2]"""
+    rng = np.random.default_rng(seed)
+    image = np.clip(rng.normal(background, 8, (height, width, 3)), 0, 255).astype(np.uint8)
+    for x1, y1, x2, y2 in receipts:
+        image[y1:y2, x1:x2] = 235
+        for y in range(y1 + 40, y2 - 20, 35):
+            cv2.putText(image, 'PAN 1,20  LECHE 0,95', (x1 + 15, y), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.7, (20, 20, 20), 2, cv2.LINE_AA)
+    return image
+
+def contains(outer, inner, tolerance=0.03):
+    """¿La caja `outer` contiene `inner` (con un margen relativo a su tamaño)?"""
+    margin_x = tolerance * (inner[2] - inner[0])
+    margin_y = tolerance * (inner[3] - inner[1])
+    return (outer[0] <= inner[0] + margin_x and outer[1] <= inner[1] + margin_y and
+            outer[2] >= inner[2] - margin_x and outer[3] >= inner[3] - margin_y)
+
+def test_receipts_found_in_reading_order():
+    receipts = [
+        [1200, 100, 1700, 700],   # arriba a la derecha
+        [150, 120, 650, 650],     # arriba a la izquierda
+        [700, 850, 1300, 1400],   # abajo
+    ]
+    image = table_photo(receipts)
+    boxes = find_documents(image)
+    assert len(boxes) == 3, boxes
+    for box, receipt in zip(boxes, [receipts[1], receipts[0], receipts[2]]):
+        assert contains(box, receipt), (box, receipt)
+        # Sin incluir gran parte de la mesa alrededor
+        assert (box[2] - box[0]) * (box[3] - box[1]) < 1.2 * (receipt[2] - receipt[0]) * (receipt[3] - receipt[1])
+
+def test_single_receipt_returns_full_image():
+    image = table_photo([[500, 200, 1100, 1300]])
+    assert find_documents(image) == [[0, 0, 2000, 1500]]
+
+def test_plain_page_returns_full_image():
+    # Un escaneo: todo es papel, no hay fondo oscuro del que separar documentos
+    image = np.full((1754, 1240, 3), 250, dtype=np.uint8)
+    for y in range(150, 1600, 60):
+        cv2.putText(image, 'Concepto ........ 12,50 EUR', (100, y), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0, (0, 0, 0), 2, cv2.LINE_AA)
+    assert find_documents(image) == [[0, 0, 1240, 1754]]
+
+def test_small_regions_ignored_and_count_limited():
+    receipts = [[100 + i * 380, 200, 420 + i * 380, 900] for i in range(5)]
+    image = table_photo(receipts, width=2100)
+    # Una mancha clara pequeña (p. ej. una moneda) no es un documento
+    cv2.circle(image, (1000, 1300), 25, (240, 240, 240), -1)
+    assert len(find_documents(image)) == 5
+    boxes = find_documents(image, max_documents=3)
+    assert len(boxes) == 3
+    assert [box[0] for box in boxes] == sorted(box[0] for box in boxes)
+
+def test_grayscale_input():
+    receipts = [[150, 120, 650, 650], [1200, 100, 1700, 700]]
+    gray = cv2.cvtColor(table_photo(receipts), cv2.COLOR_RGB2GRAY)
+    assert len(find_documents(gray)) == 2
+
+def test_crop_is_independent_copy():
+    image = table_photo([[150, 120, 650, 650], [1200, 100, 1700, 700]])
+    box = find_documents(image)[0]
+    piece = crop(image, box)
+    assert piece.shape[:2] == (box[3] - box[1], box[2] - box[0])
+    assert piece.base is None  # no retiene la imagen completa
+    piece[:] = 0
+    assert image[box[1]:box[3], box[0]:box[2]].any()
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
@@ -0,0 +1,153 @@
+"""
+Prueba de resistencia (soak) de memoria del servicio OCR.
+
+Envía miles de peticiones sintéticas a /ocr/process a través del cliente de
+pruebas de Flask y falla si el RSS crece más de un umbral tras el calentamiento.
+
+Uso:
+    python test_soak.py --requests 2000 --max-growth-mb 50
+    python test_soak.py --engine fake   # aísla el manejador HTTP sin cargar modelos
+
+Con --engine fake se sustituyen los motores por uno sintético (sin modelos), lo
+que permite detectar fugas en el manejador, la decodificación y la extracción.
+"""
+import argparse
+import base64
+import gc
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+os.environ.setdefault('OCR_MEMORY_TRACKING', '1')
+# La línea de resumen por petición es INFO: no interesa durante la prueba
+os.environ.setdefault('OCR_LOG_LEVEL', 'WARNING')
+
+import app as ocr_app
+import memstats
+
+SAMPLE_LINES = [
+    'SUPERMERCADO EJEMPLO S.L.',
+    'FECHA 09/08/2025',
+    'BASE IMP IVA 36,82 10% 3,68',
+    'TOTAL 40,50 EUR',
+]
+
+class FakeOcrEngine:
+    """Motor sintético con el formato de salida de predict() de PaddleOCR 3.x"""
+
+    def __init__(self, lang='es'):
+        self.lang = lang
+
+    def predict(self, image):
+        images = image if isinstance(image, list) else [image]
+        results = []
+        for img in images:
+            h = img.shape[0]
+            step = max(1, h // (len(SAMPLE_LINES) + 1))
+            results.append({
+                'rec_texts': list(SAMPLE_LINES),
+                'rec_scores': [0.95] * len(SAMPLE_LINES),
+                'rec_boxes': np.array([[10, step * (i + 1), 300, step * (i + 1) + 20]
+                                       for i in range(len(SAMPLE_LINES))]),
+                # Simula los buffers intermedios que devuelve el modelo real
+                'doc_preprocessor_res': {'output_img': img.copy()},
+            })
+        return results
+
+class FakeStructureEngine:
+    def predict(self, image):
+        return [{
+            'overall_ocr_res': {'rec_texts': list(SAMPLE_LINES)},
+            'table_res_list': [{'pred_html': '<table><tr><td>PAN</td><td>1,20</td></tr></table>'}],
+        }]
+
+def make_invoice_image(seed):
+    """Genera una imagen de ticket sintética distinta en cada petición"""
+    rng = np.random.default_rng(seed)
+    height = int(rng.integers(400, 900))
+    width = int(rng.integers(300, 600))
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(SAMPLE_LINES):
+        cv2.putText(img, line, (10, 40 + i * 40), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+    noise = rng.integers(0, 30, size=img.shape, dtype=np.uint8)
+    img = cv2.subtract(img, noise)
+    ok, encoded = cv2.imencode('.jpg', img)
+    assert ok
+    return 'data:image/jpeg;base64,' + base64.b64encode(encoded.tobytes()).decode('ascii')
+
+def rss_mb():
+    rss = memstats.current_rss_bytes()
+    return rss / 2**20 if rss is not None else float('nan')
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test de memoria del servicio OCR')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='Peticiones antes de tomar la medida base de RSS')
+    parser.add_argument('--max-growth-mb', type=float, default=50.0,
+                        help='Crecimiento máximo de RSS permitido tras el calentamiento')
+    parser.add_argument('--engine', choices=['real', 'fake'], default='real')
+    parser.add_argument('--report-every', type=int, default=250)
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='Activa tracemalloc para mostrar los puntos de asignación si falla (más lento)')
+    args = parser.parse_args()
+
+    if args.engine == 'fake':
+        ocr_app.PADDLEOCR_AVAILABLE = True
+        ocr_app.PPSTRUCTURE_AVAILABLE = True
+        ocr_app._create_ocr_engine = FakeOcrEngine
+        ocr_app._create_structure_engine = FakeStructureEngine
+
+    if args.tracemalloc:
+        memstats.start_tracing()
+
+    if memstats.current_rss_bytes() is None:
+        print('ERROR: no se puede medir el RSS en esta plataforma')
+        sys.exit(2)
+
+    client = ocr_app.app.test_client()
+    payloads = [make_invoice_image(seed) for seed in range(32)]
+
+    baseline = None
+    started = time.monotonic()
+    failures = 0
+    for i in range(args.requests):
+        response = client.post('/ocr/process', json={'image': payloads[i % len(payloads)]})
+        if response.status_code != 200:
+            failures += 1
+        response.close()
+
+        if i + 1 == args.warmup:
+            gc.collect()
+            baseline = rss_mb()
+            print(f'Base tras {args.warmup} peticiones de calentamiento: {baseline:.1f} MB')
+        if (i + 1) % args.report_every == 0:
+            print(f'  {i + 1}/{args.requests} peticiones, RSS {rss_mb():.1f} MB, '
+                  f'{(i + 1) / (time.monotonic() - started):.1f} req/s, errores {failures}')
+
+    gc.collect()
+    final = rss_mb()
+    if baseline is None:
+        baseline = final
+    growth = final - baseline
+    print(f'RSS final: {final:.1f} MB (crecimiento {growth:+.1f} MB, límite {args.max_growth_mb} MB)')
+
+    if failures:
+        print(f'ERROR: {failures} peticiones fallaron')
+        sys.exit(1)
+    if growth > args.max_growth_mb:
+        print('ERROR: el crecimiento de memoria supera el umbral (posible fuga)')
+        if args.tracemalloc:
+            print('Principales puntos de asignación:')
+            for site in memstats.top_allocations(10):
+                print(f"  {site['location']}: {site['size_kb']} KB en {site['count']} bloques")
+        sys.exit(1)
+
+    print('OK: memoria estable')
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
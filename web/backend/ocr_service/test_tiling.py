@@ -0,0 +1,103 @@
+"""
+Test del troceado de tickets largos (tiling.py).
+
+No necesita PaddleOCR: se simula el detector sobre cada franja a partir de las
+líneas reales de un ticket de 800x6000. Las líneas enteras dentro de la franja
+se devuelven en coordenadas de la franja (con un píxel de ruido según la
+franja) y las que cruzan un corte, recortadas y con el texto partido, como las
+devolvería PP-OCRv5.
+
+Uso:
+    python test_tiling.py
+"""
+from tiling import merge_lines, plan_tiles
+
+WIDTH, HEIGHT = 800, 6000
+
+def receipt_lines(pitch=37, height=22):
+    """Líneas reales del ticket en coordenadas de la imagen completa, de arriba abajo"""
+    lines = []
+    for index, y1 in enumerate(range(30, HEIGHT - height, pitch)):
+        lines.append({'text': f'ARTICULO {index:03d} {index * 1.25:.2f}', 'score': 0.9,
+                      'box': [40 + index % 7, y1, 700 - index % 5, y1 + height]})
+    return lines
+
+def detect(lines, tile, jitter):
+    """Lo que vería el detector en la franja `tile` = (y1, y2)"""
+    y1, y2 = tile
+    detected = []
+    for line in lines:
+        x1, ly1, x2, ly2 = line['box']
+        if ly2 <= y1 or ly1 >= y2:
+            continue
+        if ly1 >= y1 and ly2 <= y2:
+            detected.append({'text': line['text'], 'score': line['score'] + jitter / 100,
+                             'box': [x1 + jitter, ly1 - y1 + jitter, x2 + jitter, ly2 - y1 + jitter]})
+        else:
+            # Partida por el corte: caja recortada al borde y solo parte del texto
+            detected.append({'text': line['text'][:6], 'score': 0.6,
+                             'box': [x1, max(ly1, y1) - y1, x2, min(ly2, y2) - y1]})
+    return detected
+
+def tiled_lines(lines, tiles):
+    return [detect(lines, tile, jitter=index % 2) for index, tile in enumerate(tiles)]
+
+def test_plan_covers_image_with_overlap():
+    tiles = plan_tiles(HEIGHT, WIDTH, min_aspect=3.0, tile_aspect=1.5, overlap=0.2)
+    assert len(tiles) > 1
+    assert tiles[0][0] == 0 and tiles[-1][1] == HEIGHT
+    assert all(y2 - y1 == int(WIDTH * 1.5) for y1, y2 in tiles)
+    for (_, previous_end), (start, _) in zip(tiles, tiles[1:]):
+        assert previous_end - start >= int(WIDTH * 1.5 * 0.2), (previous_end, start)
+
+def test_plan_single_tile_for_normal_images():
+    assert plan_tiles(1754, 1240) == [(0, 1754)]
+    assert plan_tiles(2000, 800) == [(0, 2000)]  # 2,5:1, por debajo de min_aspect
+    assert plan_tiles(6000, 800, min_aspect=0) == [(0, 6000)]
+
+def test_each_line_once_in_original_coordinates():
+    lines = receipt_lines()
+    tiles = plan_tiles(HEIGHT, WIDTH)
+    tile_lines = tiled_lines(lines, tiles)
+    # Hay líneas repetidas en los solapamientos y líneas partidas por los cortes
+    assert sum(map(len, tile_lines)) > len(lines)
+    assert any(line['score'] == 0.6 for detected in tile_lines for line in detected)
+
+    merged = merge_lines(tile_lines, tiles)
+    assert [line['text'] for line in merged] == [line['text'] for line in lines]
+    for line, original in zip(merged, lines):
+        # Coordenadas de la imagen completa (con el píxel de ruido de las franjas impares)
+        assert all(abs(a - b) <= 1 for a, b in zip(line['box'], original['box'])), (line, original)
+
+def test_cut_lines_replaced_by_whole_copy():
+    lines = receipt_lines()
+    tiles = plan_tiles(HEIGHT, WIDTH)
+    merged = merge_lines(tiled_lines(lines, tiles), tiles)
+    # Ninguna lectura partida sobrevive: todas las líneas tienen su texto completo
+    assert all(line['score'] != 0.6 for line in merged)
+    edges = [y1 for y1, _ in tiles[1:]] + [y2 for _, y2 in tiles[:-1]]
+    cut = [line for line in lines if any(line['box'][1] < edge < line['box'][3] for edge in edges)]
+    assert cut, 'el ticket de prueba debe tener líneas cruzando los cortes'
+    texts = [line['text'] for line in merged]
+    assert all(texts.count(line['text']) == 1 for line in cut)
+
+def test_overlap_duplicate_keeps_best_reading():
+    tiles = [(0, 100), (60, 160)]
+    upper = [{'text': 'TOTAL 4O,50', 'score': 0.7, 'box': [10, 70, 200, 90]}]
+    lower = [{'text': 'TOTAL 40,50', 'score': 0.95, 'box': [11, 11, 201, 31]}]
+    assert merge_lines([upper, lower], tiles) == [{'text': 'TOTAL 40,50', 'score': 0.95, 'box': [11, 71, 201, 91]}]
+    # Con la de más confianza arriba se conserva esa
+    upper[0]['score'] = 0.99
+    assert merge_lines([upper, lower], tiles) == [{'text': 'TOTAL 4O,50', 'score': 0.99, 'box': [10, 70, 200, 90]}]
+
+def test_lines_without_box_kept():
+    tiles = [(0, 100), (60, 160)]
+    merged = merge_lines([[{'text': 'A', 'score': 0.9, 'box': None}],
+                          [{'text': 'B', 'score': 0.9, 'box': None}]], tiles)
+    assert [line['text'] for line in merged] == ['A', 'B']
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f'✅ {name}')
@@ -0,0 +1,88 @@
+"""
+Troceado en franjas solapadas de tickets muy largos.
+
+Un ticket de supermercado fotografiado entero puede medir 800x6000 px. El
+detector redimensiona la entrada completa, así que o encoge el texto hasta
+hacerlo ilegible o procesa un lienzo enorme. Las imágenes mucho más altas que
+anchas se parten en franjas horizontales con la proporción de `tile_aspect` y
+un solapamiento `overlap`, se reconocen como un lote y las líneas de cada
+franja se devuelven a coordenadas de la imagen completa:
+
+- una línea que toca un corte interior está partida; se descarta porque la
+  franja vecina la contiene entera gracias al solapamiento
+- una línea que aparece entera en dos franjas vecinas se queda una vez (la de
+  mayor confianza), según el solapamiento de sus cajas
+
+Las franjas son vistas de la imagen (sin copia), así que la memoria adicional
+es la del lote del detector, acotada por el tamaño de franja.
+"""
+import numpy as np
+
+def plan_tiles(height, width, min_aspect=3.0, tile_aspect=1.5, overlap=0.2):
+    """
+    Franjas [(y1, y2), ...] que cubren la imagen con un solapamiento de `overlap`
+    (fracción de la altura de franja). Una sola franja si la imagen no es al menos
+    `min_aspect` veces más alta que ancha
+    """
+    tile_height = max(1, int(width * tile_aspect))
+    if min_aspect <= 0 or height < min_aspect * width or height <= tile_height:
+        return [(0, height)]
+    step = max(1, int(tile_height * (1.0 - overlap)))
+    count = int(np.ceil((height - tile_height) / step)) + 1
+    # Repartir los inicios de forma uniforme: la última franja acaba justo en el borde
+    starts = np.linspace(0, height - tile_height, count).round().astype(int)
+    return [(int(start), int(start) + tile_height) for start in starts]
+
+def split(image, tiles):
+    """Vistas de `image` para cada franja (filas contiguas: no se copia nada)"""
+    return [image[y1:y2] for y1, y2 in tiles]
+
+def _iou_matrix(a, b):
+    """IoU entre cada caja de `a` (N x 4) y cada caja de `b` (M x 4)"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1.0)
+
+def merge_lines(tile_lines, tiles, edge_margin=4, iou_threshold=0.5):
+    """
+    Une las líneas {'text', 'score', 'box'} de cada franja en una sola lista con
+    cajas en coordenadas de la imagen completa, sin las líneas partidas por los
+    cortes ni los duplicados de las zonas solapadas. Las líneas sin caja se
+    conservan tal cual (no hay geometría con la que deduplicarlas)
+    """
+    merged = []
+    previous = []  # índices en `merged` de las líneas con caja de la franja anterior
+    last = len(tiles) - 1
+    for index, (lines, (y1, y2)) in enumerate(zip(tile_lines, tiles)):
+        current = []
+        for line in lines:
+            box = line.get('box')
+            if box is None:
+                merged.append(line)
+                continue
+            # Cortada por un corte interior: la franja vecina la tiene entera
+            if index > 0 and box[1] <= edge_margin:
+                continue
+            if index < last and box[3] >= (y2 - y1) - edge_margin:
+                continue
+            line = dict(line, box=[box[0], box[1] + y1, box[2], box[3] + y1])
+            if previous:
+                candidates = np.asarray([merged[i]['box'] for i in previous], dtype=np.float32)
+                iou = _iou_matrix(np.asarray([line['box']], dtype=np.float32), candidates)[0]
+                best = int(np.argmax(iou))
+                if iou[best] >= iou_threshold:
+                    # Duplicado del solapamiento: quedarse con la lectura de más confianza
+                    kept = merged[previous[best]]
+                    if (line['score'] or 0.0) > (kept['score'] or 0.0):
+                        merged[previous[best]] = line
+                    continue
+            current.append(len(merged))
+            merged.append(line)
+        previous = current
+    return merged
@@ -33,6 +33,16 @@ db.exec(`
   )
 `);
 
+// Imágenes ya ingeridas por la ingesta masiva (ocr_service/ingest.py), por hash SHA-256
+db.exec(`
+  CREATE TABLE IF NOT EXISTS facturas_ocr (
+    image_hash TEXT PRIMARY KEY,
+    factura_id TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (factura_id) REFERENCES facturas(id) ON DELETE CASCADE
+  )
+`);
+
 module.exports = db;
 
 
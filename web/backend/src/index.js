@@ -248,6 +248,64 @@ app.get('/api/sync', (req, res) => {
 
 // Configuración del servicio OCR
 const OCR_SERVICE_URL = process.env.OCR_SERVICE_URL || 'http://localhost:5000';
+// Si el servicio OCR corre en el mismo host con OCR_SPOOL_DIR apuntando a uploads/,
+// se le envía solo el nombre del archivo y lo lee directamente del disco (sin base64)
+const OCR_SHARED_SPOOL = process.env.OCR_SHARED_SPOOL === 'true';
+// Presupuesto que se pide al servicio OCR: algo menos que el timeout de axios (120 s)
+// para que devuelva un resultado parcial antes de que aquí se cancele la petición
+const OCR_DEADLINE_MS = parseInt(process.env.OCR_DEADLINE_MS || '110000', 10);
+
+// Llama al servicio Python enviando la imagen en base64 (despliegues remotos)
+// `options` se añade al cuerpo JSON (p. ej. { fields: 'total,date' }) y `headers` a la petición
+function postImageBase64(file, options = {}, headers = {}) {
+  const fs = require('fs');
+  const imageBuffer = fs.readFileSync(file.path);
+  const base64Image = imageBuffer.toString('base64');
+  const mimeType = file.mimetype || 'image/jpeg';
+  const dataUri = `data:${mimeType};base64,${base64Image}`;
+
+  console.log(`📤 Enviando a servicio Python: ${OCR_SERVICE_URL}/ocr/process`);
+  console.log(`📤 Tamaño base64: ${dataUri.length} caracteres`);
+
+  return axios.post(`${OCR_SERVICE_URL}/ocr/process`, {
+    ...options,
+    image: dataUri
+  }, {
+    timeout: 120000, // 120 segundos timeout (2 minutos) - OCR puede tardar con imágenes grandes
+    headers: {
+      ...headers,
+      'Content-Type': 'application/json'
+    }
+  });
+}
+
+// Llama al servicio Python pasando la ruta del archivo en el spool compartido
+async function postImage(file, options = {}, headers = {}) {
+  if (!OCR_SHARED_SPOOL) {
+    return postImageBase64(file, options, headers);
+  }
+
+  console.log(`📤 Enviando ruta en spool a servicio Python: ${file.filename}`);
+  try {
+    return await axios.post(`${OCR_SERVICE_URL}/ocr/process`, {
+      ...options,
+      imagePath: file.filename
+    }, {
+      timeout: 120000,
+      headers: {
+        ...headers,
+        'Content-Type': 'application/json'
+      }
+    });
+  } catch (error) {
+    // El servicio no comparte el directorio (p. ej. desplegado en otro host): usar base64
+    if (error.response && error.response.data && error.response.data.code === 'SPOOL_PATH_INVALID') {
+      console.log('⚠️ Spool no disponible en el servicio OCR, reintentando con base64');
+      return postImageBase64(file, options, headers);
+    }
+    throw error;
+  }
+}
 
 // Procesar imagen con PaddleOCR
 app.post('/api/ocr/process', upload.single('image'), async (req, res) => {
@@ -262,26 +320,42 @@ app.post('/api/ocr/process', upload.single('image'), async (req, res) => {
 
     console.log(`📷 Procesando archivo: ${req.file.filename}, tamaño: ${req.file.size} bytes`);
 
-    // Convertir archivo a base64
     const fs = require('fs');
-    const imageBuffer = fs.readFileSync(req.file.path);
-    const base64Image = imageBuffer.toString('base64');
-    const mimeType = req.file.mimetype || 'image/jpeg';
-    const dataUri = `data:${mimeType};base64,${base64Image}`;
-
-    console.log(`📤 Enviando a servicio Python: ${OCR_SERVICE_URL}/ocr/process`);
-    console.log(`📤 Tamaño base64: ${dataUri.length} caracteres`);
 
     // Llamar al servicio Python de PaddleOCR
     try {
-      const response = await axios.post(`${OCR_SERVICE_URL}/ocr/process`, {
-        image: dataUri
-      }, {
-        timeout: 120000, // 120 segundos timeout (2 minutos) - OCR puede tardar con imágenes grandes
-        headers: {
-          'Content-Type': 'application/json'
-        }
-      });
+      // ?fields=... selecciona los campos de la respuesta (por defecto, versión compacta)
+      const options = {
+        deadlineMs: req.query.deadlineMs ? parseInt(req.query.deadlineMs, 10) : OCR_DEADLINE_MS
+      };
+      if (req.query.fields) {
+        options.fields = req.query.fields;
+      }
+      // ?lang=ca|pt|fr|en: idioma del documento (por defecto, el del servicio OCR)
+      if (req.query.lang) {
+        options.lang = req.query.lang;
+      }
+      // ?skipQualityCheck=true: procesar aunque la imagen no pase el control de calidad
+      if (req.query.skipQualityCheck) {
+        options.skipQualityCheck = req.query.skipQualityCheck === 'true';
+      }
+      // ?structureModules=table|none: submódulos de PP-StructureV3 para esta petición
+      if (req.query.structureModules) {
+        options.structureModules = req.query.structureModules;
+      }
+      // ?segment=true: foto con varios tickets, un resultado por ticket en `receipts`
+      // (`data` sigue siendo el del ticket más grande, así que el frontend no cambia)
+      if (req.query.segment === 'true') {
+        options.segment = true;
+      }
+      // ?mode=progressive: respuesta inmediata con los campos del OCR y jobId para la estructura
+      // (el flujo SSE solo se ofrece directamente desde el servicio Python; no se combina con segment)
+      if (req.query.mode === 'progressive' && !options.segment) {
+        options.mode = 'progressive';
+      }
+      // Prioridad: 'interactive' (por defecto, un usuario esperando) o 'bulk' (importaciones masivas)
+      const priority = req.query.priority || req.get('X-OCR-Priority') || 'interactive';
+      const response = await postImage(req.file, options, { 'X-OCR-Priority': priority });
 
       console.log(`✅ Respuesta recibida del servicio Python: ${response.status}`);
 
@@ -307,6 +381,16 @@ app.post('/api/ocr/process', upload.single('image'), async (req, res) => {
         console.error('❌ Respuesta del servidor:', ocrError.response.status, ocrError.response.data);
       }
       
+      // Imagen inutilizable (desenfocada, oscura, sin texto...): devolver el motivo al cliente
+      if (ocrError.response && ocrError.response.status === 422) {
+        return res.status(422).json(ocrError.response.data);
+      }
+
+      // El archivo subido no es una imagen válida: error del cliente, no del servicio
+      if (ocrError.response && ocrError.response.data && ocrError.response.data.code === 'INVALID_IMAGE') {
+        return res.status(400).json(ocrError.response.data);
+      }
+
       // Si el servicio OCR no está disponible, devolver error descriptivo
       if (ocrError.code === 'ECONNREFUSED' || ocrError.code === 'ETIMEDOUT') {
         return res.status(503).json({
@@ -323,6 +407,25 @@ app.post('/api/ocr/process', upload.single('image'), async (req, res) => {
   }
 });
 
+// Resultado de la fase de estructura de una petición OCR progresiva
+app.get('/api/ocr/jobs/:jobId', async (req, res) => {
+  try {
+    const response = await axios.get(`${OCR_SERVICE_URL}/ocr/jobs/${encodeURIComponent(req.params.jobId)}`, {
+      params: { wait: req.query.wait, fields: req.query.fields },
+      timeout: 130000
+    });
+    res.json(response.data);
+  } catch (error) {
+    if (error.response) {
+      return res.status(error.response.status).json(error.response.data);
+    }
+    res.status(503).json({
+      error: 'Servicio OCR no disponible',
+      message: error.message
+    });
+  }
+});
+
 // Health check del servicio OCR
 app.get('/api/ocr/health', async (req, res) => {
   try {